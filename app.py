@@ -1,16 +1,26 @@
 import os
-import torch
-torch.classes.__path__ = [os.path.join(torch.__path__[0], torch.classes.__file__)]
 import uuid
+import weakref
+import streamlit as st
 from langchain.schema import Document
 from streamlit_extras.bottom_container import bottom
-from chains.models import load_vector_store, load_rerank
-from graph.graph import create_graph, stream_graph_updates
+from chains.models import load_session_store
+from graph.graph import get_graph, stream_graph_updates
+from ingest.queue import get_ingestion_queue
 from utils.common import *
+from utils.startup import patch_torch_classes
+from utils.tracing import start_metrics_server
+
+# torch 只在进程内转换 PDF 时才会被导入，已导入时修正 torch.classes 的路径，避免 Streamlit 文件监视报错
+patch_torch_classes()
 
 # 加载 .env 到环境变量
 load_dotenv(verbose=True)
 
+# Streamlit 每次交互都会重新运行脚本，指标服务在进程内只启动一次
+if os.getenv("METRICS_PORT") and start_metrics_server(int(os.getenv("METRICS_PORT"))):
+    print(f"📈 指标服务已启动: http://0.0.0.0:{os.getenv('METRICS_PORT')}/metrics")
+
 # 设置页面配置信息
 st.set_page_config(
     page_title="AI 聊天机器人",
@@ -31,9 +41,6 @@ if "settings" not in st.session_state:
 # 初始化会话ID和向量存储
 if "config" not in st.session_state:
     st.session_state.config = {"configurable": {"thread_id": uuid.uuid4().hex, "vectorstore": None, "rerank": None}}
-# 初始化会话状态变量，创建图
-if "graph" not in st.session_state:
-    st.session_state.graph = create_graph()
 # 初始化对话历史记录
 if "history" not in st.session_state:
     st.session_state.history = []
@@ -44,10 +51,6 @@ st.subheader("我可以帮你:blue[写代码、读文件、联网搜索解决各
 # 定义可选的模型
 model_options = {"通义千问": "Qwen/QwQ-32B", "DeepSeek R1": "deepseek-ai/DeepSeek-R1"}
 
-# 重新创建图
-def rebuild_graph():
-    st.session_state.graph = create_graph()
-
 # 侧边栏设置部分
 with st.sidebar:
     st.header("设置")
@@ -59,7 +62,6 @@ with st.sidebar:
         options=env["AVAILABLE_MODEL_LIST"],
         index=0,
         help="选择 LLM 模型的种类",
-        on_change=rebuild_graph
     )
     # 模型温度滑动条
     env['TEMPERATURE'] = st.slider(
@@ -80,10 +82,11 @@ with st.sidebar:
     st.session_state.settings["temperature"] = env['TEMPERATURE']
 
     if not st.session_state.config["configurable"]["vectorstore"]:
-        st.session_state.config["configurable"]["vectorstore"] = load_vector_store(st.session_state.embedding_model_selectbox)
-
-    if not st.session_state.config["configurable"]["rerank"]:
-        st.session_state.config["configurable"]["rerank"] = load_rerank()
+        vectorstore = load_session_store(st.session_state.embedding_model_selectbox, st.session_state.config["configurable"]["thread_id"])
+        # Streamlit 没有会话结束的回调：会话状态被回收时释放命名空间；空闲超过 SHARED_STORE_TTL 的命名空间由共享存储释放，
+        # 之后再提问时导入队列会重新导入文件
+        weakref.finalize(vectorstore, vectorstore.shared.release, vectorstore.name)
+        st.session_state.config["configurable"]["vectorstore"] = vectorstore
     st.divider()
 
     # 自定义链接
@@ -100,6 +103,22 @@ with bottom():
     # 聊天输入框
     question = st.chat_input('输入您要询问的内容，shift + enter 换行')
 
+# 文件上传后立即提交后台导入任务，提问时只检索已经导入的部分
+if uploaded_file:
+    if not st.session_state.settings["uploaded"]:
+        file_path = upload_pdf(uploaded_file)
+        job = get_ingestion_queue().submit(file_path, st.session_state.config["configurable"]["vectorstore"])
+        st.session_state.settings["file_path"] = file_path
+        st.session_state.settings["ingest_job_id"] = job.job_id
+        st.session_state.settings["uploaded"] = True
+    elif os.path.basename(st.session_state.settings["file_path"]) != uploaded_file.name:
+        st.error("请刷新页面后再上传文件")
+    job = get_ingestion_queue().get(st.session_state.settings["ingest_job_id"])
+    if job and not job.finished:
+        st.caption(f"📄 文件正在后台导入：{job.stats.summary()}")
+    elif job and job.status == "failed":
+        st.error(f"文件导入失败：{job.error}")
+
 # 显示历史对话内容
 for message in st.session_state.history:
     with st.chat_message(message["role"]):
@@ -111,32 +130,25 @@ if question:
     with st.chat_message("user"):
         st.markdown(question)
 
-    # 准备请求状态
-    state = []
+    # 准备请求状态，模型和温度随请求通过 config 传入，所有会话共用同一个图
     message = [{"role": "system", "content": f"当前日期是：{get_current_time()}"}, {"role": "user", "content": question}]
     if st.session_state.settings["type"] == "code":
         # 代码模式使用专门的代码模型
-        state = {"model_name": env["CODE_MODEL"], "temperature": st.session_state.settings["temperature"],
-                 "messages": message, "type": "chat", "documents": [],  "search_num": env["SEARCH_NUN"]}
+        model_name, mode = env["CODE_MODEL"], "chat"
     else:
         # 其他模式使用选择的模型
-        state = {"model_name": st.session_state.settings["model_name"], "temperature": st.session_state.settings["temperature"],
-                 "messages": message, "type": st.session_state.settings["type"], "documents": [], "search_num": env["SEARCH_NUN"]}
+        model_name, mode = st.session_state.settings["model_name"], st.session_state.settings["type"]
+    state = {"messages": message, "type": mode, "documents": []}
+    config = {"configurable": {**st.session_state.config["configurable"], "model_name": model_name,
+                               "temperature": st.session_state.settings["temperature"], "search_num": env["SEARCH_NUN"]}}
 
-    # 处理文件上传
+    # 处理文件上传，导入任务已在上传时提交，这里只把文件加入请求
     if uploaded_file:
         state["type"] = "file"
-        if not st.session_state.settings["uploaded"]:
-            # 保存上传的文件
-            file_path = upload_pdf(uploaded_file)
-            # 添加文档到请求
-            state["documents"].append(Document(page_content=file_path))
-            st.session_state.settings["uploaded"] = True
-        else:
-            st.error("请刷新页面后再上传文件")
+        state["documents"].append(Document(page_content=st.session_state.settings["file_path"]))
 
     # 获取AI回答并以流式方式显示
-    answer = st.chat_message("assistant").write_stream(stream_graph_updates(st.session_state.graph, state, st.session_state.config))
+    answer = st.chat_message("assistant").write_stream(stream_graph_updates(get_graph(), state, config))
 
     # 将对话保存到历史记录
     st.session_state.history.append({"role": "user", "content": question})
@@ -0,0 +1,399 @@
+"""
+离线基准测试：启动本地桩服务代替 LLM、嵌入、rerank 和 Tavily，按指定并发驱动图的 chat / websearch / file 三条路径，
+统计端到端延迟、首 token 延迟、各节点耗时和吞吐量，结果保存为 JSON，并可与之前的结果对比。
+
+用法:
+    python -m benchmark.run --routes chat,websearch,file --requests 50 --concurrency 8
+    python -m benchmark.run --mode async --concurrency 64 --baseline benchmark/results/<上一次的结果>.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+import numpy as np
+
+from benchmark.stubs import StubConfig, StubServer
+
+ROUTES = ("chat", "websearch", "file")
+QUESTIONS = (
+    "向量检索的召回率和延迟之间如何权衡？",
+    "请介绍一下 BM25 和向量检索混合的好处",
+    "What is the time to first token of a streaming graph?",
+    "文档中提到的缓存策略有哪些？",
+    "如何减少 rerank 的网络开销",
+    "今天有哪些关于大模型推理优化的新闻？",
+    "How does the ingestion pipeline split markdown files?",
+    "上下文的 token 预算是多少",
+)
+# 与历史结果对比时检查的指标，值越大越差（吞吐量单独处理）
+REGRESSION_METRICS = (("latency", "p50"), ("latency", "p95"), ("ttft", "p50"), ("ttft", "p95"))
+
+
+@dataclass
+class RequestResult:
+    """ 单次请求的测量结果 """
+    route: str
+    latency: float
+    ttft: Optional[float]
+    chunks: int
+    nodes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class NodeTimer:
+    """ 通过 LangChain 回调记录图中每个节点的耗时，节点的运行名称与 `langgraph_node` 元数据相同 """
+
+    def __init__(self):
+        self._starts: dict[Any, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self.durations: dict[str, float] = {}
+
+    def handler(self):
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        timer = self
+
+        class _Handler(BaseCallbackHandler):
+            # 异步运行时也在事件循环中直接调用，不经过线程池，计时更准确
+            run_inline = True
+
+            def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+                node = (metadata or {}).get("langgraph_node")
+                if node and kwargs.get("name") == node:
+                    with timer._lock:
+                        timer._starts[run_id] = (node, time.perf_counter())
+
+            def on_chain_end(self, outputs, *, run_id, **kwargs):
+                timer._finish(run_id)
+
+            def on_chain_error(self, error, *, run_id, **kwargs):
+                timer._finish(run_id)
+
+        return _Handler()
+
+    def _finish(self, run_id) -> None:
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+            if started:
+                node, start = started
+                self.durations[node] = self.durations.get(node, 0.0) + time.perf_counter() - start
+
+
+def _configure_environment(stub_url: str, workdir: str, embedding_model: str) -> None:
+    """ 所有外部接口指向桩服务，存储和缓存放到临时目录，必须在导入项目模块之前调用 """
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "ARK_API_KEY": "benchmark",
+        "ARK_BASE_URL": f"{stub_url}/v1",
+        "RERANK_BASE_URL": f"{stub_url}/v1/rerank",
+        "RERANK_MODEL": "benchmark-reranker",
+        "TAVILY_API_KEY": "tvly-benchmark",
+        "VECTOR_STORE_DIR": os.path.join(workdir, "vector_store"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "CHECKPOINTER": "memory",
+        "ANSWER_CACHE_EMBEDDING_MODEL": embedding_model,
+    })
+    os.environ.setdefault("QUERY_REWRITER", "auto")
+    os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+    os.environ.setdefault("PDF_WORKERS", "0")
+
+
+def _patch_tavily(stub_url: str) -> None:
+    """ Tavily 的接口地址是模块常量，没有对应的环境变量 """
+    import langchain_community.utilities.tavily_search as tavily_search
+    tavily_search.TAVILY_API_URL = stub_url
+
+
+def _write_corpus(path: str, paragraphs: int) -> None:
+    """ 生成用于文件问答的语料，段落内容覆盖 QUESTIONS 中的主题 """
+    topics = ["向量检索", "BM25", "rerank", "缓存策略", "token 预算", "ingestion pipeline", "streaming", "知识库"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# 基准测试语料\n\n")
+        for i in range(paragraphs):
+            topic = topics[i % len(topics)]
+            if i % 20 == 0:
+                f.write(f"## 第 {i // 20 + 1} 章 {topic}\n\n")
+            f.write(f"第 {i + 1} 段讨论{topic}。{topic}的召回率、延迟和吞吐量需要权衡，"
+                    f"不同的参数会影响{topic}的效果。This paragraph describes {topic} in detail, "
+                    f"including latency, throughput and memory usage of {topic}.\n\n")
+
+
+def _summary(values: list[float]) -> dict:
+    if not values:
+        return {}
+    array = np.asarray(values, dtype=np.float64)
+    return {
+        "count": len(values),
+        "mean": float(array.mean()),
+        "p50": float(np.percentile(array, 50)),
+        "p95": float(np.percentile(array, 95)),
+        "p99": float(np.percentile(array, 99)),
+        "max": float(array.max()),
+    }
+
+
+class Benchmark:
+    """ 按路径和并发驱动图，收集每个请求的测量结果 """
+
+    def __init__(self, args, stubs: StubServer, workdir: str):
+        from chains.models import load_vector_store
+        from graph.graph import get_graph
+
+        self.args = args
+        self.stubs = stubs
+        self.graph = get_graph()
+        self.corpus_path = os.path.join(workdir, "corpus.md")
+        _write_corpus(self.corpus_path, args.corpus_paragraphs)
+        self.vector_store = load_vector_store(args.embedding_model, collection="benchmark")
+        self.ingest_seconds = self._ingest()
+
+    def _ingest(self) -> float:
+        """ 测试开始前导入语料，文件问答请求只测量检索和生成 """
+        from ingest.queue import get_ingestion_queue
+
+        start = time.perf_counter()
+        job = get_ingestion_queue().submit(self.corpus_path, self.vector_store)
+        job.wait()
+        if job.status != "done":
+            raise RuntimeError(f"corpus ingestion failed: {job.error}")
+        return time.perf_counter() - start
+
+    def _request(self, route: str, index: int) -> tuple[dict, dict]:
+        from langchain_core.documents import Document
+
+        question = QUESTIONS[index % len(QUESTIONS)]
+        if self.args.unique_questions:
+            # 避免改写、rerank 和答案缓存在重复问题上命中
+            question = f"{question} ({index})"
+        state = {"messages": [{"role": "user", "content": question}], "type": route, "documents": []}
+        if route == "file":
+            state["documents"].append(Document(page_content=self.corpus_path))
+        config = {"configurable": {"thread_id": uuid.uuid4().hex, "vectorstore": self.vector_store,
+                                   "model_name": self.args.model, "temperature": 0.0, "search_num": 3}}
+        return state, config
+
+    def _record(self, route: str, start: float, first: Optional[float], chunks: int, timer: NodeTimer,
+                error: Optional[BaseException]) -> RequestResult:
+        return RequestResult(route, time.perf_counter() - start, first - start if first else None, chunks,
+                             dict(timer.durations), repr(error) if error else None)
+
+    def run_sync(self, route: str, index: int) -> RequestResult:
+        from graph.graph import stream_graph_updates
+
+        state, config = self._request(route, index)
+        timer = NodeTimer()
+        config["callbacks"] = [timer.handler()]
+        start, first, chunks, error = time.perf_counter(), None, 0, None
+        try:
+            for chunk in stream_graph_updates(self.graph, state, config):
+                if chunk and first is None:
+                    first = time.perf_counter()
+                chunks += 1
+        except Exception as e:
+            error = e
+        return self._record(route, start, first, chunks, timer, error)
+
+    async def run_async(self, route: str, index: int) -> RequestResult:
+        from graph.graph import astream_graph_updates
+
+        state, config = self._request(route, index)
+        timer = NodeTimer()
+        config["callbacks"] = [timer.handler()]
+        start, first, chunks, error = time.perf_counter(), None, 0, None
+        try:
+            async for chunk in astream_graph_updates(self.graph, state, config):
+                if chunk and first is None:
+                    first = time.perf_counter()
+                chunks += 1
+        except Exception as e:
+            error = e
+        return self._record(route, start, first, chunks, timer, error)
+
+    def run_routes(self, routes: list[str]) -> dict[str, tuple[list[RequestResult], float]]:
+        """ 依次测试每条路径，每条路径以固定并发发送 `requests` 个请求，返回每个请求的结果和总耗时 """
+        total, concurrency = self.args.requests, self.args.concurrency
+        if self.args.mode == "sync":
+            measured = {}
+            for route in routes:
+                print(f"🚀 {route}: {total} 个请求，并发 {concurrency}（sync）")
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    results = list(executor.map(lambda i: self.run_sync(route, i), range(total)))
+                measured[route] = (results, time.perf_counter() - start)
+            return measured
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            measured = {}
+            for route in routes:
+                print(f"🚀 {route}: {total} 个请求，并发 {concurrency}（async）")
+
+                async def one(i):
+                    async with semaphore:
+                        return await self.run_async(route, i)
+
+                start = time.perf_counter()
+                results = await asyncio.gather(*(one(i) for i in range(total)))
+                measured[route] = (list(results), time.perf_counter() - start)
+            return measured
+
+        return asyncio.run(main())
+
+    def warmup(self) -> None:
+        """ 建立连接池、加载模型客户端，避免首个请求的冷启动计入结果 """
+        for route in self.args.routes:
+            self.run_sync(route, 0)
+
+
+def _route_report(results: list[RequestResult], elapsed: float) -> dict:
+    ok = [r for r in results if r.error is None]
+    nodes = {}
+    for result in ok:
+        for node, seconds in result.nodes.items():
+            nodes.setdefault(node, []).append(seconds)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_samples": sorted({r.error for r in results if r.error})[:3],
+        "elapsed": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency": _summary([r.latency for r in ok]),
+        "ttft": _summary([r.ttft for r in ok if r.ttft is not None]),
+        "chunks_per_request": float(np.mean([r.chunks for r in ok])) if ok else 0.0,
+        "nodes": {node: _summary(values) for node, values in sorted(nodes.items())},
+    }
+
+
+def _git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _print_report(report: dict) -> None:
+    for route, stats in report["routes"].items():
+        latency, ttft = stats["latency"], stats["ttft"]
+        print(f"\n📊 {route}: {stats['requests']} 个请求，{stats['errors']} 个失败，吞吐量 {stats['throughput_rps']:.2f} req/s")
+        if latency:
+            print(f"  端到端延迟  p50 {latency['p50'] * 1000:8.1f} ms  p95 {latency['p95'] * 1000:8.1f} ms  p99 {latency['p99'] * 1000:8.1f} ms")
+        if ttft:
+            print(f"  首 token    p50 {ttft['p50'] * 1000:8.1f} ms  p95 {ttft['p95'] * 1000:8.1f} ms  p99 {ttft['p99'] * 1000:8.1f} ms")
+        for node, summary in stats["nodes"].items():
+            print(f"  节点 {node:<17} p50 {summary['p50'] * 1000:8.1f} ms  p95 {summary['p95'] * 1000:8.1f} ms")
+        for sample in stats["error_samples"]:
+            print(f"  ❌ {sample}")
+    print(f"\n🔌 桩服务调用次数: {report['stub_calls']}")
+
+
+def _compare(report: dict, baseline_path: str, threshold: float) -> bool:
+    """ 与之前的结果对比，指标变差超过 `threshold` 时视为回归，返回是否存在回归 """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n🔍 与 {baseline_path}（{baseline.get('revision')}）对比:")
+    regressed = False
+    for route, stats in report["routes"].items():
+        old = baseline.get("routes", {}).get(route)
+        if not old:
+            continue
+        rows = [(f"{metric}.{key}", old.get(metric, {}).get(key), stats.get(metric, {}).get(key), False)
+                for metric, key in REGRESSION_METRICS]
+        rows.append(("throughput_rps", old.get("throughput_rps"), stats.get("throughput_rps"), True))
+        for name, before, after, higher_is_better in rows:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            flag = "⚠️ 回归" if worse > threshold else ""
+            regressed |= worse > threshold
+            print(f"  {route:<10} {name:<16} {before:10.4f} -> {after:10.4f}  {change:+7.1%} {flag}")
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="使用本地桩服务的离线基准测试")
+    parser.add_argument("--routes", default="chat,websearch,file", help="测试的路径，逗号分隔：chat / websearch / file")
+    parser.add_argument("--requests", type=int, default=40, help="每条路径的请求数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="sync 使用 stream_graph_updates，async 使用 astream_graph_updates")
+    parser.add_argument("--model", default="benchmark-llm", help="请求中的 LLM 模型名称")
+    parser.add_argument("--embedding-model", default="doubao-embedding-benchmark", help="嵌入模型名称，doubao 前缀走 ARK 客户端")
+    parser.add_argument("--corpus-paragraphs", type=int, default=2000, help="文件问答语料的段落数")
+    parser.add_argument("--unique-questions", action=argparse.BooleanOptionalAction, default=True, help="每个请求使用不同的问题")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="LLM 首 token 延迟（秒）")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50, help="LLM 输出速率")
+    parser.add_argument("--llm-answer-tokens", type=int, default=200, help="每次回答的 token 数")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="嵌入请求延迟（秒）")
+    parser.add_argument("--rerank-latency", type=float, default=0.15, help="rerank 请求延迟（秒）")
+    parser.add_argument("--search-latency", type=float, default=0.8, help="Tavily 搜索延迟（秒）")
+    parser.add_argument("--output", default="benchmark/results", help="结果保存目录")
+    parser.add_argument("--baseline", help="用于对比的历史结果文件")
+    parser.add_argument("--regression-threshold", type=float, default=0.1, help="指标变差超过该比例视为回归")
+    args = parser.parse_args()
+    args.routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    unknown = set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    stub_config = StubConfig(
+        llm_ttft=args.llm_ttft,
+        llm_tokens_per_second=args.llm_tokens_per_second,
+        llm_answer_tokens=args.llm_answer_tokens,
+        embedding_latency=args.embedding_latency,
+        rerank_latency=args.rerank_latency,
+        search_latency=args.search_latency,
+    )
+    stubs = StubServer(stub_config).start()
+    workdir = tempfile.mkdtemp(prefix="langgraph-benchmark-")
+    _configure_environment(stubs.url, workdir, args.embedding_model)
+    _patch_tavily(stubs.url)
+    print(f"🔌 桩服务: {stubs.url}，工作目录: {workdir}")
+
+    try:
+        benchmark = Benchmark(args, stubs, workdir)
+        print(f"📄 语料导入耗时 {benchmark.ingest_seconds:.2f}s，共 {len(benchmark.vector_store)} 个 chunk")
+        benchmark.warmup()
+        stubs.calls.clear()
+        routes = {route: _route_report(*measured) for route, measured in benchmark.run_routes(args.routes).items()}
+    finally:
+        stubs.stop()
+
+    report = {
+        "revision": _git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "stubs": asdict(stub_config),
+        "ingest_seconds": benchmark.ingest_seconds,
+        "stub_calls": dict(stubs.calls),
+        "routes": routes,
+    }
+    _print_report(report)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{report['revision']}-{args.mode}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 结果已保存到 {path}")
+
+    if args.baseline and _compare(report, args.baseline, args.regression_threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
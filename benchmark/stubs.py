@@ -0,0 +1,186 @@
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# 生成回答时使用的词表，中英文混合，与真实回答的 token 估算接近
+_WORDS = ("向量", "检索", "模型", "文档", "问题", "答案", "上下文", "缓存", "latency", "token", "graph", "search",
+          "的", "是", "在", "和", "，", "。")
+
+
+@dataclass
+class StubConfig:
+    """ 桩服务的延迟和速率配置，时间单位为秒 """
+    llm_ttft: float = 0.3               # LLM 首 token 延迟
+    llm_tokens_per_second: float = 50   # LLM 输出速率
+    llm_answer_tokens: int = 200        # 每次回答的 token 数
+    llm_keyword_tokens: int = 12        # 非流式调用（关键词提取、摘要）的 token 数
+    embedding_latency: float = 0.05     # 每次嵌入请求的延迟
+    embedding_per_text: float = 0.001   # 每条文本额外的嵌入延迟
+    embedding_dim: int = 1024           # 嵌入向量维度
+    rerank_latency: float = 0.15        # 每次 rerank 请求的延迟
+    search_latency: float = 0.8         # 每次 Tavily 搜索的延迟
+    jitter: float = 0.1                 # 延迟的随机抖动比例
+
+
+def _bigrams(text: str) -> list[str]:
+    text = "".join(text.lower().split())
+    return [text[i:i + 2] for i in range(max(1, len(text) - 1))]
+
+
+def embed_text(text: str, dim: int) -> np.ndarray:
+    """ 确定性的伪嵌入：字符二元组哈希到 `dim` 个桶后归一化，文本越相近向量越相似 """
+    vector = np.zeros(dim, dtype=np.float32)
+    for gram in _bigrams(text):
+        digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _overlap(query: str, text: str) -> float:
+    grams = set(_bigrams(query))
+    return len(grams & set(_bigrams(text))) / len(grams) if grams else 0.0
+
+
+class StubServer:
+    """
+    在后台线程中运行的本地桩服务，模拟以下接口:
+
+    - OpenAI 兼容的 `/v1/chat/completions`（支持流式 SSE）和 `/v1/embeddings`（同时用于 ARK）
+    - SiliconFlow 兼容的 `/v1/rerank`
+    - Tavily 的 `/search`
+
+    延迟和输出速率由 `StubConfig` 控制，每个接口的调用次数记录在 `calls` 中。
+    """
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.host = host
+        self.port = port
+        self.calls: Counter = Counter()
+        self._server = None
+        self._thread = None
+        self.app = Starlette(routes=[
+            Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/v1/embeddings", self.embeddings, methods=["POST"]),
+            Route("/v1/rerank", self.rerank, methods=["POST"]),
+            Route("/search", self.search, methods=["POST"]),
+        ])
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            await asyncio.sleep(seconds * (1 + random.uniform(-self.config.jitter, self.config.jitter)))
+
+    def _answer_tokens(self, count: int) -> list[str]:
+        return [random.choice(_WORDS) for _ in range(count)]
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        self.calls["chat"] += 1
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        # 不要求流式输出的调用（关键词提取、摘要）只返回少量 token
+        streaming = bool(body.get("stream"))
+        tokens = self._answer_tokens(self.config.llm_answer_tokens if streaming else self.config.llm_keyword_tokens)
+
+        if not streaming:
+            await self._sleep(self.config.llm_ttft + len(tokens) / self.config.llm_tokens_per_second)
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        async def stream():
+            await self._sleep(self.config.llm_ttft)
+            for token in tokens:
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await self._sleep(1 / self.config.llm_tokens_per_second)
+            done = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def embeddings(self, request: Request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        self.calls["embedding"] += 1
+        self.calls["embedding_texts"] += len(inputs)
+        await self._sleep(self.config.embedding_latency + self.config.embedding_per_text * len(inputs))
+        data = []
+        for index, text in enumerate(inputs):
+            # OpenAIEmbeddings 可能传入 token id 列表
+            vector = embed_text(text if isinstance(text, str) else " ".join(map(str, text)), self.config.embedding_dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return JSONResponse({"object": "list", "data": data, "model": body.get("model", "stub"),
+                             "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    async def rerank(self, request: Request):
+        body = await request.json()
+        self.calls["rerank"] += 1
+        self.calls["rerank_documents"] += len(body.get("documents", []))
+        await self._sleep(self.config.rerank_latency)
+        query = body.get("query", "")
+        scores = [(_overlap(query, doc), index) for index, doc in enumerate(body.get("documents", []))]
+        scores.sort(reverse=True)
+        top_n = body.get("top_n") or len(scores)
+        return JSONResponse({"id": uuid.uuid4().hex,
+                             "results": [{"index": index, "relevance_score": score} for score, index in scores[:top_n]]})
+
+    async def search(self, request: Request):
+        body = await request.json()
+        self.calls["search"] += 1
+        await self._sleep(self.config.search_latency)
+        query = body.get("query", "")
+        results = [{"title": f"{query} - 结果 {i + 1}", "url": f"https://example.com/{uuid.uuid4().hex[:8]}",
+                    "content": " ".join(self._answer_tokens(80)), "score": 1.0 - i * 0.1}
+                   for i in range(int(body.get("max_results", 5)))]
+        return JSONResponse({"query": query, "answer": None, "images": [], "results": results, "response_time": 0.0})
+
+    def start(self) -> "StubServer":
+        """ 在后台线程中启动服务，端口为 0 时使用随机空闲端口 """
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="benchmark-stubs", daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("stub server failed to start")
+            time.sleep(0.01)
+        self.port = self._server.servers[0].sockets[0].getsockname()[1]
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+# 归一化问题时去掉的首尾标点（含全角标点）
+_PUNCTUATION = " \t\r\n.,!?;:'\"，。！？；：、…“”‘’（）()"
+
+
+@dataclass
+class _Entry:
+    partition: tuple
+    vector: np.ndarray
+    question: str
+    answer: str
+    created_at: float
+
+
+def normalize_question(question: str) -> str:
+    """
+    归一化问题文本：去掉首尾空白和标点、合并连续空白、转为小写
+
+    参数:
+        question (str): 原始问题
+
+    返回:
+        str: 归一化后的问题
+    """
+    return re.sub(r"\s+", " ", question.strip(_PUNCTUATION)).lower()
+
+
+def documents_fingerprint(documents: Optional[list]) -> str:
+    """
+    计算文档集合的指纹，文档内容不同的请求不会命中同一条缓存
+
+    参数:
+        documents (Optional[list]): 文档列表
+
+    返回:
+        str: 文档集合的哈希值，没有文档时为空字符串
+    """
+    if not documents:
+        return ""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update((doc.page_content if isinstance(doc, Document) else str(doc)).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存。
+
+    缓存按 (模型名称, 温度分桶, 对话类型, 文档集合指纹) 分区，分区内用归一化问题的嵌入向量做相似度匹配，
+    余弦相似度不低于 `threshold` 时直接返回缓存的答案。条目超过 `ttl` 秒失效，总数超过 `max_entries`
+    时淘汰最久未命中的条目。
+    """
+
+    def __init__(
+            self,
+            embeddings,
+            threshold: float = 0.95,
+            ttl: float = 3600,
+            max_entries: int = 1000,
+            temperature_step: float = 0.1,
+    ):
+        """
+        参数:
+            embeddings: 用于嵌入问题的模型，需要提供 `embed_query` 方法
+            threshold (float): 命中所需的最低余弦相似度
+            ttl (float): 条目有效期（秒）
+            max_entries (int): 最多缓存的答案数量
+            temperature_step (float): 温度分桶的步长
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.temperature_step = temperature_step
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._partitions: dict[tuple, list[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _partition(self, model_name: str, temperature: float, mode: str, documents: Optional[list]) -> tuple:
+        bucket = round(float(temperature) / self.temperature_step) if self.temperature_step else float(temperature)
+        return model_name, bucket, mode, documents_fingerprint(documents)
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: str) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._partitions.get(entry.partition, [])
+        ids.remove(entry_id)
+        if not ids:
+            self._partitions.pop(entry.partition, None)
+
+    def lookup(self, question: str, model_name: str, temperature: float, mode: str,
+               documents: Optional[list] = None) -> Optional[str]:
+        """
+        查找语义相近问题的答案
+
+        参数:
+            question (str): 用户问题
+            model_name (str): 模型名称
+            temperature (float): 模型温度
+            mode (str): 对话类型
+            documents (Optional[list]): 本次请求附带的文档
+
+        返回:
+            Optional[str]: 命中时返回缓存的答案，否则返回 None
+        """
+        partition = self._partition(model_name, temperature, mode, documents)
+        with self._lock:
+            if partition not in self._partitions:
+                self.misses += 1
+                return None
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._partitions.get(partition, [])):
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = float(entry.vector @ vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            print(f"⚡ 命中语义答案缓存，相似度 {best_score:.3f}")
+            return self._entries[best_id].answer
+
+    def store(self, question: str, answer: str, model_name: str, temperature: float, mode: str,
+              documents: Optional[list] = None) -> None:
+        """
+        缓存一个问题的答案
+
+        参数:
+            question (str): 用户问题
+            answer (str): 模型生成的答案
+            model_name (str): 模型名称
+            temperature (float): 模型温度
+            mode (str): 对话类型
+            documents (Optional[list]): 本次请求附带的文档
+        """
+        if not answer:
+            return
+        partition = self._partition(model_name, temperature, mode, documents)
+        entry = _Entry(partition, self._embed(question), normalize_question(question), answer, time.time())
+        with self._lock:
+            entry_id = uuid.uuid4().hex
+            self._entries[entry_id] = entry
+            self._partitions.setdefault(partition, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        """ 返回命中、未命中次数和缓存大小 """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries)}
+
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """
+    获取进程内共享的语义答案缓存，`ANSWER_CACHE_ENABLED` 未开启时返回 None
+
+    返回:
+        Optional[SemanticAnswerCache]: 语义答案缓存
+    """
+    global _answer_cache
+    if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            from chains.models import load_cached_embeddings
+            _answer_cache = SemanticAnswerCache(
+                load_cached_embeddings(os.getenv("ANSWER_CACHE_EMBEDDING_MODEL", "BAAI/bge-large-zh-v1.5")),
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+                ttl=float(os.getenv("ANSWER_CACHE_TTL", 3600)),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000)),
+            )
+        return _answer_cache
@@ -0,0 +1,109 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.documents import Document
+
+from utils.tokens import estimate_tokens
+
+# 渲染上下文时保留的元数据（Markdown 标题），其余元数据不进入提示词
+HEADER_KEYS = ("Header 1", "Header 2", "Header 3")
+# 截断最后一个片段时至少保留的 token 数，太短的片段没有参考价值
+MIN_SEGMENT_TOKENS = 64
+
+
+@dataclass
+class _Segment:
+    rank: int                   # 片段中排名最靠前的 chunk 的名次
+    source: str
+    text: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+    headers: str = ""
+    next: Optional[int] = None   # 片段之后第一个非空白字符的位置，没有记录时与 end 相同
+
+
+def _merge_segments(documents: list[Document]) -> list[_Segment]:
+    """ 同一来源中重叠或相邻（中间只有空白字符）的 chunk（按 start_index）合并为一个片段 """
+    segments, by_source = [], {}
+    for rank, doc in enumerate(documents):
+        metadata = doc.metadata or {}
+        source = metadata.get("source", "")
+        headers = " > ".join(metadata[key] for key in HEADER_KEYS if metadata.get(key))
+        start = metadata.get("start_index")
+        if start is None or not source:
+            segments.append(_Segment(rank, source, doc.page_content, headers=headers))
+            continue
+        end = start + len(doc.page_content)
+        by_source.setdefault(source, []).append(
+            _Segment(rank, source, doc.page_content, start, end, headers, metadata.get("next_index", end)))
+
+    for spans in by_source.values():
+        spans.sort(key=lambda s: s.start)
+        current = spans[0]
+        for span in spans[1:]:
+            if span.start <= max(current.end, current.next):
+                if span.start > current.end:
+                    # 两个 chunk 之间只隔着切分时去掉的空白
+                    current.text += "\n" + span.text
+                    current.end, current.next = span.end, span.next
+                elif span.end > current.end:
+                    current.text += span.text[current.end - span.start:]
+                    current.end, current.next = span.end, span.next
+                current.rank = min(current.rank, span.rank)
+            else:
+                segments.append(current)
+                current = span
+        segments.append(current)
+    return sorted(segments, key=lambda s: s.rank)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """ 按 token 估算值截断文本 """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def build_context(documents: Optional[list[Document]], token_budget: Optional[int] = None) -> str:
+    """
+    将检索或搜索得到的文档渲染为紧凑的上下文文本
+
+    重叠或相邻的 chunk 先按 `start_index` 合并，去掉除来源和标题以外的元数据，
+    再按排名从高到低装入 token 预算，预算不足时截断最后一个片段。
+
+    参数:
+        documents (Optional[list[Document]]): 按相关性排好序的文档
+        token_budget (Optional[int]): 上下文的 token 预算，缺省读取 CONTEXT_TOKEN_BUDGET
+
+    返回:
+        str: 渲染后的上下文文本，没有文档时为空字符串
+    """
+    if not documents:
+        return ""
+    if token_budget is None:
+        token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+
+    blocks, remaining = [], token_budget
+    for segment in _merge_segments(documents):
+        label = [os.path.basename(segment.source)] if segment.source else []
+        if segment.headers:
+            label.append(segment.headers)
+        heading = f"[{len(blocks) + 1}]" + (f" {' | '.join(label)}" if label else "")
+        text = segment.text.strip()
+        tokens = estimate_tokens(heading) + estimate_tokens(text) + 1
+        if tokens > remaining:
+            available = remaining - estimate_tokens(heading) - 1
+            if available >= MIN_SEGMENT_TOKENS:
+                blocks.append(f"{heading}\n{_truncate(text, available)}")
+            break
+        blocks.append(f"{heading}\n{text}")
+        remaining -= tokens
+    return "\n\n".join(blocks)
@@ -23,7 +23,8 @@ class GenerateChain:
             "If you don't know the answer, just say that you don't know."
             "\n\nDocuments: {documents}\n\nHistories: {history}\n\nQuestion: {question}")
 
-        self.chain = self.prompt | self.llm
+        # 流式输出时按 stream_channel 区分回答和节点内的其他 LLM 调用（如历史摘要），见 graph.stream_graph_events
+        self.chain = (self.prompt | self.llm).with_config(metadata={"stream_channel": "answer"})
 
     def invoke(self, input_data):
         """
@@ -36,3 +37,15 @@ class GenerateChain:
             str: 链生成的响应。
         """
         return self.chain.invoke(input_data)
+
+    async def ainvoke(self, input_data):
+        """
+        `invoke` 的异步版本。
+
+        参数:
+            input_data (dict): 与 `invoke` 相同。
+
+        返回:
+            str: 链生成的响应。
+        """
+        return await self.chain.ainvoke(input_data)
@@ -0,0 +1,202 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import BaseMessage
+from langgraph.constants import TAG_NOSTREAM
+
+from chains.models import load_model
+from utils.tokens import estimate_tokens
+
+
+class HistorySummaryChain:
+    """
+    一个用于增量更新对话摘要的类。
+    把新移出窗口的对话合并进已有摘要，而不是每次重新总结全部历史。
+    """
+    def __init__(self, model_name, temperature):
+        """
+        初始化 HistorySummaryChain 类，并加载指定的语言模型。
+
+        参数:
+            model_name (str): 要加载的语言模型的名称。
+            temperature (float): 模型温度。
+        """
+        self.llm = load_model(model_name, temperature)
+        self.prompt = ChatPromptTemplate.from_template(
+            "You are maintaining a running summary of a conversation between a user and an assistant. "
+            "Merge the new conversation lines into the existing summary. "
+            "Keep facts, user preferences, decisions and open questions that later turns may refer to; drop greetings and filler. "
+            "Write the summary in the same language as the conversation and keep it under {max_words} words. "
+            "Output only the updated summary.\n\nExisting summary: {summary}\n\nNew lines:\n{lines}"
+        )
+        # 摘要在生成节点内调用，标记为不流式输出并标记通道，不会混入流式回答和回答缓存
+        self.chain = (self.prompt | self.llm).with_config(
+            tags=[TAG_NOSTREAM], metadata={"stream_channel": "history_summary"})
+
+    def invoke(self, input_data):
+        """
+        使用提供的输入数据调用链以生成新的摘要。
+
+        参数:
+            input_data (dict): 包含 'summary'、'lines' 和 'max_words' 键的字典。
+
+        返回:
+            str: 链生成的摘要。
+        """
+        return self.chain.invoke(input_data)
+
+    async def ainvoke(self, input_data):
+        """
+        `invoke` 的异步版本。
+
+        参数:
+            input_data (dict): 与 `invoke` 相同。
+
+        返回:
+            str: 链生成的新的摘要。
+        """
+        return await self.chain.ainvoke(input_data)
+
+
+def render_message(message: BaseMessage) -> str:
+    """ 将消息渲染为 `角色: 内容` 形式的一行文本 """
+    role = {"human": "user", "ai": "assistant"}.get(message.type, message.type)
+    return f"{role}: {message.content}"
+
+
+class HistoryManager:
+    """
+    按 token 预算管理传入 GenerateChain 的对话历史。
+
+    最近的若干轮对话原样保留，超出预算的较早对话被折叠进一个增量更新的摘要，摘要和已折叠的消息数量
+    保存在图状态中（`history_summary` / `summarized_count`），每轮只需总结新移出窗口的消息。
+    每条消息的 token 数按消息 ID 缓存，长会话中每轮的计算量与历史长度无关。
+    """
+
+    def __init__(self, token_budget: int = 2000, summary_ratio: float = 0.25, cache_size: int = 10000):
+        """
+        参数:
+            token_budget (int): 历史部分（摘要 + 原文）的 token 预算
+            summary_ratio (float): 摘要最多占用预算的比例
+            cache_size (int): 缓存 token 数的消息条数
+        """
+        self.token_budget = token_budget
+        self.summary_budget = int(token_budget * summary_ratio)
+        self.cache_size = cache_size
+        self._token_cache: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count_tokens(self, message: BaseMessage) -> int:
+        """
+        估算单条消息的 token 数，结果按消息 ID 缓存
+
+        参数:
+            message (BaseMessage): 消息
+
+        返回:
+            int: 估算的 token 数
+        """
+        key = message.id or f"{message.type}:{hash(message.content if isinstance(message.content, str) else str(message.content))}"
+        with self._lock:
+            tokens = self._token_cache.get(key)
+            if tokens is not None:
+                self._token_cache.move_to_end(key)
+                return tokens
+        tokens = estimate_tokens(render_message(message))
+        with self._lock:
+            self._token_cache[key] = tokens
+            while len(self._token_cache) > self.cache_size:
+                self._token_cache.popitem(last=False)
+        return tokens
+
+    def _split(self, messages: list[BaseMessage], summary: str, summarized_count: int) -> tuple[list, list, int]:
+        """ 找出需要折叠进摘要的消息，返回未折叠的消息、需要折叠的消息和已折叠的消息数量 """
+        summarized_count = min(summarized_count, len(messages))
+        pending = messages[summarized_count:]
+        remaining = self.token_budget - min(estimate_tokens(summary), self.summary_budget)
+
+        # 从最新的消息往前保留，直到用完预算
+        keep = 0
+        for message in reversed(pending):
+            tokens = self.count_tokens(message)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            keep += 1
+        return pending, pending[:len(pending) - keep], summarized_count
+
+    def _summary_input(self, summary: str, overflow: list[BaseMessage]) -> dict:
+        print(f"🤖 正在将 {len(overflow)} 条较早的消息合并到对话摘要")
+        return {
+            "summary": summary or "(empty)",
+            "lines": "\n".join(render_message(m) for m in overflow),
+            "max_words": self.summary_budget,
+        }
+
+    @staticmethod
+    def _render(pending: list[BaseMessage], overflow: list[BaseMessage], summary: str) -> str:
+        lines = [f"summary of earlier conversation: {summary}"] if summary else []
+        lines.extend(render_message(m) for m in pending[len(overflow):])
+        return "\n".join(lines)
+
+    def build(
+            self,
+            messages: list[BaseMessage],
+            summary: str,
+            summarized_count: int,
+            summarize: Optional[HistorySummaryChain],
+    ) -> tuple[str, str, int]:
+        """
+        生成满足 token 预算的历史文本
+
+        参数:
+            messages (list[BaseMessage]): 当前问题之前的全部历史消息
+            summary (str): 图状态中已有的摘要
+            summarized_count (int): 已经折叠进摘要的消息数量
+            summarize (Optional[HistorySummaryChain]): 用于更新摘要的链，为空时直接丢弃超出预算的消息
+
+        返回:
+            tuple[str, str, int]: 历史文本、更新后的摘要、更新后的已折叠消息数量
+        """
+        pending, overflow, summarized_count = self._split(messages, summary, summarized_count)
+        if overflow:
+            if summarize is not None:
+                summary = summarize.invoke(self._summary_input(summary, overflow)).content
+            summarized_count += len(overflow)
+        return self._render(pending, overflow, summary), summary, summarized_count
+
+    async def abuild(
+            self,
+            messages: list[BaseMessage],
+            summary: str,
+            summarized_count: int,
+            summarize: Optional[HistorySummaryChain],
+    ) -> tuple[str, str, int]:
+        """ `build` 的异步版本，参数和返回值与 `build` 相同 """
+        pending, overflow, summarized_count = self._split(messages, summary, summarized_count)
+        if overflow:
+            if summarize is not None:
+                summary = (await summarize.ainvoke(self._summary_input(summary, overflow))).content
+            summarized_count += len(overflow)
+        return self._render(pending, overflow, summary), summary, summarized_count
+
+
+_history_manager: Optional[HistoryManager] = None
+_history_manager_lock = threading.Lock()
+
+
+def get_history_manager() -> HistoryManager:
+    """
+    获取进程内共享的历史管理器，首次调用时根据环境变量创建
+
+    返回:
+        HistoryManager: 历史管理器
+    """
+    global _history_manager
+    with _history_manager_lock:
+        if _history_manager is None:
+            _history_manager = HistoryManager(token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 2000)))
+        return _history_manager
@@ -1,26 +1,260 @@
+import asyncio
 import os
+import re
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING
 
-from langchain_core.vectorstores import InMemoryVectorStore
+import httpx
+import openai
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 from embedding.ark_embedding import ArkEmbedding
-from rerank.rerank import Rerank
+from embedding.cached_embedding import CachedEmbeddings, get_embedding_cache
+from utils.tokens import estimate_tokens
+from utils.tracing import Span
+from vectorstore.ivf_index import IVFFlatIndex
+from vectorstore.mmap_vector_store import MmapVectorStore
+from vectorstore.quantization import Int8Quantizer
+from vectorstore.shared_store import (NamespaceView, SharedVectorStore, get_shared_store, process_dir_name,
+                                     remove_stale_process_dirs)
+
+if TYPE_CHECKING:
+    from rerank.rerank import Rerank
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """
+    记录 LLM 调用耗时的回调：每次调用生成一个 `llm` span，包含首 token 延迟和输入输出 token 数，
+    按模型名称区分指标。接口没有返回用量时按文本估算 token 数。
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._runs: dict = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, invocation_params=None, **kwargs):
+        model = (invocation_params or {}).get("model") or (metadata or {}).get("ls_model_name", "")
+        prompt_chars = sum(len(str(message.content)) for batch in messages for message in batch)
+        with self._lock:
+            self._runs[run_id] = [Span("llm", {"model": model}, prompt_chars=prompt_chars), time.perf_counter(), None]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and run[2] is None:
+                run[2] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, response=response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=error)
+
+    def _finish(self, run_id, response=None, error=None) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        span, start, first_token = run
+        if first_token is not None:
+            span.set(ttft_seconds=first_token - start)
+        if error is not None:
+            span.error = repr(error)
+        if response is not None:
+            span.set(**_token_usage(response))
+        span.finish(time.perf_counter() - start)
+
+
+def _token_usage(response) -> dict:
+    """ 从 LLMResult 中取出 token 用量，接口没有返回时按生成的文本估算 """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("completion_tokens"):
+        return {"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage["completion_tokens"]}
+    prompt_tokens, completion_tokens = 0, 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                prompt_tokens += metadata.get("input_tokens", 0)
+                completion_tokens += metadata.get("output_tokens", 0)
+            else:
+                completion_tokens += estimate_tokens(generation.text)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+class ReasoningChatOpenAI(ChatOpenAI):
+    """
+    保留推理过程的 ChatOpenAI。
+
+    推理模型（QwQ、DeepSeek-R1 等）在 OpenAI 兼容接口中把推理过程放在 `reasoning_content` 字段，
+    ChatOpenAI 会丢弃该字段。这里把它写入消息的 `additional_kwargs["reasoning_content"]`，
+    流式输出时可以与回答分开展示。
+    """
+
+    def _convert_chunk_to_generation_chunk(self, chunk: dict, default_chunk_class: type, base_generation_info: dict | None):
+        generation_chunk = super()._convert_chunk_to_generation_chunk(chunk, default_chunk_class, base_generation_info)
+        choices = chunk.get("choices") or chunk.get("chunk", {}).get("choices") or []
+        if generation_chunk is not None and choices:
+            reasoning = (choices[0].get("delta") or {}).get("reasoning_content")
+            if reasoning:
+                generation_chunk.message.additional_kwargs["reasoning_content"] = reasoning
+        return generation_chunk
+
+    def _create_chat_result(self, response, generation_info: dict | None = None):
+        result = super()._create_chat_result(response, generation_info)
+        response_dict = response if isinstance(response, dict) else response.model_dump()
+        for generation, choice in zip(result.generations, response_dict.get("choices") or []):
+            reasoning = (choice.get("message") or {}).get("reasoning_content")
+            if reasoning:
+                generation.message.additional_kwargs["reasoning_content"] = reasoning
+        return result
+
+
+class _LoopLocalAsyncHttpxClient(openai.DefaultAsyncHttpxClient):
+    """
+    按事件循环分别持有连接池的异步客户端：连接池绑定在创建它的事件循环上，
+    请求转发给当前事件循环对应的客户端，`asyncio.run` 多次运行时不会复用已关闭循环上的连接。
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client_kwargs = kwargs
+        self._loop_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = weakref.WeakKeyDictionary()
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        client = self._loop_clients.get(loop)
+        if client is None:
+            client = self._loop_clients[loop] = openai.DefaultAsyncHttpxClient(**self._client_kwargs)
+        return await client.send(request, **kwargs)
+
+
+class ModelRegistry:
+    """
+    进程内共享的 LLM 客户端注册表。
+
+    按 (model_name, temperature, base_url) 缓存 ReasoningChatOpenAI 实例，同一个 base_url 的所有模型
+    共用一组 httpx 同步/异步连接池（异步连接池按事件循环区分），节点之间、会话之间以及 Streamlit 重新运行时都复用已建立的连接。
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20, keepalive_expiry: float = 60.0):
+        """
+        参数:
+            max_connections (int): 每个 base_url 的最大连接数
+            max_keepalive_connections (int): 每个 base_url 最多保留的空闲连接数
+            keepalive_expiry (float): 空闲连接的保留时间（秒）
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._models: dict[tuple, ChatOpenAI] = {}
+        self._http_clients: dict[str, tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self._lock = threading.Lock()
+        self._metrics_handler = LLMMetricsHandler()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_http_clients(self, base_url: str) -> tuple[httpx.Client, httpx.AsyncClient]:
+        if base_url not in self._http_clients:
+            # 使用 openai SDK 的默认客户端，保留其超时和重定向设置，只替换连接池配置
+            self._http_clients[base_url] = (
+                openai.DefaultHttpxClient(limits=self.limits),
+                _LoopLocalAsyncHttpxClient(limits=self.limits),
+            )
+        return self._http_clients[base_url]
+
+    def get(self, model_name: str, temperature: float, base_url: str | None = None) -> ChatOpenAI:
+        """
+        获取（必要时创建）指定参数的 ChatOpenAI 实例
+
+        参数:
+            model_name (str): 模型名称
+            temperature (float): 模型温度
+            base_url (str | None): API 地址，缺省读取 OPENAI_BASE_URL
+
+        返回:
+            ChatOpenAI实例
+        """
+        base_url = base_url or os.getenv("OPENAI_BASE_URL", "")
+        key = (model_name, float(temperature), base_url)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            self.misses += 1
+            http_client, http_async_client = self._get_http_clients(base_url)
+            model = ReasoningChatOpenAI(
+                model=model_name,
+                temperature=temperature,
+                base_url=base_url or None,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                callbacks=[self._metrics_handler],
+            )
+            self._models[key] = model
+            return model
+
+    def stats(self) -> dict:
+        """
+        获取注册表的统计信息
+
+        返回:
+            dict: 缓存命中/未命中次数、客户端数量和连接池配置
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "models": len(self._models),
+                "http_pools": len(self._http_clients),
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+            }
+
+
+_model_registry: ModelRegistry | None = None
+_model_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """
+    获取进程内共享的 LLM 客户端注册表，首次调用时根据环境变量创建
+
+    返回:
+        ModelRegistry实例
+    """
+    global _model_registry
+    with _model_registry_lock:
+        if _model_registry is None:
+            _model_registry = ModelRegistry(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20)),
+                keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60)),
+            )
+        return _model_registry
 
 
 def load_model(model_name: str, temperature: float) -> ChatOpenAI:
     """
-    加载语言模型
+    加载语言模型，相同参数的模型在进程内只创建一次
 
     参数:
         model_name (str): 模型名称
+        temperature (float): 模型温度
 
     返回:
         ChatOpenAI实例，用于生成文本和回答问题
     """
-    return ChatOpenAI(
-        model=model_name,
-        temperature=temperature,
-    )
+    return get_model_registry().get(model_name, temperature)
 
 
 def load_embeddings(model_name: str) -> OpenAIEmbeddings:
@@ -50,29 +284,130 @@ def load_ark_embeddings(model_name: str) -> ArkEmbedding:
     return ArkEmbedding(
         api_base=os.getenv("ARK_BASE_URL", ""),
         api_key=os.getenv("ARK_API_KEY", ""),
-        model_name=model_name
+        model_name=model_name,
+        batch_size=int(os.getenv("ARK_EMBEDDING_BATCH_SIZE", 64)),
+        max_batch_tokens=int(os.getenv("ARK_EMBEDDING_MAX_BATCH_TOKENS", 32000)),
+        max_concurrency=int(os.getenv("ARK_EMBEDDING_CONCURRENCY", 4)),
     )
 
-def load_rerank() -> Rerank:
+def load_cached_embeddings(model_name: str) -> CachedEmbeddings:
+    """
+    加载带缓存的嵌入模型，doubao 系列使用火山方舟，其余使用 OpenAI 兼容接口
+
+    参数:
+        model_name (str): 模型名称
+
+    返回:
+        CachedEmbeddings 实例，相同内容只嵌入一次，重复上传的文档和重复的问题不再调用嵌入接口
+    """
+    if model_name.startswith("doubao-embedding"):
+        embeddings = load_ark_embeddings(model_name)
+    else:
+        embeddings = load_embeddings(model_name)
+    return CachedEmbeddings(embeddings, get_embedding_cache())
+
+def load_rerank() -> "Rerank":
+    """
+    加载重排序模型，`rerank` 模块（requests / urllib3）在第一次使用时才导入
+
+    返回:
+        Rerank 实例，复用连接池并缓存重排序结果
+    """
+    from rerank.rerank import Rerank
+
     return Rerank(
         model=os.getenv('RERANK_MODEL', ''),
         base_url=os.getenv('RERANK_BASE_URL', ''),
-        api_key=os.getenv('OPENAI_API_KEY')
+        api_key=os.getenv('OPENAI_API_KEY'),
+        connect_timeout=float(os.getenv('RERANK_CONNECT_TIMEOUT', 3.0)),
+        read_timeout=float(os.getenv('RERANK_READ_TIMEOUT', 10.0)),
+        max_retries=int(os.getenv('RERANK_MAX_RETRIES', 2)),
+        cache_size=int(os.getenv('RERANK_CACHE_SIZE', 1024)),
     )
 
-def load_vector_store(model_name: str) -> InMemoryVectorStore:
+_rerank: "Rerank | None" = None
+_rerank_lock = threading.Lock()
+
+def get_rerank() -> "Rerank":
     """
-    创建内存向量存储
+    获取进程内共享的重排序客户端，首次调用时创建
+
+    返回:
+        Rerank 实例
+    """
+    global _rerank
+    with _rerank_lock:
+        if _rerank is None:
+            _rerank = load_rerank()
+        return _rerank
+
+_vector_stores: dict[str, MmapVectorStore] = {}
+_vector_stores_lock = threading.Lock()
+
+def load_vector_store(model_name: str, collection: str = "default") -> MmapVectorStore:
+    """
+    打开持久化向量存储，重启后已上传文档的向量不会丢失。
+
+    同一目录在进程内只打开一次，所有调用方共用同一个实例（以及它的写锁、BM25 索引和量化编码），
+    多个实例各自记录行数并改写 meta.json 会丢失写入。
 
     参数:
         model_name (str): 用于生成嵌入的模型名称
+        collection (str): 集合名称，同一嵌入模型下不同集合的文档互相隔离
 
     返回:
-        InMemoryVectorStore实例，用于存储和检索向量化的文本
+        MmapVectorStore实例，用于存储和检索向量化的文本
     """
-    if model_name.startswith("doubao-embedding"):
-        embeddings = load_ark_embeddings(model_name)
-    else:
-        embeddings = load_embeddings(model_name)
+    # 不同嵌入模型的向量维度不同，按模型名称分目录存储
+    model_dir = re.sub(r"[^0-9A-Za-z._-]", "_", model_name)
+    persist_dir = os.path.abspath(os.path.join(os.getenv("VECTOR_STORE_DIR", "vector_store"), model_dir, collection))
+    with _vector_stores_lock:
+        if persist_dir not in _vector_stores:
+            _vector_stores[persist_dir] = _open_vector_store(model_name, persist_dir)
+        return _vector_stores[persist_dir]
+
+def _open_vector_store(model_name: str, persist_dir: str) -> MmapVectorStore:
+    embeddings = load_cached_embeddings(model_name)
+    index = None
+    if os.getenv("VECTOR_INDEX", "").lower() == "ivf":
+        os.makedirs(persist_dir, exist_ok=True)
+        index = IVFFlatIndex(
+            persist_dir,
+            nprobe=int(os.getenv("VECTOR_INDEX_NPROBE", 16)),
+            min_train_size=int(os.getenv("VECTOR_INDEX_MIN_SIZE", 20000)),
+        )
+    quantizer = None
+    if os.getenv("VECTOR_QUANTIZATION", "").lower() == "int8":
+        # 检索时扫描 int8 编码，原始向量只用于重算少量候选的分数
+        quantizer = Int8Quantizer(persist_dir, rescore_factor=int(os.getenv("VECTOR_RESCORE_FACTOR", 4)))
+    return MmapVectorStore(embeddings, persist_dir, dtype=os.getenv("VECTOR_STORE_DTYPE", "float32"),
+                           index=index, quantizer=quantizer)
+
+def load_session_store(model_name: str, session_id: str) -> NamespaceView:
+    """
+    获取会话的向量存储：进程内共享存储中以会话 ID 命名的命名空间
+
+    同一嵌入模型的所有会话共用一个存储，相同内容的 chunk 只保存一份；会话空闲超过 `SHARED_STORE_TTL` 秒、
+    或全部会话引用的内容超过 `SHARED_STORE_MAX_MB` 时，最久未使用的会话的文档会被释放。
+
+    参数:
+        model_name (str): 用于生成嵌入的模型名称
+        session_id (str): 会话 ID
+
+    返回:
+        NamespaceView: 只能看到该会话文档的向量存储
+    """
+    def create() -> SharedVectorStore:
+        # 命名空间只保存在内存中，存储目录按进程区分，避免多个工作进程写同一组文件
+        parent = os.path.join(os.getenv("VECTOR_STORE_DIR", "vector_store"), re.sub(r"[^0-9A-Za-z._-]", "_", model_name), "shared")
+        remove_stale_process_dirs(parent)
+        return SharedVectorStore(
+            load_cached_embeddings(model_name),
+            os.path.join(parent, process_dir_name()),
+            ttl=float(os.getenv("SHARED_STORE_TTL", 3600)),
+            max_bytes=int(float(os.getenv("SHARED_STORE_MAX_MB", 2048)) * 1024 * 1024),
+            compact_ratio=float(os.getenv("SHARED_STORE_COMPACT_RATIO", 0.5)),
+            dtype=os.getenv("VECTOR_STORE_DTYPE", "float32"),
+        )
 
-    return InMemoryVectorStore(embeddings)
+    return get_shared_store(model_name, create).namespace(session_id)
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from chains.summary import SummaryChain
+from utils.common import get_current_time
+
+# 常见的中文虚词和疑问词，切分 CJK 文本时作为分隔
+CJK_STOPWORDS = sorted([
+    "请问", "请", "帮我", "帮忙", "一下", "什么", "怎么样", "怎么", "怎样", "如何", "为什么", "哪些", "哪个", "哪里",
+    "是否", "是不是", "有没有", "可以", "能否", "能不能", "我想", "我要", "告诉我", "介绍", "关于", "以及", "还有",
+    "这个", "那个", "这些", "那些", "一个", "的", "了", "吗", "呢", "吧", "啊", "呀", "和", "与", "及", "或",
+    "是", "在", "有", "我", "你", "他", "她", "它", "们", "给", "把", "被", "让", "对", "从", "到", "都", "也", "就",
+], key=len, reverse=True)
+EN_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "do", "does", "did", "what", "which", "who", "whom",
+    "how", "why", "when", "where", "can", "could", "would", "should", "will", "shall", "may", "might", "i", "you",
+    "he", "she", "it", "we", "they", "me", "my", "your", "of", "to", "in", "on", "for", "with", "about", "and", "or",
+    "please", "tell", "explain", "show", "give", "some", "any", "this", "that", "these", "those", "there", "from",
+}
+# 出现这些词时，问题与当前日期有关
+TIME_WORDS = re.compile(r"今天|今日|现在|目前|当前|最新|最近|近期|今年|本年|本月|这个月|本周|这周|昨天|明天|"
+                        r"\b(today|now|current|currently|latest|recent|recently|this (year|month|week))\b", re.I)
+# 指代上文的词，启发式改写无法还原其含义
+REFERENCE_WORDS = re.compile(r"它|他们|她们|这个|那个|上面|前面|刚才|继续|\b(it|that|those|above|previous)\b", re.I)
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9.+#_-]*|\d+(?:\.\d+)?")
+_STOPWORD_SPLIT = re.compile("|".join(map(re.escape, CJK_STOPWORDS)))
+
+
+@dataclass
+class RewriteResult:
+    """ 查询改写结果 """
+    query: str              # 改写后的搜索查询
+    confidence: float       # 改写结果的置信度，0 到 1
+    source: str             # 产生结果的改写器：heuristic / llm
+
+
+class QueryRewriter(ABC):
+    """ 查询改写器的基类，把用户问题改写为适合联网搜索或向量检索的查询 """
+
+    @abstractmethod
+    def rewrite(self, question: str) -> RewriteResult:
+        """
+        改写用户问题
+
+        参数:
+            question (str): 用户问题
+
+        返回:
+            RewriteResult: 改写结果
+        """
+        pass
+
+    async def arewrite(self, question: str) -> RewriteResult:
+        """ `rewrite` 的异步版本，默认在线程池中执行 `rewrite` """
+        return await asyncio.to_thread(self.rewrite, question)
+
+
+class LLMQueryRewriter(QueryRewriter):
+    """ 使用 SummaryChain 调用 LLM 提取关键词 """
+
+    def __init__(self, model_name: str, temperature: float):
+        self.chain = SummaryChain(model_name, temperature)
+
+    def rewrite(self, question: str) -> RewriteResult:
+        query = self.chain.invoke({"question": question, "current_time": get_current_time()})
+        return RewriteResult(query.content, 1.0, "llm")
+
+    async def arewrite(self, question: str) -> RewriteResult:
+        query = await self.chain.ainvoke({"question": question, "current_time": get_current_time()})
+        return RewriteResult(query.content, 1.0, "llm")
+
+
+class HeuristicQueryRewriter(QueryRewriter):
+    """
+    不调用 LLM 的本地改写器。
+
+    去掉标点和停用词后，英文按单词、中文按停用词切分出的短语提取关键词；问题与时间有关时追加当前日期。
+    与 SummaryChain 的输出格式一致：问题本身作为第一个关键词，其余关键词以空格连接。
+    问题含有指代上文的词、过短或提取不到关键词时置信度较低。
+    """
+
+    def __init__(self, max_keywords: int = 8):
+        """
+        参数:
+            max_keywords (int): 最多提取的关键词数量
+        """
+        self.max_keywords = max_keywords
+
+    def keywords(self, question: str) -> list[str]:
+        """
+        提取关键词
+
+        参数:
+            question (str): 用户问题
+
+        返回:
+            list[str]: 按出现顺序去重后的关键词
+        """
+        found = []
+        for word in _WORD.findall(question):
+            if word.lower() not in EN_STOPWORDS and len(word) > 1:
+                found.append(word)
+        for run in _CJK_RUN.findall(question):
+            for phrase in _STOPWORD_SPLIT.split(run):
+                if len(phrase) >= 2:
+                    found.append(phrase)
+                    # 较长的短语再补充二元组，提高与文档中不同表述的匹配率
+                    if len(phrase) > 6:
+                        found.extend(phrase[i:i + 2] for i in range(0, len(phrase) - 1, 2))
+        return list(dict.fromkeys(found))[:self.max_keywords]
+
+    def rewrite(self, question: str) -> RewriteResult:
+        cleaned = re.sub(r"\s+", " ", re.sub(r"[^\w\s.+#-]", " ", question)).strip()
+        keywords = self.keywords(cleaned)
+        parts = [cleaned] + [k for k in keywords if k != cleaned]
+        if TIME_WORDS.search(question):
+            now = get_current_time()
+            parts.append(f"{now[:4]}年{int(now[5:7])}月{int(now[8:10])}日")
+
+        confidence = 1.0
+        if not keywords:
+            confidence -= 0.6
+        if REFERENCE_WORDS.search(question):
+            confidence -= 0.5
+        if len(cleaned) < 4:
+            confidence -= 0.3
+        if len(cleaned) > 120:
+            confidence -= 0.3
+        return RewriteResult(" ".join(parts), max(0.0, confidence), "heuristic")
+
+    async def arewrite(self, question: str) -> RewriteResult:
+        # 纯本地计算，无需切换线程
+        return self.rewrite(question)
+
+
+class AutoQueryRewriter(QueryRewriter):
+    """ 优先使用启发式改写，置信度低于阈值时退回 LLM 改写 """
+
+    def __init__(self, heuristic: HeuristicQueryRewriter, llm: LLMQueryRewriter, threshold: float = 0.6):
+        self.heuristic = heuristic
+        self.llm = llm
+        self.threshold = threshold
+
+    def rewrite(self, question: str) -> RewriteResult:
+        result = self.heuristic.rewrite(question)
+        if result.confidence >= self.threshold:
+            return result
+        print(f"🤖 启发式改写置信度较低({result.confidence:.2f})，使用 LLM 提取关键词")
+        return self.llm.rewrite(question)
+
+    async def arewrite(self, question: str) -> RewriteResult:
+        result = self.heuristic.rewrite(question)
+        if result.confidence >= self.threshold:
+            return result
+        print(f"🤖 启发式改写置信度较低({result.confidence:.2f})，使用 LLM 提取关键词")
+        return await self.llm.arewrite(question)
+
+
+class _RewriteCache:
+    """ 改写结果的 LRU 缓存，键中包含日期，跨天后与时间有关的查询会重新生成 """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, RewriteResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[RewriteResult]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            return result
+
+    def put(self, key: tuple, result: RewriteResult) -> None:
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_rewrite_cache = _RewriteCache()
+
+
+def _rewriter_key(question: str, model_name: str, temperature: float, mode: Optional[str]) -> tuple:
+    mode = (mode or os.getenv("QUERY_REWRITER", "llm")).lower()
+    return mode, model_name, float(temperature), question, get_current_time()[:10]
+
+
+def _create_rewriter(mode: str, model_name: str, temperature: float) -> QueryRewriter:
+    if mode == "heuristic":
+        return HeuristicQueryRewriter()
+    if mode == "auto":
+        return AutoQueryRewriter(HeuristicQueryRewriter(), LLMQueryRewriter(model_name, temperature),
+                                 threshold=float(os.getenv("QUERY_REWRITER_THRESHOLD", 0.6)))
+    return LLMQueryRewriter(model_name, temperature)
+
+
+def rewrite_query(question: str, model_name: str, temperature: float, mode: Optional[str] = None) -> RewriteResult:
+    """
+    按 `QUERY_REWRITER` 选择的策略改写问题，相同问题的结果会被缓存
+
+    参数:
+        question (str): 用户问题
+        model_name (str): LLM 改写使用的模型名称
+        temperature (float): 模型温度
+        mode (Optional[str]): 改写策略，llm / heuristic / auto，缺省读取 QUERY_REWRITER
+
+    返回:
+        RewriteResult: 改写结果
+    """
+    key = _rewriter_key(question, model_name, temperature, mode)
+    result = _rewrite_cache.get(key)
+    if result is None:
+        result = _create_rewriter(key[0], model_name, temperature).rewrite(question)
+        _rewrite_cache.put(key, result)
+    return result
+
+
+async def arewrite_query(question: str, model_name: str, temperature: float, mode: Optional[str] = None) -> RewriteResult:
+    """ `rewrite_query` 的异步版本，与同步版本共享缓存 """
+    key = _rewriter_key(question, model_name, temperature, mode)
+    result = _rewrite_cache.get(key)
+    if result is None:
+        result = await _create_rewriter(key[0], model_name, temperature).arewrite(question)
+        _rewrite_cache.put(key, result)
+    return result
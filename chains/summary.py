@@ -31,7 +31,8 @@ class SummaryChain:
             "you need to add an additional keyword for the current date"
             "Be careful not answer the question directly, just output the search query.\n\nQuestion: {question}"
         )
-        self.chain = self.prompt | self.llm
+        # 标记通道，流式输出时不会混入回答
+        self.chain = (self.prompt | self.llm).with_config(metadata={"stream_channel": "search_query"})
 
     def invoke(self, input_data):
         """
@@ -44,3 +45,15 @@ class SummaryChain:
             str: 链生成的搜索查询。
         """
         return self.chain.invoke(input_data)
+
+    async def ainvoke(self, input_data):
+        """
+        `invoke` 的异步版本。
+
+        参数:
+            input_data (dict): 与 `invoke` 相同。
+
+        返回:
+            str: 链生成的搜索查询。
+        """
+        return await self.chain.ainvoke(input_data)
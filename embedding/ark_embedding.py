@@ -1,7 +1,10 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 
 from .base_embedding import BaseEmbedding
 from openai import AsyncOpenAI, OpenAI
+from utils.tokens import estimate_tokens
 
 
 class ArkEmbedding(BaseEmbedding):
@@ -9,9 +12,11 @@ class ArkEmbedding(BaseEmbedding):
 
     该类实现了 BaseEmbedding 接口，提供与 OpenAI 兼容的嵌入功能。
     使用官方 SDK 进行 API 调用，确保了接口调用的可靠性和兼容性。
+    批量嵌入时按条数和 token 数切分请求，多个批次并发执行后按输入顺序拼接结果。
 
     Attributes:
-        client (AsyncOpenAI): OpenAI 异步客户端实例，用于进行 API 调用。
+        client (OpenAI): OpenAI 同步客户端实例，用于进行 API 调用。
+        async_client (AsyncOpenAI): OpenAI 异步客户端实例，用于进行异步 API 调用。
         dimensions (Dict[str, int]): 不同模型的嵌入维度映射。
     """
 
@@ -26,6 +31,9 @@ class ArkEmbedding(BaseEmbedding):
             model_name: str,
             api_base: str,
             api_key: Optional[str] = None,
+            batch_size: int = 64,
+            max_batch_tokens: int = 32000,
+            max_concurrency: int = 4,
             **kwargs: Dict[str, Any]
     ) -> None:
         """初始化 Ark 嵌入模型实例。
@@ -34,13 +42,67 @@ class ArkEmbedding(BaseEmbedding):
             model_name: 要使用的模型名称，如 'text-embedding-ada-002'。
             api_base: API 服务的基础 URL。
             api_key: OpenAI API 密钥，用于认证。
+            batch_size: 单次请求最多包含的文本条数。
+            max_batch_tokens: 单次请求最多包含的 token 数（估算值），单条超长文本会独占一个批次。
+            max_concurrency: 同时进行的请求数量上限。
             **kwargs: 额外的模型配置参数。
         """
         super().__init__(model_name, api_base, api_key, **kwargs)
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
         self.client = OpenAI(
             api_key=self.api_key,
             base_url=self.api_base,
         )
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base,
+        )
+
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        """按条数和 token 数将文本切分为多个批次，保持原有顺序。
+
+        Args:
+            texts: 要嵌入的文档文本列表
+
+        Returns:
+            切分后的批次列表
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def _sorted_embeddings(response) -> List[List[float]]:
+        # 按照输入顺序排序结果
+        sorted_data = sorted(response.data, key=lambda x: x.index)
+        return [item.embedding for item in sorted_data]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(
+            model=self.model_name,
+            input=texts,
+            **self.kwargs
+        )
+        return self._sorted_embeddings(response)
+
+    async def _aembed_batch(self, texts: List[str], semaphore: asyncio.Semaphore) -> List[List[float]]:
+        async with semaphore:
+            response = await self.async_client.embeddings.create(
+                model=self.model_name,
+                input=texts,
+                **self.kwargs
+            )
+        return self._sorted_embeddings(response)
 
     def embed_query(self, text: str) -> List[float]:
         """将单个查询文本转换为嵌入向量。
@@ -62,7 +124,7 @@ class ArkEmbedding(BaseEmbedding):
         return response.data[0].embedding
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """将多个文档文本转换为嵌入向量列表。
+        """将多个文档文本转换为嵌入向量列表，多个批次在线程池中并发请求。
 
         Args:
             texts: 要嵌入的文档文本列表
@@ -73,14 +135,51 @@ class ArkEmbedding(BaseEmbedding):
         Raises:
             OpenAIError: 当 API 调用失败时抛出
         """
-        response = self.client.embeddings.create(
+        if not texts:
+            return []
+        batches = self._split_batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            results = executor.map(self._embed_batch, batches)
+            return [embedding for batch in results for embedding in batch]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步将单个查询文本转换为嵌入向量。
+
+        Args:
+            text: 要嵌入的查询文本
+
+        Returns:
+            表示文本的嵌入向量
+
+        Raises:
+            OpenAIError: 当 API 调用失败时抛出
+        """
+        response = await self.async_client.embeddings.create(
             model=self.model_name,
-            input=texts,
+            input=text,
             **self.kwargs
         )
-        # 按照输入顺序排序结果
-        sorted_data = sorted(response.data, key=lambda x: x.index)
-        return [item.embedding for item in sorted_data]
+        return response.data[0].embedding
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步将多个文档文本转换为嵌入向量列表，最多 `max_concurrency` 个批次同时请求。
+
+        Args:
+            texts: 要嵌入的文档文本列表
+
+        Returns:
+            表示文档的嵌入向量列表
+
+        Raises:
+            OpenAIError: 当 API 调用失败时抛出
+        """
+        if not texts:
+            return []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(self._aembed_batch(batch, semaphore) for batch in self._split_batches(texts)))
+        return [embedding for batch in results for embedding in batch]
 
     def get_dimension(self) -> int:
         """获取嵌入向量的维度。
@@ -88,4 +187,4 @@ class ArkEmbedding(BaseEmbedding):
         Returns:
             嵌入向量的维度
         """
-        return self.dimensions.get(self.model_name, 2560)  # 默认返回1536维
\ No newline at end of file
+        return self.dimensions.get(self.model_name, 2560)  # 默认返回1536维
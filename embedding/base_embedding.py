@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional
 
@@ -28,7 +29,7 @@ class BaseEmbedding(ABC):
         self.kwargs = kwargs
 
     @abstractmethod
-    async def embed_query(self, text: str) -> List[float]:
+    def embed_query(self, text: str) -> List[float]:
         """将单个查询文本转换为嵌入向量。
 
         Args:
@@ -40,7 +41,7 @@ class BaseEmbedding(ABC):
         pass
 
     @abstractmethod
-    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """将多个文档文本转换为嵌入向量列表。
 
         Args:
@@ -51,6 +52,28 @@ class BaseEmbedding(ABC):
         """
         pass
 
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步将单个查询文本转换为嵌入向量，默认在线程池中调用 `embed_query`。
+
+        Args:
+            text (str): 要嵌入的查询文本
+
+        Returns:
+            List[float]: 表示文本的嵌入向量
+        """
+        return await asyncio.to_thread(self.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步将多个文档文本转换为嵌入向量列表，默认在线程池中调用 `embed_documents`。
+
+        Args:
+            texts (List[str]): 要嵌入的文档文本列表
+
+        Returns:
+            List[List[float]]: 表示文档的嵌入向量列表
+        """
+        return await asyncio.to_thread(self.embed_documents, texts)
+
     @abstractmethod
     def get_dimension(self) -> int:
         """获取嵌入向量的维度。
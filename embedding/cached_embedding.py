@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.tracing import span
+
+
+class EmbeddingCache:
+    """按内容寻址的嵌入向量缓存。
+
+    缓存键为 `(model_name, sha256(text))`，内存中维护一层 LRU，
+    下层是 SQLite 持久化存储，超过 `max_entries` 时按最近访问时间淘汰。
+    同一进程内的所有嵌入模型共用一个缓存实例，命中和未命中次数会被统计。
+
+    Attributes:
+        hits (int): 命中次数（内存或磁盘）。
+        misses (int): 未命中、需要调用上游接口的次数。
+    """
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            max_entries: int = 200000,
+            memory_entries: int = 10000,
+    ) -> None:
+        """初始化嵌入缓存。
+
+        Args:
+            path: SQLite 文件路径，为空时只使用内存缓存。
+            max_entries: 磁盘中最多保留的向量数量。
+            memory_entries: 内存 LRU 中最多保留的向量数量。
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_count = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+            self._conn.commit()
+            self._disk_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        """生成缓存键。
+
+        Args:
+            model_name: 嵌入模型名称
+            text: 待嵌入的文本
+
+        Returns:
+            缓存键
+        """
+        return f"{model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """批量读取缓存。
+
+        Args:
+            keys: 缓存键列表
+
+        Returns:
+            命中的缓存键到向量的映射
+        """
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if self._conn is not None and missing:
+                now = time.time()
+                # SQLite 单条语句的参数数量有限制，分批查询
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                        found[key] = vector
+                        self._remember(key, vector)
+                    if rows:
+                        self._conn.executemany(
+                            "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key, _ in rows]
+                        )
+                self._conn.commit()
+
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """批量写入缓存，超过容量时淘汰最久未访问的向量。
+
+        Args:
+            items: 缓存键到向量的映射
+        """
+        if not items:
+            return
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._conn is None:
+                return
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()],
+            )
+            self._disk_count += len(items)
+            if self._disk_count > self.max_entries:
+                self._disk_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                overflow = self._disk_count - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)", (overflow,)
+                    )
+                    self._disk_count -= overflow
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息。
+
+        Returns:
+            包含命中、未命中次数、命中率和缓存大小的字典
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_count,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """带缓存的嵌入模型包装类。
+
+    包装任意 `BaseEmbedding` 或 LangChain `Embeddings`，先查询 `EmbeddingCache`，
+    只把未命中的文本（去重后）一次性发送给上游模型。
+
+    Attributes:
+        underlying: 被包装的嵌入模型。
+        cache (EmbeddingCache): 嵌入缓存。
+        model_name (str): 用于区分缓存键的模型名称。
+    """
+
+    def __init__(self, underlying: Any, cache: EmbeddingCache) -> None:
+        """初始化带缓存的嵌入模型。
+
+        Args:
+            underlying: 被包装的嵌入模型，需要提供 `embed_documents` 和 `embed_query` 方法
+            cache: 嵌入缓存
+        """
+        self.underlying = underlying
+        self.cache = cache
+        self.model_name = getattr(underlying, "model_name", None) or getattr(underlying, "model", "")
+
+    def _lookup(self, texts: List[str]):
+        keys = [self.cache.make_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+        # 同一批次中重复的文本只请求一次
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, missing
+
+    @staticmethod
+    def _record(current, keys: List[str], missing: Dict[str, str]) -> None:
+        # 命中数按输入条数计算，发送给上游的条数和字符数按去重后的文本计算
+        current.set(cache_hits=sum(1 for key in keys if key not in missing),
+                    upstream_texts=len(missing), upstream_chars=sum(len(text) for text in missing.values()))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """将多个文档文本转换为嵌入向量列表，只有未命中缓存的文本会调用上游模型。
+
+        Args:
+            texts: 要嵌入的文档文本列表
+
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        if not texts:
+            return []
+        with span("embedding", {"model": self.model_name}, texts=len(texts)) as current:
+            keys, found, missing = self._lookup(texts)
+            self._record(current, keys, missing)
+            if missing:
+                vectors = self.underlying.embed_documents(list(missing.values()))
+                fresh = dict(zip(missing.keys(), vectors))
+                self.cache.put_many(fresh)
+                found.update(fresh)
+            return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """将单个查询文本转换为嵌入向量。
+
+        Args:
+            text: 要嵌入的查询文本
+
+        Returns:
+            表示文本的嵌入向量
+        """
+        with span("embedding", {"model": self.model_name}, texts=1) as current:
+            keys, found, missing = self._lookup([text])
+            self._record(current, keys, missing)
+            if missing:
+                vector = self.underlying.embed_query(text)
+                self.cache.put_many({keys[0]: vector})
+                return vector
+            return found[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步版本的 `embed_documents`。"""
+        if not texts:
+            return []
+        with span("embedding", {"model": self.model_name}, texts=len(texts)) as current:
+            keys, found, missing = await asyncio.to_thread(self._lookup, texts)
+            self._record(current, keys, missing)
+            if missing:
+                if hasattr(self.underlying, "aembed_documents"):
+                    vectors = await self.underlying.aembed_documents(list(missing.values()))
+                else:
+                    vectors = await asyncio.to_thread(self.underlying.embed_documents, list(missing.values()))
+                fresh = dict(zip(missing.keys(), vectors))
+                await asyncio.to_thread(self.cache.put_many, fresh)
+                found.update(fresh)
+            return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步版本的 `embed_query`。"""
+        with span("embedding", {"model": self.model_name}, texts=1) as current:
+            keys, found, missing = await asyncio.to_thread(self._lookup, [text])
+            self._record(current, keys, missing)
+            if missing:
+                if hasattr(self.underlying, "aembed_query"):
+                    vector = await self.underlying.aembed_query(text)
+                else:
+                    vector = await asyncio.to_thread(self.underlying.embed_query, text)
+                await asyncio.to_thread(self.cache.put_many, {keys[0]: vector})
+                return vector
+            return found[keys[0]]
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """获取进程内共享的嵌入缓存，首次调用时根据环境变量创建。
+
+    Returns:
+        进程内共享的 EmbeddingCache 实例
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3"),
+                max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000)),
+                memory_entries=int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", 10000)),
+            )
+        return _embedding_cache
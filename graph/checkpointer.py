@@ -0,0 +1,251 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    有容量上限的内存检查点存储。
+
+    每个会话（thread）只保留最近 `retention` 个检查点，较早的检查点及其 writes、
+    不再被引用的 channel 数据会在写入新检查点时被清理；超过 `ttl` 秒未活动的会话整体淘汰。
+
+    写入和清理在同一把锁内进行；每个 (thread, namespace) 记录自己的 channel 数据键和各检查点引用的版本，
+    清理只访问当前会话的数据，耗时与会话总数无关。
+    """
+
+    def __init__(self, retention: int = 20, ttl: Optional[float] = 86400, evict_interval: float = 60, **kwargs: Any):
+        """
+        参数:
+            retention (int): 每个会话保留的检查点数量，为 0 时不限制
+            ttl (Optional[float]): 会话空闲多久（秒）后淘汰，为空时不淘汰
+            evict_interval (float): 两次空闲会话扫描的最小间隔（秒）
+        """
+        super().__init__(**kwargs)
+        self.retention = retention
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._last_seen: dict[str, float] = {}
+        self._last_evict = time.monotonic()
+        self._lock = threading.RLock()
+        # (thread_id, checkpoint_ns) -> 该命名空间的 channel 数据键 (channel, version)
+        self._blob_keys: dict[tuple, set] = {}
+        # (thread_id, checkpoint_ns, checkpoint_id) -> 检查点引用的 (channel, version)
+        self._checkpoint_versions: dict[tuple, set] = {}
+
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            self._blob_keys.setdefault((thread_id, checkpoint_ns), set()).update(new_versions.items())
+            self._checkpoint_versions[(thread_id, checkpoint_ns, checkpoint["id"])] = set(checkpoint["channel_versions"].items())
+            self._last_seen[thread_id] = time.monotonic()
+            if self.retention:
+                self._compact(thread_id, checkpoint_ns)
+            self._maybe_evict()
+        return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def _compact(self, thread_id: str, checkpoint_ns: str) -> None:
+        """ 只保留最近的检查点，并清理已删除检查点的 writes 和不再被引用的 channel 数据 """
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.retention:
+            return
+        # 检查点 ID 按时间递增，可以直接排序
+        expired = sorted(checkpoints)[:-self.retention]
+        for checkpoint_id in expired:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._checkpoint_versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        referenced = set()
+        for checkpoint_id, (serialized_checkpoint, _, _) in checkpoints.items():
+            versions = self._checkpoint_versions.get((thread_id, checkpoint_ns, checkpoint_id))
+            if versions is None:
+                versions = self._checkpoint_versions[(thread_id, checkpoint_ns, checkpoint_id)] = set(
+                    self.serde.loads_typed(serialized_checkpoint)["channel_versions"].items())
+            referenced |= versions
+        blob_keys = self._blob_keys.get((thread_id, checkpoint_ns), set())
+        for channel_version in blob_keys - referenced:
+            self.blobs.pop((thread_id, checkpoint_ns, *channel_version), None)
+        blob_keys &= referenced
+
+    def _maybe_evict(self) -> None:
+        now = time.monotonic()
+        if not self.ttl or now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        for thread_id in [t for t, seen in self._last_seen.items() if now - seen > self.ttl]:
+            self.evict_thread(thread_id)
+
+    def evict_thread(self, thread_id: str) -> None:
+        """
+        删除一个会话的全部检查点
+
+        参数:
+            thread_id (str): 会话 ID
+        """
+        with self._lock:
+            self._last_seen.pop(thread_id, None)
+            namespaces = self.storage.pop(thread_id, {})
+            for key in [key for key in self.writes if key[0] == thread_id]:
+                del self.writes[key]
+            for checkpoint_ns in set(namespaces) | {ns for thread, ns in self._blob_keys if thread == thread_id}:
+                for channel_version in self._blob_keys.pop((thread_id, checkpoint_ns), ()):
+                    self.blobs.pop((thread_id, checkpoint_ns, *channel_version), None)
+                for checkpoint_id in namespaces.get(checkpoint_ns, ()):
+                    self._checkpoint_versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+
+class BoundedSqliteSaver(BaseCheckpointSaver):
+    """
+    基于 SQLite（WAL 模式）的持久化检查点存储，进程重启后可以恢复会话。
+
+    读写委托给 `langgraph-checkpoint-sqlite` 的 `SqliteSaver`，在此基础上增加与
+    `BoundedMemorySaver` 相同的保留数量和空闲淘汰策略，淘汰后对 WAL 文件做截断式 checkpoint。
+    SqliteSaver 本身不支持异步接口，这里的异步方法在线程池中调用同步实现。
+    """
+
+    def __init__(self, path: str, retention: int = 20, ttl: Optional[float] = 86400, evict_interval: float = 60):
+        """
+        参数:
+            path (str): SQLite 数据库文件路径
+            retention (int): 每个会话保留的检查点数量，为 0 时不限制
+            ttl (Optional[float]): 会话空闲多久（秒）后淘汰，为空时不淘汰
+            evict_interval (float): 两次空闲会话扫描的最小间隔（秒）
+        """
+        from langgraph.checkpoint.sqlite import SqliteSaver
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.saver = SqliteSaver(conn)
+        super().__init__(serde=self.saver.serde)
+        self.retention = retention
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        with self.saver.cursor() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_seen REAL)")
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.saver.get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any):
+        return self.saver.list(config, **kwargs)
+
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = self.saver.put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self.saver.cursor() as cur:
+            cur.execute("INSERT OR REPLACE INTO thread_activity (thread_id, last_seen) VALUES (?, ?)",
+                        (str(thread_id), time.time()))
+            if self.retention:
+                self._compact(cur, str(thread_id), checkpoint_ns)
+        self._maybe_evict()
+        return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        self.saver.put_writes(config, writes, task_id, task_path)
+
+    def _compact(self, cur: sqlite3.Cursor, thread_id: str, checkpoint_ns: str) -> None:
+        """ 只保留最近的检查点及其 writes """
+        cur.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.retention - 1),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return
+        for table in ("checkpoints", "writes"):
+            cur.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                (thread_id, checkpoint_ns, row[0]),
+            )
+
+    def _maybe_evict(self) -> None:
+        now = time.time()
+        if not self.ttl or now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        with self.saver.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE last_seen < ?", (now - self.ttl,))
+            expired = [row[0] for row in cur.fetchall()]
+        for thread_id in expired:
+            self.evict_thread(thread_id)
+        if expired:
+            with self.saver.cursor() as cur:
+                cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def evict_thread(self, thread_id: str) -> None:
+        """
+        删除一个会话的全部检查点
+
+        参数:
+            thread_id (str): 会话 ID
+        """
+        with self.saver.cursor() as cur:
+            for table in ("checkpoints", "writes", "thread_activity"):
+                cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (str(thread_id),))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        for item in await asyncio.to_thread(lambda: list(self.list(config, **kwargs))):
+            yield item
+
+    async def aput(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def get_next_version(self, current: Optional[str], channel: Any) -> str:
+        return self.saver.get_next_version(current, channel)
+
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """
+    根据环境变量创建检查点存储
+
+    返回:
+        BaseCheckpointSaver: `CHECKPOINTER=sqlite` 时为 BoundedSqliteSaver，否则为 BoundedMemorySaver
+    """
+    retention = int(os.getenv("CHECKPOINT_RETENTION", 20))
+    ttl = float(os.getenv("CHECKPOINT_THREAD_TTL", 86400)) or None
+    if os.getenv("CHECKPOINTER", "memory").lower() == "sqlite":
+        return BoundedSqliteSaver(os.getenv("CHECKPOINT_DB", "cache/checkpoints.sqlite3"), retention=retention, ttl=ttl)
+    return BoundedMemorySaver(retention=retention, ttl=ttl)
@@ -1,22 +1,50 @@
+import asyncio
+import logging
 import os
-from datetime import datetime
+import threading
+import time
 
 from langchain.schema import Document
-from langchain_community.document_loaders import TextLoader
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_core.runnables import RunnableConfig
-from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph.state import StateGraph, CompiledStateGraph, END
-from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
-from marker.output import text_from_rendered
 
+from chains.answer_cache import get_answer_cache
+from chains.context import build_context
 from chains.generate import GenerateChain
-from chains.summary import SummaryChain
+from chains.history import HistorySummaryChain, get_history_manager
+from chains.models import get_rerank
+from chains.rewriter import arewrite_query, rewrite_query
+from graph.checkpointer import create_checkpointer
 from graph.graph_state import GraphState
+from rerank.gating import get_rerank_gate
 from utils.common import get_current_time
+from utils.tracing import Span, content_sampled, get_logger, get_metrics, metric_name, span, traced
+from vectorstore.hybrid import ahybrid_search, hybrid_search
 
+logger = get_logger("graph")
+
+
+def get_param(state: GraphState, config: RunnableConfig, key: str, default=None):
+    """
+    读取单次请求的参数，优先使用 `config["configurable"]` 中的值，其次使用图状态中的值
+
+    模型名称、温度、搜索数量等参数通过 RunnableConfig 传入，所有会话可以共享同一个编译好的图。
+
+    参数:
+        state (GraphState): 当前图的状态
+        config (RunnableConfig): 可运行配置
+        key (str): 参数名称
+        default: 两处都没有时的默认值
+
+    返回:
+        参数值
+    """
+    configurable = (config or {}).get("configurable", {})
+    if configurable.get(key) is not None:
+        return configurable[key]
+    value = state.get(key) if state else None
+    return default if value is None else value
 
 def route_question(state: GraphState) -> str:
     """
@@ -28,7 +56,7 @@ def route_question(state: GraphState) -> str:
     返回:
         str: 下一个要调用的节点名称
     """
-    print("🤖 正在根据类型选择分支")
+    logger.debug("正在根据类型选择分支")
     if state['type'] == 'websearch':
         return "extract_keywords"
     if state['type'] == 'file':
@@ -36,31 +64,60 @@ def route_question(state: GraphState) -> str:
     elif state['type'] == 'chat':
         return "generate"
 
-def generate(state: GraphState) -> GraphState:
+def _history_args(state: GraphState, config: RunnableConfig) -> tuple:
+    """ 历史管理器的参数：当前问题之前的消息、已有摘要、已折叠的消息数量和摘要链 """
+    return (
+        state["messages"][:-1],
+        state.get("history_summary", ""),
+        state.get("summarized_count", 0),
+        HistorySummaryChain(os.getenv("HISTORY_SUMMARY_MODEL") or get_param(state, config, "model_name"), 0.0),
+    )
+
+def _generate_input(state: GraphState, history: str) -> dict:
+    return {
+        "question": state["messages"][-1].content,
+        "history": history,
+        # 合并重叠的 chunk 并按 token 预算装入，避免把 Document 的 repr 和元数据写进提示词
+        "documents": build_context(state["documents"]),
+        "current_date": get_current_time()
+    }
+
+@traced("node.generate")
+def generate(state: GraphState, config: RunnableConfig) -> GraphState:
     """
     根据文档和对话历史生成答案。
 
     参数:
         state (GraphState): 当前图的状态
+        config (RunnableConfig): 可运行配置
 
     返回:
         state (GraphState): 返回添加了LLM生成内容的新状态
     """
-    print("🤖 正在生成回答")
-    chain = GenerateChain(state["model_name"], state["temperature"])
-    messages = state["messages"]
-    state["messages"] = chain.invoke({
-        "question": messages[-1].content,
-        "history": messages[:-1],
-        "documents": state["documents"],
-        "current_date": get_current_time()
-    })
+    logger.debug("正在生成回答")
+    chain = GenerateChain(get_param(state, config, "model_name"), get_param(state, config, "temperature", 0.0))
+    # 历史超出 token 预算时，较早的消息被合并进摘要
+    history, state["history_summary"], state["summarized_count"] = get_history_manager().build(*_history_args(state, config))
+    state["messages"] = chain.invoke(_generate_input(state, history))
+    return state
+
+@traced("node.generate")
+async def agenerate(state: GraphState, config: RunnableConfig) -> GraphState:
+    """ `generate` 的异步版本 """
+    logger.debug("正在生成回答")
+    chain = GenerateChain(get_param(state, config, "model_name"), get_param(state, config, "temperature", 0.0))
+    history, state["history_summary"], state["summarized_count"] = await get_history_manager().abuild(*_history_args(state, config))
+    state["messages"] = await chain.ainvoke(_generate_input(state, history))
     return state
 
+@traced("node.file_process")
 def file_process(state: GraphState, config: RunnableConfig) -> GraphState:
     """
     处理文件
 
+    文件由后台导入队列处理（通常在上传时就已提交），这里最多等待 `INGEST_WAIT_TIMEOUT` 秒，
+    超时后直接使用已经写入向量存储的部分进行检索，回答时间不再取决于文件大小。
+
     参数:
         state (GraphState): 当前图的状态
         config (RunnableConfig): 可运行配置
@@ -69,42 +126,68 @@ def file_process(state: GraphState, config: RunnableConfig) -> GraphState:
         state (GraphState): 返回图状态，将文档添加 config 中的向量存储
     """
 
-    print("🤖 开始处理文件")
+    logger.debug("开始处理文件")
     vector_store = config["configurable"]["vectorstore"]
+    # 导入流水线（文本切分、PDF 转换）只在处理文件时才加载
+    from ingest.queue import get_ingestion_queue
+    ingestion_queue = get_ingestion_queue()
+    deadline = time.monotonic() + float(os.getenv("INGEST_WAIT_TIMEOUT", 10))
 
     for doc in state["documents"]:
         file_path: str = doc.page_content
         if os.path.exists(file_path):
-            print(f"📄 文件路径: {file_path}")
-            split_docs: list[Document] = None
-            if file_path.endswith(".txt") or file_path.endswith(".md"):
-                # 处理文本或Markdown文件
-                docs = TextLoader(file_path, autodetect_encoding=True).load()
-                # 文本分割
-                splitter = RecursiveCharacterTextSplitter(
-                    separators=["\n\n", "\n", " ", ".", ",", "\u200B", "\uff0c", "\u3001", "\uff0e", "\u3002", ""],
-                    chunk_size=512,
-                    chunk_overlap=256,
-                    add_start_index=True
-                )
-                split_docs = splitter.split_documents(docs)
+            logger.debug("文件路径: %s", file_path)
+            job = ingestion_queue.submit(file_path, vector_store)
+            if job.wait(timeout=max(0.0, deadline - time.monotonic())):
+                logger.info("文件导入%s: %s", "完成" if job.status == "done" else "失败", job.stats.summary())
             else:
-                # 使用 marker-pdf 处理其他文件
-                converter = PdfConverter(artifact_dict=create_model_dict())
-                rendered = converter(file_path)
-                docs, _, _ = text_from_rendered(rendered)
-                splitter = MarkdownHeaderTextSplitter(
-                    [("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3")],
-                    strip_headers = False
-                )
-                split_docs = splitter.split_text(docs)
-
-            # 将处理后的文档添加到向量存储中
-            vector_store.add_documents(split_docs)
+                logger.info("文件仍在后台导入，使用已导入的部分: %s", job.stats.summary())
         else:
-            print(f"📄 文件路径不存在: {file_path}")
+            logger.warning("文件路径不存在: %s", file_path)
     return state
 
+@traced("node.file_process")
+async def afile_process(state: GraphState, config: RunnableConfig) -> GraphState:
+    """ `file_process` 的异步版本，等待后台导入时不阻塞事件循环 """
+
+    logger.debug("开始处理文件")
+    vector_store = config["configurable"]["vectorstore"]
+    # 导入流水线（文本切分、PDF 转换）只在处理文件时才加载
+    from ingest.queue import get_ingestion_queue
+    ingestion_queue = get_ingestion_queue()
+    deadline = time.monotonic() + float(os.getenv("INGEST_WAIT_TIMEOUT", 10))
+
+    for doc in state["documents"]:
+        file_path: str = doc.page_content
+        if os.path.exists(file_path):
+            logger.debug("文件路径: %s", file_path)
+            job = ingestion_queue.submit(file_path, vector_store)
+            if await job.await_finished(timeout=max(0.0, deadline - time.monotonic())):
+                logger.info("文件导入%s: %s", "完成" if job.status == "done" else "失败", job.stats.summary())
+            else:
+                logger.info("文件仍在后台导入，使用已导入的部分: %s", job.stats.summary())
+        else:
+            logger.warning("文件路径不存在: %s", file_path)
+    return state
+
+def _use_hybrid_search() -> bool:
+    return os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+
+def _get_rerank(config: RunnableConfig):
+    """ 优先使用 config 中传入的 rerank 客户端，否则使用进程内共享的客户端 """
+    return config["configurable"].get("rerank") or get_rerank()
+
+def _log_documents(label: str, documents: list, scores: list = None) -> None:
+    """ DEBUG 级别记录召回或重排序后文档的来源和分数，文档内容只按 `LOG_CONTENT_SAMPLE_RATE` 采样记录 """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    with_content = content_sampled()
+    for idx, doc in enumerate(documents, start=1):
+        score = f" score={scores[idx - 1]:.4f}" if scores else ""
+        content = f"\n{doc.page_content}" if with_content else ""
+        logger.debug("[%s] [%d]%s source=%s%s", label, idx, score, doc.metadata.get("source"), content)
+
+@traced("node.extract_keywords")
 def extract_keywords(state: GraphState, config: RunnableConfig) -> GraphState:
     """
     从问题中提取关键词。
@@ -117,11 +200,12 @@ def extract_keywords(state: GraphState, config: RunnableConfig) -> GraphState:
         state (GraphState): 返回添加了提取关键词的新状态
     """
 
-    print("🤖 正在提取关键词")
-    chain = SummaryChain(state["model_name"], state["temperature"])
+    logger.debug("正在提取关键词")
     messages = state["messages"]
-    # query = chain.invoke({"question": messages[-1].content, "history": messages[:-1]})
-    query = chain.invoke({"question": messages[-1].content, "current_time": get_current_time()})
+    # 由 QUERY_REWRITER 选择 LLM 改写、本地启发式改写，或置信度不足时才调用 LLM
+    result = rewrite_query(messages[-1].content, get_param(state, config, "model_name"), get_param(state, config, "temperature", 0.0))
+    logger.debug("搜索查询(%s): %s", result.source, result.query)
+    query = AIMessage(result.query)
 
     if state["type"] == "websearch":
         # 将生成的搜索查询添加到消息列表中，下一个节点将会使用
@@ -129,23 +213,46 @@ def extract_keywords(state: GraphState, config: RunnableConfig) -> GraphState:
     elif state["type"] == "file":
         # 使用生成的搜索查询在向量数据库中搜索
         # docs = config["configurable"]["vectorstore"].max_marginal_relevance_search(query.content, 5)
-        docs_and_scores = config["configurable"]["vectorstore"].similarity_search_with_score(query.content, 20)
-        print(f" 📄 召回共{len(docs_and_scores)}篇文档:")
-        idx, docs, curr_time_str = 0, [], datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for doc, score in docs_and_scores:
-            docs.append(doc)
-            idx += 1
-            print(f"============= [Recall] [{curr_time_str}] [{idx}] Score:{score} Source:{doc.metadata['source']} =============")
-            print(doc.page_content)
-
-        # rerank
-        docs_result = config["configurable"]["rerank"].rerank(docs, query.content, 3)
-
-        idx = 0
-        for doc in (docs_result if docs_result else []):
-            idx += 1
-            print(f"============= [Rerank] [{curr_time_str}] [{idx}] Source:{doc.metadata['source']} =============")
-            print(doc.page_content)
+        vector_store = config["configurable"]["vectorstore"]
+        if _use_hybrid_search():
+            # 向量检索和 BM25 各召回 20 篇，RRF 融合后只把较少的候选交给 rerank
+            docs_and_scores = hybrid_search(vector_store, query.content, k=int(os.getenv("RETRIEVAL_CANDIDATES", 10)), fetch_k=20)
+        else:
+            docs_and_scores = vector_store.similarity_search_with_score(query.content, 20)
+        logger.debug("召回共%d篇文档", len(docs_and_scores))
+        _log_documents("Recall", [doc for doc, _ in docs_and_scores], [score for _, score in docs_and_scores])
+
+        # 根据召回分数的分布决定跳过 rerank、只重排序模糊区间或全部重排序
+        docs_result = get_rerank_gate().apply(_get_rerank(config), docs_and_scores, query.content, 3)
+        _log_documents("Rerank", docs_result or [])
+
+        state["documents"] = docs_result
+
+    return state
+
+@traced("node.extract_keywords")
+async def aextract_keywords(state: GraphState, config: RunnableConfig) -> GraphState:
+    """ `extract_keywords` 的异步版本，改写、嵌入和 rerank 均使用异步接口 """
+
+    logger.debug("正在提取关键词")
+    messages = state["messages"]
+    result = await arewrite_query(messages[-1].content, get_param(state, config, "model_name"), get_param(state, config, "temperature", 0.0))
+    logger.debug("搜索查询(%s): %s", result.source, result.query)
+    query = AIMessage(result.query)
+
+    if state["type"] == "websearch":
+        state["messages"] = query
+    elif state["type"] == "file":
+        vector_store = config["configurable"]["vectorstore"]
+        if _use_hybrid_search():
+            docs_and_scores = await ahybrid_search(vector_store, query.content, k=int(os.getenv("RETRIEVAL_CANDIDATES", 10)), fetch_k=20)
+        else:
+            docs_and_scores = await vector_store.asimilarity_search_with_score(query.content, 20)
+        logger.debug("召回共%d篇文档", len(docs_and_scores))
+        _log_documents("Recall", [doc for doc, _ in docs_and_scores], [score for _, score in docs_and_scores])
+
+        docs_result = await get_rerank_gate().aapply(_get_rerank(config), docs_and_scores, query.content, 3)
+        _log_documents("Rerank", docs_result or [])
 
         state["documents"] = docs_result
 
@@ -163,35 +270,73 @@ def decide_to_generate(state: GraphState) -> str:
     """
 
     if state["type"] == "websearch":
-        print("🌐 需要进行网络搜索")
+        logger.debug("需要进行网络搜索")
         return "websearch"
     elif state["type"] == "file":
-        print("⭐ 无需搜索，直接生成答案")
+        logger.debug("无需搜索，直接生成答案")
         return "generate"
 
-def web_search(state: GraphState) -> GraphState:
+def _log_search_results(documents: list) -> None:
+    """ 记录搜索结果的长度，结果内容只按 `LOG_CONTENT_SAMPLE_RATE` 采样记录 """
+    length = sum(len(doc.page_content) for doc in documents)
+    logger.debug("搜索完成，结果共 %d 字", length)
+    if documents and content_sampled():
+        logger.info("搜索结果:\n%s", documents[-1].page_content)
+
+def _web_search_tool(search_num: int):
+    """ 创建 Tavily 搜索工具，langchain_community 的工具模块较重，只在联网搜索时导入 """
+    from langchain_community.tools.tavily_search import TavilySearchResults
+    return TavilySearchResults(k = search_num)
+
+@traced("node.websearch")
+def web_search(state: GraphState, config: RunnableConfig) -> GraphState:
     """
     基于问题进行网络搜索。
 
     参数:
         state (GraphState): 当前图的状态
+        config (RunnableConfig): 可运行配置
 
     返回:
         state (GraphState): 返回添加了网络搜索结果的新状态
     """
 
-    print(f"🌐 正在进行网络搜索，搜索网页数量：{state['search_num']}...")
-    web_search_tool = TavilySearchResults(k = state["search_num"])
+    search_num = int(get_param(state, config, "search_num", 3))
+    logger.debug("正在进行网络搜索，搜索网页数量：%d", search_num)
+    web_search_tool = _web_search_tool(search_num)
     documents = state["documents"]
     try:
-        docs = web_search_tool.invoke({"query": state["messages"][-1].content})
-        web_results = "\n".join([d["content"] for d in docs])
+        with span("tavily", requested_results=search_num) as current:
+            docs = web_search_tool.invoke({"query": state["messages"][-1].content})
+            web_results = "\n".join([d["content"] for d in docs])
+            current.set(results=len(docs), response_chars=len(web_results))
         web_results = Document(page_content=web_results)
         documents.append(web_results)
         state["documents"] = documents
     except:
         pass
-    print(f"🌐 搜索结果:\n{documents[0].page_content}")
+    _log_search_results(documents)
+    return state
+
+@traced("node.websearch")
+async def aweb_search(state: GraphState, config: RunnableConfig) -> GraphState:
+    """ `web_search` 的异步版本 """
+
+    search_num = int(get_param(state, config, "search_num", 3))
+    logger.debug("正在进行网络搜索，搜索网页数量：%d", search_num)
+    web_search_tool = _web_search_tool(search_num)
+    documents = state["documents"]
+    try:
+        with span("tavily", requested_results=search_num) as current:
+            docs = await web_search_tool.ainvoke({"query": state["messages"][-1].content})
+            web_results = "\n".join([d["content"] for d in docs])
+            current.set(results=len(docs), response_chars=len(web_results))
+        web_results = Document(page_content=web_results)
+        documents.append(web_results)
+        state["documents"] = documents
+    except:
+        pass
+    _log_search_results(documents)
     return state
 
 def create_graph() -> CompiledStateGraph:
@@ -203,11 +348,11 @@ def create_graph() -> CompiledStateGraph:
     """
 
     workflow = StateGraph(GraphState)
-    # 添加节点
-    workflow.add_node("websearch", web_search)
-    workflow.add_node("extract_keywords", extract_keywords)
-    workflow.add_node("file_process", file_process)
-    workflow.add_node("generate", generate)
+    # 添加节点，同时注册同步和异步实现：`stream` 走同步版本，`astream` 走异步版本
+    workflow.add_node("websearch", RunnableLambda(web_search, afunc=aweb_search, name="websearch"))
+    workflow.add_node("extract_keywords", RunnableLambda(extract_keywords, afunc=aextract_keywords, name="extract_keywords"))
+    workflow.add_node("file_process", RunnableLambda(file_process, afunc=afile_process, name="file_process"))
+    workflow.add_node("generate", RunnableLambda(generate, afunc=agenerate, name="generate"))
     # 添加边
     workflow.set_conditional_entry_point(
         route_question,
@@ -229,12 +374,159 @@ def create_graph() -> CompiledStateGraph:
     workflow.add_edge("websearch", "generate")
     workflow.add_edge("generate", END)
 
-    # 创建图，并使用 `MemorySaver()` 在内存中保存状态
-    return workflow.compile(checkpointer=MemorySaver())
+    # 创建图，检查点存储由 `CHECKPOINTER` 选择，每个会话只保留最近的检查点，空闲会话会被淘汰
+    return workflow.compile(checkpointer=create_checkpointer())
+
+_graph: CompiledStateGraph = None
+_graph_lock = threading.Lock()
+
+def get_graph() -> CompiledStateGraph:
+    """
+    获取进程内共享的编译好的状态图，首次调用时创建。
+
+    图的拓扑与模型无关，所有会话共用同一个图，按会话区分的 thread_id、向量存储、rerank 以及
+    模型名称、温度都通过 RunnableConfig 传入，见 `get_param`。
+
+    返回:
+        CompiledStateGraph: 编译好的状态图
+    """
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = create_graph()
+        return _graph
+
+def _message_content(message) -> str:
+    """ 获取消息文本，兼容 dict 形式和 BaseMessage 形式的消息 """
+    return message["content"] if isinstance(message, dict) else message.content
+
+def _answer_cache_key(user_input: GraphState, config: dict) -> dict:
+    return dict(
+        question=_message_content(user_input["messages"][-1]),
+        model_name=get_param(user_input, config, "model_name"),
+        temperature=get_param(user_input, config, "temperature", 0.0),
+        mode=user_input["type"],
+        documents=user_input.get("documents"),
+    )
+
+def _cached_answer_update(user_input: GraphState, answer: str) -> dict:
+    """ 命中缓存时写入会话状态的内容 """
+    return {**user_input, "messages": list(user_input["messages"]) + [AIMessage(answer)]}
+
+# 流式输出的通道：回答和推理过程
+ANSWER = "answer"
+REASONING = "reasoning"
+
+def _channel_events(chunk, metadata: dict, reasoning: bool) -> list[tuple[str, str]]:
+    """
+    把 `stream_mode="messages"` 的一个输出拆分为 (通道, 文本)
+
+    只保留生成节点中回答模型的输出：其他节点的消息（如提取关键词节点写入状态的搜索查询）以及生成节点内
+    标记了其他 `stream_channel` 的 LLM 调用（如历史摘要）都会被丢弃。
+
+    参数:
+        chunk: 消息块
+        metadata (dict): 消息块的元数据，包含产生它的节点 `langgraph_node`
+        reasoning (bool): 是否输出推理过程
+
+    返回:
+        list[tuple[str, str]]: 通道和文本
+    """
+    if metadata.get("langgraph_node") != "generate" or metadata.get("stream_channel", ANSWER) != ANSWER:
+        return []
+    events = []
+    if reasoning and chunk.additional_kwargs.get("reasoning_content"):
+        events.append((REASONING, chunk.additional_kwargs["reasoning_content"]))
+    if chunk.content:
+        events.append((ANSWER, chunk.content))
+    return events
+
+class _AnswerTimer:
+    """
+    记录单次请求的首个回答 token 延迟（从开始流式输出到用户看到第一个回答 token），
+    结束时写入 `answer` span，指标按对话类型和是否命中答案缓存区分
+    """
+
+    def __init__(self, mode: str):
+        self.span = Span("answer", {"mode": mode, "cached": "false"})
+        self.start = time.perf_counter()
+        self.chars = 0
+
+    def observe(self, channel: str, text: str) -> None:
+        elapsed = time.perf_counter() - self.start
+        if channel == REASONING:
+            self.span.attributes.setdefault("reasoning_ttft_seconds", elapsed)
+            return
+        if not self.chars:
+            self.span.set(ttft_seconds=elapsed)
+        self.chars += len(text)
+
+    def finish(self, cached: bool = False, error: BaseException = None) -> None:
+        self.span.labels["cached"] = "true" if cached else "false"
+        self.span.set(answer_chars=self.chars)
+        if error is not None:
+            self.span.error = repr(error)
+        ttft = self.span.attributes.get("ttft_seconds")
+        logger.debug("首个回答 token: %s，总耗时 %.0f ms", f"{ttft * 1000:.0f} ms" if ttft is not None else "-",
+                     (time.perf_counter() - self.start) * 1000)
+        self.span.finish(time.perf_counter() - self.start)
+
+def stream_graph_events(graph: CompiledStateGraph, user_input: GraphState, config: dict, reasoning: bool = False):
+    """
+    流式运行图，按通道返回回答和（可选的）推理过程。
+
+    只输出生成节点中回答模型的 token，提取关键词、历史摘要等其他 LLM 调用的输出不会混入回答；
+    每次请求的首个回答 token 延迟记录在 `chatbot_answer_ttft_seconds` 指标中。
+
+    开启语义答案缓存时，会话中的第一个离线对话问题先查询缓存，命中后直接流式返回缓存的答案，
+    并把问答写入会话状态，保证后续的连续对话可以看到这一轮。
+
+    参数:
+        graph (CompiledStateGraph): 编译好的状态图
+        user_input (GraphState): 用户输入的状态
+        config (dict): 配置字典
+        reasoning (bool): 是否输出推理模型的推理过程
+
+    返回:
+        generator: 生成器对象，逐步返回 (通道, 文本)，通道为 `ANSWER` 或 `REASONING`
+    """
+
+    timer = _AnswerTimer(user_input["type"])
+    answer_cache = get_answer_cache()
+    cache_key = None
+    try:
+        # 缓存的答案不依赖对话历史，只对会话中的第一个问题使用
+        if answer_cache and user_input["type"] == "chat" and not graph.get_state(config).values.get("messages"):
+            cache_key = _answer_cache_key(user_input, config)
+            answer = answer_cache.lookup(**cache_key)
+            get_metrics().inc(metric_name("answer_cache_lookups_total"), result="miss" if answer is None else "hit")
+            if answer is not None:
+                for start in range(0, len(answer), 16):
+                    timer.observe(ANSWER, answer[start:start + 16])
+                    yield ANSWER, answer[start:start + 16]
+                graph.update_state(config, _cached_answer_update(user_input, answer), as_node="generate")
+                timer.finish(cached=True)
+                return
+
+        chunks = []
+        for chunk, metadata in graph.stream(user_input, config, stream_mode="messages"):
+            for channel, text in _channel_events(chunk, metadata, reasoning):
+                timer.observe(channel, text)
+                if channel == ANSWER:
+                    chunks.append(text)
+                yield channel, text
+
+        if cache_key:
+            answer_cache.store(answer="".join(chunks), **cache_key)
+    except BaseException as e:
+        # 调用方提前结束迭代（客户端断开）不计为错误
+        timer.finish(error=e if isinstance(e, Exception) else None)
+        raise
+    timer.finish()
 
 def stream_graph_updates(graph: CompiledStateGraph, user_input: GraphState, config: dict):
     """
-    流式处理图更新并返回最终结果。
+    流式处理图更新并返回回答，见 `stream_graph_events`
 
     参数:
         graph (CompiledStateGraph): 编译好的状态图
@@ -242,8 +534,70 @@ def stream_graph_updates(graph: CompiledStateGraph, user_input: GraphState, conf
         config (dict): 配置字典
 
     返回:
-        generator: 生成器对象，逐步返回图更新的内容
+        generator: 生成器对象，逐步返回回答的文本
+    """
+    for _, text in stream_graph_events(graph, user_input, config):
+        yield text
+
+async def astream_graph_events(graph: CompiledStateGraph, user_input: GraphState, config: dict, reasoning: bool = False):
     """
+    `stream_graph_events` 的异步版本，基于 `graph.astream` 运行各节点的异步实现，
+    等待 LLM、搜索和 rerank 时不占用线程，一个事件循环可以同时服务多个会话。
 
-    for chunk, _ in graph.stream(user_input, config, stream_mode="messages"):
-        yield chunk.content
+    参数:
+        graph (CompiledStateGraph): 编译好的状态图
+        user_input (GraphState): 用户输入的状态
+        config (dict): 配置字典
+        reasoning (bool): 是否输出推理模型的推理过程
+
+    返回:
+        async generator: 异步生成器，逐步返回 (通道, 文本)
+    """
+
+    timer = _AnswerTimer(user_input["type"])
+    answer_cache = get_answer_cache()
+    cache_key = None
+    try:
+        if answer_cache and user_input["type"] == "chat" and not (await graph.aget_state(config)).values.get("messages"):
+            cache_key = _answer_cache_key(user_input, config)
+            # 缓存查询需要嵌入问题，放到线程池中执行
+            answer = await asyncio.to_thread(answer_cache.lookup, **cache_key)
+            get_metrics().inc(metric_name("answer_cache_lookups_total"), result="miss" if answer is None else "hit")
+            if answer is not None:
+                for start in range(0, len(answer), 16):
+                    timer.observe(ANSWER, answer[start:start + 16])
+                    yield ANSWER, answer[start:start + 16]
+                await graph.aupdate_state(config, _cached_answer_update(user_input, answer), as_node="generate")
+                timer.finish(cached=True)
+                return
+
+        chunks = []
+        async for chunk, metadata in graph.astream(user_input, config, stream_mode="messages"):
+            for channel, text in _channel_events(chunk, metadata, reasoning):
+                timer.observe(channel, text)
+                if channel == ANSWER:
+                    chunks.append(text)
+                yield channel, text
+
+        if cache_key:
+            await asyncio.to_thread(answer_cache.store, answer="".join(chunks), **cache_key)
+    except BaseException as e:
+        # 调用方提前结束迭代（客户端断开）不计为错误
+        timer.finish(error=e if isinstance(e, Exception) else None)
+        raise
+    timer.finish()
+
+async def astream_graph_updates(graph: CompiledStateGraph, user_input: GraphState, config: dict):
+    """
+    `stream_graph_updates` 的异步版本，见 `astream_graph_events`
+
+    参数:
+        graph (CompiledStateGraph): 编译好的状态图
+        user_input (GraphState): 用户输入的状态
+        config (dict): 配置字典
+
+    返回:
+        async generator: 异步生成器，逐步返回回答的文本
+    """
+    async for _, text in astream_graph_events(graph, user_input, config):
+        yield text
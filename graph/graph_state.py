@@ -7,10 +7,12 @@ class GraphState(TypedDict):
     定义图状态的类型字典。
     用于表示图中的状态信息。
     """
-    model_name: str                             # 使用的模型名称
-    temperature: float                          #  模型温度
+    model_name: str                             # 使用的模型名称，config 中的 model_name 优先
+    temperature: float                          #  模型温度，config 中的 temperature 优先
     embedding_model_name: str                   # 使用的嵌入模型名称
     type: Literal["websearch", "file", "chat"]  # 操作类型，包括联网搜索、上传文件和聊天
     messages: Annotated[list, add_messages]     # 消息列表，使用add_messages注解处理消息追加
     documents: Optional[list] = []              # 文档列表，默认为空列表
-    search_num: int = 3                         # 搜索返回的网页数据数量，默认为3
+    search_num: int = 3                         # 搜索返回的网页数据数量，默认为3，config 中的 search_num 优先
+    history_summary: str = ""                   # 已移出历史窗口的对话摘要
+    summarized_count: int = 0                   # 已经合并进摘要的消息数量
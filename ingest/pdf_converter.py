@@ -0,0 +1,210 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from utils.tracing import Span, span
+
+# 每个进程只加载一次的 marker 模型（布局、OCR 等）
+_models = None
+_models_lock = threading.Lock()
+
+
+def _load_models():
+    """ 在当前进程中加载 marker 模型，已加载时直接返回 """
+    global _models
+    with _models_lock:
+        if _models is None:
+            from marker.models import create_model_dict
+            from utils.startup import patch_torch_classes
+            _models = create_model_dict()
+            # 在 Streamlit 进程内转换时 torch 在这里第一次被导入
+            patch_torch_classes()
+        return _models
+
+
+def _convert(file_path: str) -> str:
+    """ 使用当前进程中的 marker 模型将 PDF 转换为 markdown """
+    from marker.converters.pdf import PdfConverter
+    from marker.output import text_from_rendered
+
+    converter = PdfConverter(artifact_dict=_load_models())
+    text, _, _ = text_from_rendered(converter(file_path))
+    return text
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    计算文件内容的 sha256
+
+    参数:
+        file_path (str): 文件路径
+
+    返回:
+        str: 十六进制的哈希值
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PdfConversionPool:
+    """
+    进程内共享的 PDF 转换池。
+
+    `workers > 0` 时在独立的工作进程中转换，每个工作进程启动时加载一次 marker 模型并复用，
+    CPU 密集的转换不会阻塞 Streamlit 服务线程；`workers == 0` 时在当前进程中转换，模型同样只加载一次。
+    转换结果按文件内容哈希缓存为 markdown 文件，重复上传同一个 PDF 时直接读取缓存，
+    同一文件的并发转换请求会合并为一次。
+    工作进程异常退出（例如内存不足被杀死）后进程池不可再用，此时关闭并丢弃进程池，转换在新的进程池中重试一次。
+    """
+
+    def __init__(self, workers: int = 1, cache_dir: Optional[str] = "cache/pdf"):
+        """
+        参数:
+            workers (int): 工作进程数量，为 0 时在当前进程中转换
+            cache_dir (Optional[str]): markdown 缓存目录，为空时不缓存
+        """
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: dict[str, Future] = {}
+        # 转换已完成时 add_done_callback 会在持锁的线程中直接回调，因此使用可重入锁
+        self._lock = threading.RLock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # torch 在 fork 出的子进程中可能死锁，使用 spawn 启动工作进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_models,
+            )
+        return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        """ 丢弃已损坏的进程池，下一次提交时重新创建 """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, file_path: str) -> tuple[Future, ProcessPoolExecutor]:
+        """ 提交到进程池，进程池已损坏时换一个新的进程池，调用方持有锁 """
+        executor = self._get_executor()
+        try:
+            return executor.submit(_convert, file_path), executor
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            return executor.submit(_convert, file_path), executor
+
+    def _cache_path(self, digest: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, f"{digest}.md") if self.cache_dir else None
+
+    def convert(self, file_path: str, timeout: Optional[float] = None) -> str:
+        """
+        将 PDF 转换为 markdown，优先读取缓存
+
+        参数:
+            file_path (str): PDF 文件路径
+            timeout (Optional[float]): 等待转换完成的超时时间（秒），为空时一直等待
+
+        返回:
+            str: 转换后的 markdown 文本
+        """
+        with span("marker", file_bytes=os.path.getsize(file_path)) as current:
+            digest = file_sha256(file_path)
+            cache_path = self._cache_path(digest)
+            current.set(cache_hit=bool(cache_path and os.path.exists(cache_path)))
+            if current.attributes["cache_hit"]:
+                print(f"📄 命中 PDF 转换缓存: {file_path}")
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    return f.read()
+
+            try:
+                markdown = self._convert_once(file_path, digest, timeout, current)
+            except BrokenProcessPool:
+                print(f"⚠️ PDF 转换进程异常退出，重建进程池后重试: {file_path}")
+                current.set(retried=True)
+                markdown = self._convert_once(file_path, digest, timeout, current)
+            current.set(output_chars=len(markdown))
+            return markdown
+
+    def _convert_once(self, file_path: str, digest: str, timeout: Optional[float], current: Span) -> str:
+        with self._lock:
+            future = self._inflight.get(digest)
+            if future is not None and future.done() and isinstance(future.exception(), BrokenProcessPool):
+                # 已失败但回调还没来得及移除的转换不再合并
+                future = None
+            owner = future is None
+            if owner:
+                executor = None
+                if self.workers > 0:
+                    future, executor = self._submit(file_path)
+                else:
+                    future = Future()
+                self._inflight[digest] = future
+                future.add_done_callback(lambda f: self._on_done(digest, f, executor))
+        # 同一文件正在由其他调用方转换时等待同一个结果
+        current.set(joined=not owner)
+
+        if owner and self.workers <= 0:
+            try:
+                future.set_result(_convert(file_path))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result(timeout=timeout)
+
+    def _on_done(self, digest: str, future: Future, executor: Optional[ProcessPoolExecutor] = None) -> None:
+        """ 转换完成后写入缓存，即使发起请求的调用方已经等待超时；工作进程异常退出时丢弃进程池 """
+        with self._lock:
+            if self._inflight.get(digest) is future:
+                del self._inflight[digest]
+        if future.cancelled():
+            return
+        if isinstance(future.exception(), BrokenProcessPool) and executor is not None:
+            self._discard_executor(executor)
+            return
+        cache_path = self._cache_path(digest)
+        if cache_path and future.exception() is None:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(future.result())
+            os.replace(tmp_path, cache_path)
+
+    def shutdown(self) -> None:
+        """ 关闭工作进程 """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+_pdf_pool: Optional[PdfConversionPool] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_conversion_pool() -> PdfConversionPool:
+    """
+    获取进程内共享的 PDF 转换池，首次调用时根据环境变量创建
+
+    返回:
+        PdfConversionPool: PDF 转换池
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = PdfConversionPool(
+                workers=int(os.getenv("PDF_WORKERS", 1)),
+                cache_dir=os.getenv("PDF_CACHE_DIR", "cache/pdf"),
+            )
+        return _pdf_pool
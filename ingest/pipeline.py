@@ -0,0 +1,258 @@
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+
+from ingest.pdf_converter import get_pdf_conversion_pool
+
+# 文本文件的切分参数
+TEXT_SEPARATORS = ["\n\n", "\n", " ", ".", ",", "\u200B", "\uff0c", "\u3001", "\uff0e", "\u3002", ""]
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 256
+_NON_BLANK = re.compile(r"\S")
+
+
+@dataclass
+class StageStats:
+    """ 单个流水线阶段的统计信息 """
+    items: int = 0          # 处理的条目数（字符数或 chunk 数）
+    seconds: float = 0.0    # 累计耗时（秒）
+
+    @property
+    def throughput(self) -> float:
+        """ 每秒处理的条目数 """
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class IngestStats:
+    """ 一次文件导入的进度和各阶段统计信息 """
+    file_path: str
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    load: StageStats = field(default_factory=StageStats)    # 读取，items 为字符数
+    split: StageStats = field(default_factory=StageStats)   # 切分，items 为 chunk 数
+    embed: StageStats = field(default_factory=StageStats)   # 嵌入，items 为 chunk 数
+    index: StageStats = field(default_factory=StageStats)   # 写入向量存储，items 为 chunk 数
+
+    @property
+    def chunks_indexed(self) -> int:
+        """ 已经可以被检索到的 chunk 数量 """
+        return self.index.items
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def summary(self) -> str:
+        return (f"读取 {self.load.items} 字符, 切分 {self.split.items} 块, 嵌入 {self.embed.items} 块 "
+                f"({self.embed.throughput:.1f} 块/秒), 写入 {self.index.items} 块, 耗时 {self.elapsed:.2f}s")
+
+
+def _detect_encoding(file_path: str) -> str:
+    """ 检测文本文件编码，优先使用 utf-8，与 TextLoader(autodetect_encoding=True) 的行为一致 """
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            for _ in iter(lambda: f.read(1 << 20), ""):
+                pass
+        return "utf-8"
+    except UnicodeDecodeError:
+        from langchain_community.document_loaders.helpers import detect_file_encodings
+        for detected in detect_file_encodings(file_path):
+            try:
+                with open(file_path, "r", encoding=detected.encoding) as f:
+                    for _ in iter(lambda: f.read(1 << 20), ""):
+                        pass
+                return detected.encoding
+            except UnicodeDecodeError:
+                continue
+    raise RuntimeError(f"Unable to decode {file_path}")
+
+
+def _read_text_blocks(file_path: str, block_chars: int) -> Iterator[str]:
+    """ 按块读取文本文件 """
+    with open(file_path, "r", encoding=_detect_encoding(file_path)) as f:
+        yield from iter(lambda: f.read(block_chars), "")
+
+
+def iter_text_chunks(file_path: str, stats: IngestStats, block_chars: int = 65536) -> Iterator[Document]:
+    """
+    增量读取并切分文本或 Markdown 文件，每次只在内存中保留一个读取块和未定型的尾部。
+
+    每读入一块，就对“上次留下的尾部 + 新块”重新切分；距离缓冲区末尾不足两个 chunk 的切分结果
+    可能随后续文本变化，留到下一轮，其余的直接产出，`start_index` 为其在整个文件中的字符偏移，
+    `next_index` 为其后第一个非空白字符的偏移，用于判断两个 chunk 之间是否只隔着切分时去掉的空白。
+
+    参数:
+        file_path (str): 文件路径
+        stats (IngestStats): 导入统计信息，读取和切分阶段的数据会累加到其中
+        block_chars (int): 每次读取的字符数
+
+    返回:
+        Iterator[Document]: 切分后的文档块
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        separators=TEXT_SEPARATORS,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True
+    )
+    buffer, buffer_offset = "", 0
+    blocks = _read_text_blocks(file_path, block_chars)
+    while True:
+        start = time.perf_counter()
+        block = next(blocks, None)
+        stats.load.seconds += time.perf_counter() - start
+        if block is not None:
+            stats.load.items += len(block)
+            buffer += block
+
+        start = time.perf_counter()
+        chunks = splitter.create_documents([buffer], metadatas=[{"source": file_path}])
+        cut = len(buffer) - 2 * CHUNK_SIZE if block is not None else len(buffer) + 1
+        ready = [chunk for chunk in chunks if chunk.metadata["start_index"] < cut]
+        pending = chunks[len(ready):]
+        consumed = max((chunk.metadata["start_index"] + len(chunk.page_content) for chunk in chunks), default=len(buffer))
+        stats.split.seconds += time.perf_counter() - start
+        stats.split.items += len(ready)
+
+        for chunk in ready:
+            # 空白一直延续到缓冲区末尾时以缓冲区末尾为准，只会少合并、不会误合并
+            match = _NON_BLANK.search(buffer, chunk.metadata["start_index"] + len(chunk.page_content))
+            chunk.metadata["next_index"] = (match.start() if match else len(buffer)) + buffer_offset
+            chunk.metadata["start_index"] += buffer_offset
+            yield chunk
+
+        if block is None:
+            return
+        if pending:
+            tail_start = pending[0].metadata["start_index"]
+            buffer, buffer_offset = buffer[tail_start:], buffer_offset + tail_start
+        else:
+            # 缓冲区中的 chunk 已全部产出，之后只剩空白字符（或缓冲区中只有空白字符），从最后一个 chunk 的结尾继续
+            buffer, buffer_offset = buffer[consumed:], buffer_offset + consumed
+
+
+def iter_pdf_chunks(file_path: str, stats: IngestStats) -> Iterator[Document]:
+    """
+    将 PDF 转换为 Markdown 后按标题切分
+
+    参数:
+        file_path (str): 文件路径
+        stats (IngestStats): 导入统计信息
+
+    返回:
+        Iterator[Document]: 切分后的文档块
+    """
+    start = time.perf_counter()
+    text = get_pdf_conversion_pool().convert(file_path)
+    stats.load.seconds += time.perf_counter() - start
+    stats.load.items += len(text)
+
+    start = time.perf_counter()
+    splitter = MarkdownHeaderTextSplitter(
+        [("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3")],
+        strip_headers=False
+    )
+    chunks = splitter.split_text(text)
+    stats.split.seconds += time.perf_counter() - start
+    stats.split.items += len(chunks)
+    for chunk in chunks:
+        chunk.metadata["source"] = file_path
+        yield chunk
+
+
+def _batched(chunks: Iterator[Document], batch_size: int) -> Iterator[List[Document]]:
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_file(
+        file_path: str,
+        vector_store,
+        batch_size: int = 64,
+        max_inflight: int = 4,
+        on_progress: Optional[Callable[[IngestStats], None]] = None,
+        stats: Optional[IngestStats] = None,
+) -> IngestStats:
+    """
+    以流水线方式导入文件：生成器读取 -> 增量切分 -> 并发嵌入批次 -> 增量写入向量存储。
+
+    最多同时有 `max_inflight` 个批次在嵌入，超过时等待最早的批次完成并写入后再继续读取，
+    因此内存中的 chunk 和向量数量有上限；每个批次写入后即可被检索到。
+    向量存储提供 `add_embeddings` 时由流水线负责嵌入，否则退化为逐批调用 `add_documents`。
+
+    参数:
+        file_path (str): 文件路径
+        vector_store: 向量存储
+        batch_size (int): 每个嵌入批次的 chunk 数量
+        max_inflight (int): 同时嵌入的批次数量上限
+        on_progress (Optional[Callable[[IngestStats], None]]): 每写入一个批次后的回调
+        stats (Optional[IngestStats]): 外部传入的统计对象，用于在导入过程中查询进度
+
+    返回:
+        IngestStats: 导入统计信息
+    """
+    stats = stats or IngestStats(file_path)
+    if file_path.endswith(".txt") or file_path.endswith(".md"):
+        chunks = iter_text_chunks(file_path, stats)
+    else:
+        chunks = iter_pdf_chunks(file_path, stats)
+
+    embeddings = vector_store.embeddings
+    pipelined = hasattr(vector_store, "add_embeddings")
+
+    def embed(batch: List[Document]) -> Tuple[List[Document], List[List[float]], float]:
+        start = time.perf_counter()
+        vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+        return batch, vectors, time.perf_counter() - start
+
+    def write(future: Future) -> None:
+        batch, vectors, seconds = future.result()
+        stats.embed.items += len(batch)
+        stats.embed.seconds += seconds
+        start = time.perf_counter()
+        vector_store.add_embeddings(batch, vectors)
+        stats.index.seconds += time.perf_counter() - start
+        stats.index.items += len(batch)
+        if on_progress:
+            on_progress(stats)
+
+    if not pipelined:
+        for batch in _batched(chunks, batch_size):
+            start = time.perf_counter()
+            vector_store.add_documents(batch)
+            stats.index.seconds += time.perf_counter() - start
+            stats.embed.items += len(batch)
+            stats.index.items += len(batch)
+            if on_progress:
+                on_progress(stats)
+        stats.finished_at = time.time()
+        return stats
+
+    inflight: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        try:
+            for batch in _batched(chunks, batch_size):
+                if len(inflight) >= max_inflight:
+                    write(inflight.popleft())
+                inflight.append(executor.submit(embed, batch))
+            # 按提交顺序写入，保证 chunk 在向量存储中的顺序与文件一致
+            while inflight:
+                write(inflight.popleft())
+        finally:
+            for future in inflight:
+                future.cancel()
+    stats.finished_at = time.time()
+    return stats
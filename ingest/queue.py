@@ -0,0 +1,183 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ingest.pipeline import IngestStats, ingest_file
+
+
+@dataclass
+class IngestJob:
+    """ 一个后台文件导入任务 """
+    file_path: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "pending"                 # pending / running / done / failed
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    stats: IngestStats = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.stats is None:
+            self.stats = IngestStats(self.file_path)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待任务完成
+
+        参数:
+            timeout (Optional[float]): 最长等待时间（秒），为空时一直等待
+
+        返回:
+            bool: 任务是否已经结束（成功或失败）
+        """
+        if self.future is not None:
+            try:
+                self.future.result(timeout=timeout)
+            except Exception:
+                pass
+        return self.finished
+
+    async def await_finished(self, timeout: Optional[float] = None) -> bool:
+        """ `wait` 的异步版本，等待期间不阻塞事件循环 """
+        if self.future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future)), timeout)
+            except Exception:
+                pass
+        return self.finished
+
+    def describe(self) -> dict:
+        """ 返回任务状态，用于在界面或接口中展示 """
+        return {
+            "job_id": self.job_id,
+            "file_path": self.file_path,
+            "status": self.status,
+            "error": self.error,
+            "chunks_indexed": self.stats.chunks_indexed,
+            "progress": self.stats.summary(),
+        }
+
+
+class IngestionQueue:
+    """
+    后台文件导入队列。
+
+    文件上传后立即提交导入任务，由固定数量的工作线程执行 `ingest_file`，提问链路不再等待整个文件导入完成。
+    同一个向量存储中的同一个文件只会导入一次，重复提交返回已有的任务（失败的任务除外）；
+    去重记录只弱引用向量存储，向量存储被回收后其记录随之删除；向量存储提供 `has_source` 时，
+    已完成的文件如果不在向量存储中了（例如会话的命名空间被淘汰），再次提交时重新导入。
+    文件内容变化后以 `replace=True` 提交，新任务等待同一文件的旧任务结束，删除旧内容（向量存储提供 `remove_source` 时）后重新导入。
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished_jobs: int = 1000):
+        """
+        参数:
+            max_workers (int): 同时执行导入任务的工作线程数量
+            max_finished_jobs (int): 最多保留的已结束任务数量，超过后丢弃最早的任务记录
+        """
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: dict[str, IngestJob] = {}
+        self._by_store: weakref.WeakKeyDictionary[object, dict[str, IngestJob]] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def submit(self, file_path: str, vector_store, replace: bool = False) -> IngestJob:
+        """
+        提交导入任务
+
+        参数:
+            file_path (str): 文件路径
+            vector_store: 目标向量存储
+            replace (bool): 文件内容已经变化，删除该文件之前导入的内容后重新导入
+
+        返回:
+            IngestJob: 新建的任务，或者同一文件已有的任务
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            store_jobs = self._by_store.setdefault(vector_store, {})
+            previous = store_jobs.get(path)
+            if previous is not None and previous.status != "failed" and not replace:
+                has_source = getattr(vector_store, "has_source", None)
+                if previous.status != "done" or has_source is None or has_source(previous.file_path):
+                    return previous
+                print(f"📄 文件已不在向量存储中（会话的向量存储已被释放），重新导入: {file_path}")
+            job = IngestJob(file_path)
+            self._jobs[job.job_id] = job
+            store_jobs[path] = job
+            job.future = self._executor.submit(self._run, job, vector_store, previous if replace else None)
+            self._prune()
+        return job
+
+    def _run(self, job: IngestJob, vector_store, previous: Optional[IngestJob] = None) -> None:
+        if previous is not None:
+            # 旧任务先于新任务提交，已经在执行或排在前面，等它结束后再删除旧内容，避免旧内容在删除后才写入
+            previous.wait()
+            remove_source = getattr(vector_store, "remove_source", None)
+            if remove_source is not None:
+                removed = remove_source(job.file_path)
+                print(f"📄 文件内容已变化，删除旧内容 {removed} 个 chunk 后重新导入: {job.file_path}")
+        job.status = "running"
+        print(f"📄 开始后台导入: {job.file_path}")
+        try:
+            ingest_file(
+                job.file_path,
+                vector_store,
+                batch_size=int(os.getenv("INGEST_BATCH_SIZE", 64)),
+                max_inflight=int(os.getenv("INGEST_MAX_INFLIGHT", 4)),
+                stats=job.stats,
+            )
+            job.status = "done"
+            print(f"📄 后台导入完成: {job.stats.summary()}")
+        except Exception as e:
+            job.status, job.error = "failed", repr(e)
+            print(f"❌ 后台导入失败: {job.file_path} {e!r}")
+            raise
+
+    def _prune(self) -> None:
+        finished = [job for job in self._jobs.values() if job.finished]
+        expired = finished[:max(0, len(finished) - self.max_finished_jobs)]
+        for job in expired:
+            del self._jobs[job.job_id]
+        if expired:
+            expired_ids = {job.job_id for job in expired}
+            for store_jobs in self._by_store.values():
+                for path in [path for path, job in store_jobs.items() if job.job_id in expired_ids]:
+                    del store_jobs[path]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """ 根据任务 ID 获取任务 """
+        return self._jobs.get(job_id)
+
+    def status(self) -> list[dict]:
+        """ 返回所有任务的状态 """
+        with self._lock:
+            return [job.describe() for job in self._jobs.values()]
+
+
+_ingestion_queue: Optional[IngestionQueue] = None
+_ingestion_queue_lock = threading.Lock()
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    """
+    获取进程内共享的导入队列，首次调用时根据环境变量创建
+
+    返回:
+        IngestionQueue: 导入队列
+    """
+    global _ingestion_queue
+    with _ingestion_queue_lock:
+        if _ingestion_queue is None:
+            _ingestion_queue = IngestionQueue(max_workers=int(os.getenv("INGEST_WORKERS", 2)))
+        return _ingestion_queue
@@ -4,7 +4,7 @@ from dotenv import load_dotenv
 from langchain.schema import Document
 from langchain_core.messages import AIMessage, HumanMessage
 from chains.models import load_vector_store
-from graph.graph import create_graph, stream_graph_updates, GraphState
+from graph.graph import get_graph, stream_graph_updates, GraphState
 from utils.common import *
 from utils import pretty
 
@@ -15,15 +15,15 @@ def main():
     # 创建状态图以及对话相关的设置
     config = {"configurable": {
         "thread_id": uuid.uuid4().hex,
-        "vectorstore": load_vector_store("BAAI/bge-large-zh-v1.5")}
+        "vectorstore": load_vector_store("BAAI/bge-large-zh-v1.5"),
+        "model_name": "Qwen/QwQ-32B",
+        "temperature": 0.0}
     }
     state = GraphState(
-        model_name="Qwen/QwQ-32B",
-        temperature=0.0,
         type="chat",
         documents=[Document(page_content="upload_files/test.pdf")],
     )
-    graph = create_graph()
+    graph = get_graph()
 
     # 生成 mermaid 图
     # gen_mermaid(graph, "graph.mmd")
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.documents import Document
+
+from utils.tracing import get_logger, get_metrics, metric_name
+
+logger = get_logger("rerank")
+
+
+@dataclass
+class RerankDecision:
+    """ 一次重排序决策 """
+    action: str         # skip：不重排序；partial：只重排序模糊区间；full：全部重排序
+    start: int = 0      # 需要重排序的区间起点（partial 时有效）
+    end: int = 0        # 需要重排序的区间终点（不含，partial 时有效）
+    reason: str = ""
+
+
+class RerankGate:
+    """
+    根据召回分数分布决定是否调用远程重排序模型。
+
+    分数按全体候选的极差归一化，因此同时适用于余弦相似度和 RRF 融合分数：
+    - 候选数量不超过 top_k 或过少时直接跳过；
+    - 第 k 名与第 k+1 名之间的归一化差距足够大，说明前 k 名已经明确，跳过；
+    - 否则只把第 k 名分数附近 `band` 范围内的候选（模糊区间）送去重排序，明显领先的候选直接保留，
+      明显落后的候选直接丢弃；模糊区间覆盖全部候选时完整重排序。
+    重排序的平均耗时超过延迟预算时，重排序区间收窄到第 k 名前后各 `degraded_window` 个候选，
+    收窄后仍覆盖全部候选时跳过重排序。
+    """
+
+    def __init__(self, skip_gap: float = 0.25, band: float = 0.15, min_candidates: int = 5,
+                 latency_budget: float = 0.8, ewma_alpha: float = 0.2, degraded_window: int = 2):
+        """
+        参数:
+            skip_gap (float): 第 k 名与第 k+1 名的归一化分差达到该值时跳过重排序
+            band (float): 模糊区间相对第 k 名分数的归一化宽度
+            min_candidates (int): 候选数量少于该值时跳过重排序
+            latency_budget (float): 重排序的延迟预算（秒）
+            ewma_alpha (float): 重排序耗时指数滑动平均的系数
+            degraded_window (int): 超出延迟预算时，第 k 名前后各保留多少个候选送去重排序
+        """
+        self.skip_gap = skip_gap
+        self.band = band
+        self.min_candidates = min_candidates
+        self.latency_budget = latency_budget
+        self.ewma_alpha = ewma_alpha
+        self.degraded_window = degraded_window
+        self.latency_ewma: Optional[float] = None
+        self.decisions: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def decide(self, scores: list[float], top_k: int) -> RerankDecision:
+        """
+        根据按降序排列的召回分数做出决策
+
+        参数:
+            scores (list[float]): 召回分数，按降序排列
+            top_k (int): 最终需要的文档数量
+
+        返回:
+            RerankDecision: 重排序决策
+        """
+        n = len(scores)
+        if n <= top_k or n < self.min_candidates:
+            return RerankDecision("skip", reason=f"only {n} candidates")
+        spread = scores[0] - scores[-1]
+        if spread <= 0:
+            start, end, reason = 0, n, "flat scores"
+        else:
+            gap = (scores[top_k - 1] - scores[top_k]) / spread
+            if gap >= self.skip_gap:
+                return RerankDecision("skip", reason=f"top-{top_k} gap {gap:.2f}")
+            pivot = scores[top_k - 1]
+            start = next(i for i, s in enumerate(scores) if (s - pivot) / spread <= self.band)
+            end = next((i for i, s in enumerate(scores) if (pivot - s) / spread > self.band), n)
+            reason = f"ambiguous band [{start}, {end})"
+
+        if self.latency_ewma is not None and self.latency_ewma > self.latency_budget:
+            # 超出延迟预算：只重排序第 k 名附近的少量候选
+            start, end = max(start, top_k - self.degraded_window), min(end, top_k + self.degraded_window)
+            reason += f", latency {self.latency_ewma:.2f}s over budget, narrowed to [{start}, {end})"
+            if start == 0 and end == n:
+                return RerankDecision("skip", reason=reason)
+        elif start == 0 and end == n:
+            return RerankDecision("full", 0, n, reason=reason)
+        return RerankDecision("partial", start, end, reason=reason)
+
+    def record_latency(self, seconds: float) -> None:
+        """ 记录一次重排序调用的耗时 """
+        with self._lock:
+            if self.latency_ewma is None:
+                self.latency_ewma = seconds
+            else:
+                self.latency_ewma = self.ewma_alpha * seconds + (1 - self.ewma_alpha) * self.latency_ewma
+
+    def _decide_and_count(self, docs_and_scores: list[tuple[Document, float]], top_k: int) -> RerankDecision:
+        decision = self.decide([score for _, score in docs_and_scores], top_k)
+        with self._lock:
+            self.decisions[decision.action] += 1
+        get_metrics().inc(metric_name("rerank_gate_decisions_total"), action=decision.action)
+        logger.debug("rerank 决策: %s (%s)", decision.action, decision.reason)
+        return decision
+
+    def apply(self, rerank, docs_and_scores: list[tuple[Document, float]], query: str, top_k: int) -> list[Document]:
+        """
+        按决策执行重排序
+
+        参数:
+            rerank: 重排序客户端，需要提供 `rerank(docs, query, k)` 方法
+            docs_and_scores (list[tuple[Document, float]]): 召回的文档及分数，按分数降序排列
+            query (str): 查询
+            top_k (int): 返回的文档数量
+
+        返回:
+            list[Document]: 最终的文档列表
+        """
+        docs = [doc for doc, _ in docs_and_scores]
+        decision = self._decide_and_count(docs_and_scores, top_k)
+        if decision.action == "skip":
+            return docs[:top_k]
+        head, band = docs[:decision.start], docs[decision.start:decision.end]
+        if len(head) >= top_k:
+            return head[:top_k]
+        start = time.perf_counter()
+        reranked = rerank.rerank(band, query, top_k - len(head))
+        self.record_latency(time.perf_counter() - start)
+        return head + reranked
+
+    async def aapply(self, rerank, docs_and_scores: list[tuple[Document, float]], query: str, top_k: int) -> list[Document]:
+        """ `apply` 的异步版本，重排序客户端需要提供 `arerank(docs, query, k)` 方法 """
+        docs = [doc for doc, _ in docs_and_scores]
+        decision = self._decide_and_count(docs_and_scores, top_k)
+        if decision.action == "skip":
+            return docs[:top_k]
+        head, band = docs[:decision.start], docs[decision.start:decision.end]
+        if len(head) >= top_k:
+            return head[:top_k]
+        start = time.perf_counter()
+        reranked = await rerank.arerank(band, query, top_k - len(head))
+        self.record_latency(time.perf_counter() - start)
+        return head + reranked
+
+    def stats(self) -> dict:
+        """ 返回各类决策的次数和重排序平均耗时 """
+        with self._lock:
+            return {"decisions": dict(self.decisions), "latency_ewma": self.latency_ewma}
+
+
+_rerank_gate: Optional[RerankGate] = None
+_rerank_gate_lock = threading.Lock()
+
+
+def get_rerank_gate() -> RerankGate:
+    """
+    获取进程内共享的重排序决策器，首次调用时根据环境变量创建
+
+    返回:
+        RerankGate: 重排序决策器
+    """
+    global _rerank_gate
+    with _rerank_gate_lock:
+        if _rerank_gate is None:
+            _rerank_gate = RerankGate(
+                skip_gap=float(os.getenv("RERANK_SKIP_GAP", 0.25)),
+                band=float(os.getenv("RERANK_BAND", 0.15)),
+                min_candidates=int(os.getenv("RERANK_MIN_CANDIDATES", 5)),
+                latency_budget=float(os.getenv("RERANK_LATENCY_BUDGET", 0.8)),
+                degraded_window=int(os.getenv("RERANK_DEGRADED_WINDOW", 2)),
+            )
+        return _rerank_gate
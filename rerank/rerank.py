@@ -1,28 +1,101 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import httpx
 import requests
 from langchain_core.documents import Document
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.tracing import span
 
 
 class Rerank:
-    def __init__(self, model: str, base_url: str, api_key: str):
+    # 需要重试的 HTTP 状态码
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self,
+            model: str,
+            base_url: str,
+            api_key: str,
+            connect_timeout: float = 3.0,
+            read_timeout: float = 10.0,
+            max_retries: int = 2,
+            backoff_factor: float = 0.3,
+            pool_size: int = 10,
+            cache_size: int = 1024,
+    ):
+        """
+        初始化重排序客户端，所有请求复用同一个连接池。
+
+        :param model: 重排序模型名称
+        :param base_url: 重排序接口地址
+        :param api_key: API 密钥
+        :param connect_timeout: 建立连接的超时时间（秒）
+        :param read_timeout: 读取响应的超时时间（秒）
+        :param max_retries: 连接失败或服务端错误时的最大重试次数
+        :param backoff_factor: 重试的指数退避系数
+        :param pool_size: 连接池大小
+        :param cache_size: 重排序结果缓存的条数，为 0 时不缓存
+        """
         self.rerank_model = model
         self.base_url = base_url
         self.api_key = api_key
-        print(f'rerank 初始化成功：{self.rerank_model}, {self.base_url}, {self.api_key}')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, list[int]] = OrderedDict()
+        self._cache_lock = threading.Lock()
 
-    def rerank(self, results: list[Document], query: str, k = 5) -> list[Document]:
-        """
-        使用云端重排序模型模型对检索结果进行重排序
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+        self._async_limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        # 异步连接池绑定在创建它的事件循环上，每个事件循环各用一个客户端，循环结束后随之释放
+        self._async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = weakref.WeakKeyDictionary()
 
-        :param results: 原始检索结果
-        :param query: 查询
-        :param k: 返回的top-k结果数
-        :return: 重排序后的结果
-        """
-        texts = [item.page_content for item in results]
+        masked_key = self.api_key[:6] + "***" if self.api_key else None
+        print(f'rerank 初始化成功：{self.rerank_model}, {self.base_url}, {masked_key}')
+
+    def _cache_key(self, texts: list[str], query: str, k: int) -> tuple:
+        chunk_hashes = tuple(hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts)
+        return self.rerank_model, query, chunk_hashes, k
 
-        url = self.base_url
+    def _cache_get(self, key: tuple) -> list[int] | None:
+        with self._cache_lock:
+            indices = self._cache.get(key)
+            if indices is not None:
+                self._cache.move_to_end(key)
+            return indices
 
-        payload = {
+    def _cache_put(self, key: tuple, indices: list[int]) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = indices
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _payload(self, texts: list[str], query: str, k: int) -> dict:
+        return {
             "model": self.rerank_model,
             "query": query,
             "documents": texts,
@@ -31,18 +104,92 @@ class Rerank:
             "max_chunks_per_doc": 512,
             "overlap_tokens": 256
         }
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
 
-        response = requests.request("POST", url, json=payload, headers=headers)
+    def rerank(self, results: list[Document], query: str, k = 5) -> list[Document]:
+        """
+        使用云端重排序模型模型对检索结果进行重排序
+
+        :param results: 原始检索结果
+        :param query: 查询
+        :param k: 返回的top-k结果数
+        :return: 重排序后的结果，超时或请求失败时按原始召回顺序返回前 k 个结果
+        """
+        if not results:
+            return []
+        texts = [item.page_content for item in results]
+        with span("rerank", {"model": self.rerank_model}, documents=len(texts)) as current:
+            key = self._cache_key(texts, query, k)
+            indices = self._cache_get(key)
+            current.set(cache_hit=indices is not None)
+            if indices is not None:
+                return [results[i] for i in indices]
+
+            current.set(request_chars=sum(len(text) for text in texts) + len(query))
+            try:
+                response = self.session.post(self.base_url, json=self._payload(texts, query, k), timeout=self.timeout)
+            except requests.RequestException as e:
+                print(f"❌ rerank 请求失败，使用原始召回顺序: {e!r}")
+                current.set(fallback=True)
+                return results[:k]
+            return self._handle_response(response.status_code, response.text, response.json, results, key, k, current)
+
+    async def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(
+                headers=dict(self.session.headers),
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=self._async_limits,
+            )
+        return client
+
+    async def arerank(self, results: list[Document], query: str, k = 5) -> list[Document]:
+        """
+        `rerank` 的异步版本，使用独立的异步连接池，重试策略与同步版本一致
+
+        :param results: 原始检索结果
+        :param query: 查询
+        :param k: 返回的top-k结果数
+        :return: 重排序后的结果，超时或请求失败时按原始召回顺序返回前 k 个结果
+        """
+        if not results:
+            return []
+        texts = [item.page_content for item in results]
+        with span("rerank", {"model": self.rerank_model}, documents=len(texts)) as current:
+            key = self._cache_key(texts, query, k)
+            indices = self._cache_get(key)
+            current.set(cache_hit=indices is not None)
+            if indices is not None:
+                return [results[i] for i in indices]
+
+            current.set(request_chars=sum(len(text) for text in texts) + len(query))
+            client = await self._get_async_client()
+            payload = self._payload(texts, query, k)
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await client.post(self.base_url, json=payload)
+                    if response.status_code not in self.RETRY_STATUS or attempt == self.max_retries:
+                        break
+                except httpx.HTTPError as e:
+                    if attempt == self.max_retries:
+                        print(f"❌ rerank 请求失败，使用原始召回顺序: {e!r}")
+                        current.set(fallback=True)
+                        return results[:k]
+                current.set(retries=attempt + 1)
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            return self._handle_response(response.status_code, response.text, response.json, results, key, k, current)
+
+    def _handle_response(self, status_code: int, text: str, parse_json, results: list[Document], key: tuple, k: int,
+                         current) -> list[Document]:
+        current.set(status_code=str(status_code))
         try:
-            if response.status_code == 200:
-                response = response.json()
-                indices = [item['index'] for item in response['results']]
+            if status_code == 200:
+                indices = [item['index'] for item in parse_json()['results']]
+                self._cache_put(key, indices)
                 return [results[i] for i in indices]
-            else:
-                print(f"❌ {response.json()}")
-        except:
-            print(f'Error:network error status_code={response.status_code}')
+            print(f"❌ rerank 请求失败，使用原始召回顺序: status_code={status_code} {text}")
+        except (ValueError, KeyError, IndexError):
+            print(f'❌ rerank 响应解析失败，使用原始召回顺序: status_code={status_code}')
+        current.set(fallback=True)
+        return results[:k]
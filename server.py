@@ -0,0 +1,486 @@
+"""
+无界面的流式 HTTP 接口，与 Streamlit 应用共用同一套图和资源。
+
+接口:
+    POST   /sessions                  创建会话，可指定嵌入模型
+    GET    /sessions/{session_id}     查询会话的对话历史和文件导入状态（会话不存在时返回 404）
+    DELETE /sessions/{session_id}     删除会话及其检查点
+    POST   /sessions/{session_id}/files   上传文件（multipart，字段名 file），提交后台导入
+    POST   /chat                      离线对话 / 文件问答，SSE 流式返回
+    POST   /websearch                 联网搜索问答，SSE 流式返回
+    GET    /healthz                   健康检查
+    GET    /metrics                   Prometheus 格式的节点和外部调用指标（每个工作进程各自统计）
+
+运行:
+    python server.py
+
+每个工作进程持有一份编译好的图、rerank 客户端和 LLM 连接池；会话的向量存储和上传文件只存在于创建它的
+工作进程中，`SERVER_WORKERS` 大于 1 时负载均衡需要按会话 ID 做粘性路由，并使用 `CHECKPOINTER=sqlite`
+在进程间共享对话历史。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+from dotenv import load_dotenv
+from langchain.schema import Document
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from chains.models import get_rerank, load_session_store
+from graph.graph import ANSWER, astream_graph_events, get_graph
+from ingest.queue import get_ingestion_queue
+from utils.common import get_current_time
+from utils.tracing import get_metrics
+
+load_dotenv(verbose=True)
+
+UPLOAD_DIR = "upload_files"
+# 保存上传文件时每次写入的字节数
+UPLOAD_CHUNK_BYTES = 1 << 20
+# multipart 请求体中除文件内容外（边界、各部分的头和其他字段）允许的字节数
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+@dataclass
+class Session:
+    """ 一个对话会话，`session_id` 同时作为图的 thread_id 和共享向量存储中的命名空间 """
+    session_id: str
+    embedding_model: str
+    vectorstore: object
+    files: dict = field(default_factory=dict)           # 文件路径 -> 导入任务 ID
+    digests: dict = field(default_factory=dict)         # 文件路径 -> 最近一次上传内容的 SHA-256
+    upload_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_active: float = field(default_factory=time.monotonic)
+
+
+class SessionManager:
+    """ 工作进程内的会话表，空闲超过 `ttl` 秒的会话会被移除，同时释放其向量存储并删除其上传文件 """
+
+    def __init__(self, default_embedding_model: str, ttl: float = 3600, max_sessions: int = 10000):
+        self.default_embedding_model = default_embedding_model
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: dict[str, Session] = {}
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for session_id in [sid for sid, s in self._sessions.items() if now - s.last_active > self.ttl and not s.lock.locked()]:
+            self._discard(self._sessions.pop(session_id))
+
+    async def get(self, session_id: Optional[str] = None, embedding_model: Optional[str] = None, create: bool = True) -> Session:
+        """
+        获取会话，不存在时创建（其他工作进程创建的会话在这里按需恢复）
+
+        参数:
+            session_id (Optional[str]): 会话 ID，为空时创建新会话
+            embedding_model (Optional[str]): 新会话使用的嵌入模型
+            create (bool): 会话不存在时是否创建，为 False 时抛出 KeyError
+
+        返回:
+            Session: 会话
+        """
+        session = self._sessions.get(session_id) if session_id else None
+        if session is None:
+            if session_id is not None and not _SESSION_ID.match(session_id):
+                raise ValueError("invalid session_id")
+            if not create:
+                raise KeyError(session_id)
+            self._sweep()
+            if len(self._sessions) >= self.max_sessions:
+                raise OverflowError("too many sessions")
+            session_id = session_id or uuid.uuid4().hex
+            embedding_model = embedding_model or self.default_embedding_model
+            vectorstore = await asyncio.to_thread(load_session_store, embedding_model, session_id)
+            session = self._sessions.setdefault(session_id, Session(session_id, embedding_model, vectorstore))
+        session.last_active = time.monotonic()
+        return session
+
+    def remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._discard(session)
+
+    @staticmethod
+    def _discard(session: Session) -> None:
+        session.vectorstore.release()
+        shutil.rmtree(os.path.join(UPLOAD_DIR, session.session_id), ignore_errors=True)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class _SlotStreamingResponse(StreamingResponse):
+    """ 响应结束（包括客户端断开导致的取消）后释放并发名额 """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _error(status_code: int, message: str, **headers) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers or None)
+
+
+async def _read_json(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("request body must be JSON")
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    return body
+
+
+def _build_request(body: dict, session: Session, mode: str) -> tuple[dict, dict]:
+    """ 构造图的输入状态和本次请求的参数（模型、温度、搜索数量通过 config 传入） """
+    question = body.get("message")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("message is required")
+    if body.get("mode") == "code":
+        model_name = os.getenv("CODE_MODEL")
+    else:
+        model_name = body.get("model_name") or os.getenv("AVAILABLE_MODELS", "").split(",")[0]
+    state = {
+        "messages": [{"role": "system", "content": f"当前日期是：{get_current_time()}"}, {"role": "user", "content": question}],
+        "type": mode,
+        "documents": [],
+    }
+    # 会话上传过文件时，离线对话按文件问答处理
+    if mode == "chat" and session.files and body.get("mode") != "code":
+        state["type"] = "file"
+        state["documents"] = [Document(page_content=path) for path in session.files]
+    try:
+        temperature = float(body.get("temperature", 0.0))
+        search_num = int(body.get("search_num", os.getenv("SEARCH_NUN", 3)))
+    except (TypeError, ValueError):
+        # null、列表、对象等类型 float()/int() 会抛出 TypeError
+        raise ValueError("temperature and search_num must be numbers")
+    params = {
+        "model_name": model_name,
+        "temperature": temperature,
+        "search_num": search_num,
+        # 推理模型的推理过程以单独的 reasoning 事件返回，默认不返回
+        "reasoning": bool(body.get("reasoning", False)),
+    }
+    return state, params
+
+
+async def _acquire_slot(request: Request) -> bool:
+    """ 等待并发名额，排队超过 `SERVER_QUEUE_TIMEOUT` 秒时放弃 """
+    try:
+        await asyncio.wait_for(request.app.state.slots.acquire(), request.app.state.queue_timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def _stream(request: Request, session: Session, state: dict, params: dict):
+    """ 以 SSE 格式流式返回回答，同一会话的请求串行执行 """
+    app_state = request.app.state
+    config = {"configurable": {"thread_id": session.session_id, "vectorstore": session.vectorstore,
+                               "rerank": app_state.rerank, **params}}
+    yield _sse({"session_id": session.session_id}, event="session")
+    try:
+        async with asyncio.timeout(app_state.request_timeout):
+            async with session.lock:
+                async for channel, text in astream_graph_events(app_state.graph, state, config, params["reasoning"]):
+                    if channel == ANSWER:
+                        yield _sse({"content": text})
+                    else:
+                        yield _sse({"content": text}, event="reasoning")
+        yield _sse({}, event="done")
+    except TimeoutError:
+        yield _sse({"error": f"request timed out after {app_state.request_timeout}s"}, event="error")
+    except asyncio.CancelledError:
+        # 客户端断开时 Starlette 取消响应任务，图的运行随之取消
+        print(f"⚠️ 客户端断开，已取消会话 {session.session_id} 的请求")
+        raise
+    except Exception as e:
+        yield _sse({"error": repr(e)}, event="error")
+    finally:
+        session.last_active = time.monotonic()
+
+
+async def _answer(request: Request, mode: str):
+    try:
+        body = await _read_json(request)
+        session = await request.app.state.sessions.get(body.get("session_id"), body.get("embedding_model"))
+        state, params = _build_request(body, session, mode)
+    except ValueError as e:
+        return _error(400, str(e))
+    except OverflowError as e:
+        return _error(503, str(e), **{"Retry-After": "1"})
+    if not await _acquire_slot(request):
+        return _error(503, "server is busy", **{"Retry-After": "1"})
+    return _SlotStreamingResponse(
+        _stream(request, session, state, params),
+        request.app.state.slots.release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def chat(request: Request):
+    return await _answer(request, "chat")
+
+
+async def websearch(request: Request):
+    return await _answer(request, "websearch")
+
+
+async def create_session(request: Request):
+    try:
+        body = await _read_json(request) if await request.body() else {}
+        session = await request.app.state.sessions.get(None, body.get("embedding_model"))
+    except ValueError as e:
+        return _error(400, str(e))
+    except OverflowError as e:
+        return _error(503, str(e), **{"Retry-After": "1"})
+    return JSONResponse({"session_id": session.session_id, "embedding_model": session.embedding_model}, status_code=201)
+
+
+async def get_session(request: Request):
+    try:
+        session = await request.app.state.sessions.get(request.path_params["session_id"], create=False)
+    except ValueError as e:
+        return _error(400, str(e))
+    except KeyError:
+        return _error(404, "session not found")
+    snapshot = await request.app.state.graph.aget_state({"configurable": {"thread_id": session.session_id}})
+    queue = get_ingestion_queue()
+    files = [job.describe() for job in map(queue.get, session.files.values()) if job is not None]
+    messages = [{"role": m.type, "content": m.content} for m in snapshot.values.get("messages", [])]
+    return JSONResponse({"session_id": session.session_id, "embedding_model": session.embedding_model,
+                         "files": files, "messages": messages})
+
+
+async def delete_session(request: Request):
+    session_id = request.path_params["session_id"]
+    if not _SESSION_ID.match(session_id):
+        return _error(400, "invalid session_id")
+    request.app.state.sessions.remove(session_id)
+    checkpointer = request.app.state.graph.checkpointer
+    if hasattr(checkpointer, "evict_thread"):
+        await asyncio.to_thread(checkpointer.evict_thread, session_id)
+    return JSONResponse({"session_id": session_id, "deleted": True})
+
+
+class _UploadError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def _receive_upload(request: Request, boundary: bytes, tmp_path: str) -> tuple[str, str]:
+    """
+    边接收请求体边解析 multipart，把字段 `file` 的内容分块写入临时文件，请求体超过大小限制时立即停止接收
+
+    参数:
+        request (Request): 上传请求
+        boundary (bytes): multipart 边界
+        tmp_path (str): 临时文件路径，出错时删除
+
+    返回:
+        tuple[str, str]: 文件名和文件内容的 SHA-256
+    """
+    app_state = request.app.state
+    events = []
+    headers = {}
+    header_field = bytearray()
+    header_value = bytearray()
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        header_value.extend(data[start:end])
+
+    def on_header_end() -> None:
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished() -> None:
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        events.append(("data", data[start:end]))
+
+    def on_part_end() -> None:
+        events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field, "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+
+    def write(f, data: bytes) -> None:
+        f.write(data)
+        digest.update(data)
+
+    name, f, done = None, None, False
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    received = size = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > app_state.max_upload_bytes + UPLOAD_FORM_OVERHEAD:
+                raise _UploadError(413, "file too large")
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "headers" and not done and f is None:
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    if options.get(b"name") != b"file" or b"filename" not in options:
+                        continue
+                    name = os.path.basename(options[b"filename"].decode("utf-8", "replace"))
+                    if os.path.splitext(name)[1].lower().lstrip(".") not in app_state.upload_types:
+                        raise _UploadError(415, f"unsupported file type, allowed: {', '.join(sorted(app_state.upload_types))}")
+                    f = await asyncio.to_thread(open, tmp_path, "wb")
+                elif kind == "data" and f is not None and not done:
+                    size += len(value)
+                    if size > app_state.max_upload_bytes:
+                        raise _UploadError(413, "file too large")
+                    buffer.extend(value)
+                    if len(buffer) >= UPLOAD_CHUNK_BYTES:
+                        await asyncio.to_thread(write, f, bytes(buffer))
+                        buffer.clear()
+                elif kind == "end" and f is not None:
+                    done = True
+            events.clear()
+        parser.finalize()
+        if not done:
+            raise _UploadError(400, "multipart field 'file' is required")
+        await asyncio.to_thread(write, f, bytes(buffer))
+        return name, digest.hexdigest()
+    except BaseException:
+        if f is not None:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.remove, tmp_path)
+        raise
+    finally:
+        if f is not None and not f.closed:
+            await asyncio.to_thread(f.close)
+
+
+async def upload_file(request: Request):
+    app_state = request.app.state
+    try:
+        session = await app_state.sessions.get(request.path_params["session_id"], create=False)
+    except ValueError as e:
+        return _error(400, str(e))
+    except KeyError:
+        return _error(404, "session not found")
+
+    # 不使用 request.form()：它会先把整个请求体读入内存或临时文件，再交给这里检查大小
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > app_state.max_upload_bytes + UPLOAD_FORM_OVERHEAD:
+        return _error(413, "file too large")
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        return _error(400, "multipart field 'file' is required")
+
+    # 每个请求写入自己的临时文件，同名文件的并发上传互不影响
+    session_dir = os.path.join(UPLOAD_DIR, session.session_id)
+    await asyncio.to_thread(os.makedirs, session_dir, exist_ok=True)
+    tmp_path = os.path.join(session_dir, f".{uuid.uuid4().hex}.part")
+    try:
+        name, digest = await _receive_upload(request, options[b"boundary"], tmp_path)
+    except _UploadError as e:
+        return _error(e.status_code, str(e))
+    except MultipartParseError:
+        return _error(400, "malformed multipart body")
+
+    # 按内容判断是否需要重新导入：内容相同时沿用已有任务，内容变化时删除旧内容后重新导入
+    file_path = os.path.join(session_dir, name)
+    async with session.upload_lock:
+        previous = session.digests.get(file_path)
+        if previous == digest:
+            await asyncio.to_thread(os.remove, tmp_path)
+        else:
+            await asyncio.to_thread(os.replace, tmp_path, file_path)
+            session.digests[file_path] = digest
+        job = get_ingestion_queue().submit(file_path, session.vectorstore, replace=previous is not None and previous != digest)
+        session.files[file_path] = job.job_id
+    return JSONResponse(job.describe(), status_code=202)
+
+
+async def healthz(request: Request):
+    app_state = request.app.state
+    return JSONResponse({"status": "ok", "sessions": len(app_state.sessions), "saturated": app_state.slots.locked()})
+
+
+async def metrics(request: Request):
+    return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    # 进程级共享资源：编译好的图、rerank 客户端，LLM 连接池由 chains.models 中的注册表共享
+    app.state.graph = get_graph()
+    app.state.rerank = get_rerank()
+    app.state.sessions = SessionManager(
+        os.getenv("SERVER_EMBEDDING_MODEL") or os.getenv("AVAILABLE_EMBEDDING_MODELS", "").split(",")[-1],
+        ttl=float(os.getenv("SERVER_SESSION_TTL", 3600)),
+        max_sessions=int(os.getenv("SERVER_MAX_SESSIONS", 10000)),
+    )
+    app.state.slots = asyncio.Semaphore(int(os.getenv("SERVER_MAX_CONCURRENCY", 64)))
+    app.state.queue_timeout = float(os.getenv("SERVER_QUEUE_TIMEOUT", 5))
+    app.state.request_timeout = float(os.getenv("SERVER_REQUEST_TIMEOUT", 300))
+    app.state.upload_types = {t.strip().lower() for t in os.getenv("SERVER_UPLOAD_TYPES", "txt,md").split(",") if t.strip()}
+    app.state.max_upload_bytes = int(float(os.getenv("SERVER_MAX_UPLOAD_MB", 20)) * 1024 * 1024)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/websearch", websearch, methods=["POST"]),
+        Route("/sessions", create_session, methods=["POST"]),
+        Route("/sessions/{session_id}", get_session, methods=["GET"]),
+        Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+        Route("/sessions/{session_id}/files", upload_file, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "server:app",
+        host=os.getenv("SERVER_HOST", "0.0.0.0"),
+        port=int(os.getenv("SERVER_PORT", 8000)),
+        workers=int(os.getenv("SERVER_WORKERS", 1)),
+        timeout_keep_alive=int(os.getenv("SERVER_KEEP_ALIVE", 5)),
+    )
@@ -0,0 +1,66 @@
+from langgraph.checkpoint.base import empty_checkpoint
+
+from graph import checkpointer as checkpointer_module
+from graph.checkpointer import BoundedMemorySaver
+
+
+def _put(saver, config, checkpoint_id, version):
+    # 每个检查点更新 x，y 只在第一个检查点写入，之后一直被引用
+    checkpoint = empty_checkpoint()
+    checkpoint["id"] = checkpoint_id
+    checkpoint["channel_values"] = {"x": version, "y": "kept"}
+    checkpoint["channel_versions"] = {"x": version, "y": 1}
+    new_versions = {"x": version, "y": 1} if version == 1 else {"x": version}
+    return saver.put(config, checkpoint, {}, new_versions)
+
+
+def _write_history(saver, thread_id, count):
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    for version in range(1, count + 1):
+        config = _put(saver, config, f"{version:04d}", version)
+        saver.put_writes(config, [("x", version)], task_id="task")
+    return config
+
+
+def test_retention_drops_old_checkpoints_writes_and_unreferenced_blobs():
+    saver = BoundedMemorySaver(retention=2, ttl=None)
+    _write_history(saver, "a", 5)
+    _write_history(saver, "b", 3)
+
+    assert sorted(saver.storage["a"][""]) == ["0004", "0005"]
+    assert sorted(key[2:] for key in saver.blobs if key[0] == "a") == [("x", 4), ("x", 5), ("y", 1)]
+    assert sorted(key[2] for key in saver.writes if key[0] == "a") == ["0004", "0005"]
+    latest = saver.get_tuple({"configurable": {"thread_id": "a", "checkpoint_ns": ""}})
+    assert latest.checkpoint["channel_values"] == {"x": 5, "y": "kept"}
+    # 其他会话不受影响
+    assert sorted(saver.storage["b"][""]) == ["0002", "0003"]
+
+
+def test_idle_threads_are_evicted_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(checkpointer_module.time, "monotonic", lambda: now[0])
+    saver = BoundedMemorySaver(retention=2, ttl=60, evict_interval=0)
+    _write_history(saver, "idle", 3)
+    now[0] += 30
+    _write_history(saver, "active", 1)
+
+    now[0] += 40
+    _write_history(saver, "active", 1)
+
+    assert "idle" not in saver.storage
+    assert not [key for key in saver.blobs if key[0] == "idle"]
+    assert not [key for key in saver.writes if key[0] == "idle"]
+    assert "active" in saver.storage
+
+
+def test_evict_thread_removes_everything_for_the_thread():
+    saver = BoundedMemorySaver(retention=2, ttl=None)
+    _write_history(saver, "a", 3)
+    _write_history(saver, "b", 3)
+
+    saver.evict_thread("a")
+
+    assert "a" not in saver.storage
+    assert all(key[0] == "b" for key in saver.blobs)
+    assert all(key[0] == "b" for key in saver.writes)
+    assert saver.get_tuple({"configurable": {"thread_id": "b", "checkpoint_ns": ""}}) is not None
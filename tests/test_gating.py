@@ -0,0 +1,59 @@
+from langchain_core.documents import Document
+
+from rerank.gating import RerankGate
+
+# 均匀分布的分数：第 3 名与第 4 名的归一化分差只有 0.1，模糊区间为 [1, 4)
+EVEN_SCORES = [float(score) for score in range(10, -1, -1)]
+
+
+def test_skips_when_there_are_too_few_candidates():
+    gate = RerankGate(min_candidates=5)
+    assert gate.decide([0.9, 0.8, 0.7], top_k=3).action == "skip"
+    assert gate.decide([0.9, 0.8, 0.7, 0.6], top_k=3).action == "skip"
+
+
+def test_skips_when_the_top_k_are_clearly_separated():
+    decision = RerankGate(skip_gap=0.25).decide([1.0, 0.95, 0.9, 0.3, 0.2, 0.1], top_k=3)
+    assert decision.action == "skip"
+
+
+def test_reranks_only_the_ambiguous_band():
+    decision = RerankGate(skip_gap=0.25, band=0.15).decide(EVEN_SCORES, top_k=3)
+    assert (decision.action, decision.start, decision.end) == ("partial", 1, 4)
+
+
+def test_full_rerank_when_the_band_covers_every_candidate():
+    decision = RerankGate().decide([0.5] * 6, top_k=3)
+    assert (decision.action, decision.start, decision.end) == ("full", 0, 6)
+
+
+def test_over_latency_budget_narrows_the_band_around_top_k():
+    gate = RerankGate(latency_budget=0.8, degraded_window=1)
+    gate.record_latency(2.0)
+    decision = gate.decide([0.5] * 6, top_k=3)
+    assert (decision.action, decision.start, decision.end) == ("partial", 2, 4)
+
+
+def test_over_latency_budget_skips_when_the_narrowed_band_still_covers_everything():
+    gate = RerankGate(latency_budget=0.8, degraded_window=10)
+    gate.record_latency(2.0)
+    assert gate.decide([0.5] * 6, top_k=3).action == "skip"
+
+
+class _FakeRerank:
+    def __init__(self):
+        self.calls = []
+
+    def rerank(self, docs, query, k):
+        self.calls.append(([doc.page_content for doc in docs], k))
+        return list(reversed(docs))[:k]
+
+
+def test_apply_keeps_the_leading_candidates_and_reranks_the_band():
+    docs_and_scores = [(Document(page_content=str(i)), score) for i, score in enumerate(EVEN_SCORES)]
+    rerank = _FakeRerank()
+
+    result = RerankGate().apply(rerank, docs_and_scores, "query", top_k=3)
+
+    assert rerank.calls == [(["1", "2", "3"], 2)]
+    assert [doc.page_content for doc in result] == ["0", "3", "2"]
@@ -0,0 +1,18 @@
+from ingest.pipeline import IngestStats, iter_text_chunks
+
+
+def test_iter_text_chunks_does_not_repeat_chunks_before_trailing_blanks(tmp_path):
+    # 第一个读取块以超过 2 * CHUNK_SIZE 的空行结尾，缓冲区末尾没有任何 chunk 开始
+    block_chars = 4096
+    words = " ".join(f"word{i}" for i in range(600))[:3000]
+    text = words + "\n" * (block_chars - len(words)) + " ".join(f"tail{i}" for i in range(600))
+    file_path = tmp_path / "blanks.txt"
+    file_path.write_text(text, encoding="utf-8")
+
+    chunks = list(iter_text_chunks(str(file_path), IngestStats(str(file_path)), block_chars=block_chars))
+
+    starts = [chunk.metadata["start_index"] for chunk in chunks]
+    assert len(starts) == len(set(starts))
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from vectorstore import shared_store as shared_store_module
+from vectorstore.shared_store import SharedVectorStore
+
+
+class _HashEmbeddings(Embeddings):
+    """ 由文本哈希决定的随机向量，相同文本得到相同向量 """
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(16).tolist()
+
+
+def _store(tmp_path, **kwargs):
+    # 默认不触发后台压缩，需要时在测试中显式调用 compact
+    kwargs.setdefault("compact_ratio", float("inf"))
+    return SharedVectorStore(_HashEmbeddings(), str(tmp_path / "shared"), ttl=kwargs.pop("ttl", 0), **kwargs)
+
+
+def _add(store, name, texts, source="a.txt"):
+    return store.namespace(name).add_texts(texts, [{"source": source} for _ in texts])
+
+
+def test_identical_chunks_are_stored_once_and_referenced_per_namespace(tmp_path):
+    store = _store(tmp_path)
+    _add(store, "s1", ["alpha", "beta"])
+    _add(store, "s2", ["beta", "gamma"])
+
+    stats = store.stats()
+    assert len(store.store) == 3
+    assert (stats["unique_chunks"], stats["references"]) == (3, 4)
+
+    assert store.release("s1")
+    stats = store.stats()
+    assert (stats["unique_chunks"], stats["references"]) == (2, 2)
+    assert stats["garbage_bytes"] > 0
+    assert not store.release("s1")
+    assert [doc.page_content for doc in store.namespace("s2").similarity_search("beta", k=1)] == ["beta"]
+
+
+def test_idle_namespaces_are_evicted_after_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_store_module.time, "monotonic", lambda: now[0])
+    store = _store(tmp_path, ttl=60)
+    _add(store, "idle", ["alpha"])
+    now[0] += 30
+    _add(store, "active", ["beta"])
+
+    now[0] += 40
+    assert store.namespace("active").similarity_search("beta", k=1)
+
+    assert store.evictions == 1
+    assert not store.has_source("idle", "a.txt")
+    assert store.has_source("active", "a.txt")
+
+
+def test_least_recently_used_namespace_is_evicted_over_max_bytes(tmp_path):
+    store = _store(tmp_path, max_bytes=10 ** 9)
+    _add(store, "first", ["alpha " * 50])
+    _add(store, "second", ["beta " * 50])
+    # 检索会刷新最近访问时间，second 成为最近最少使用的命名空间
+    store.namespace("first").similarity_search("alpha", k=1)
+    store.max_bytes = store.live_bytes - 1
+
+    _add(store, "new", ["gamma"])
+
+    # 释放一个命名空间后已回到上限以内，不再继续释放
+    assert store.evictions == 1
+    assert not store.has_source("second", "a.txt")
+    assert store.has_source("first", "a.txt")
+    assert len(store.namespace("new")) == 1
+
+
+def test_compaction_keeps_only_referenced_rows(tmp_path):
+    store = _store(tmp_path)
+    _add(store, "s1", ["alpha", "beta"])
+    _add(store, "s2", ["gamma"])
+    store.release("s1")
+    first_generation_dir = store.store.persist_dir
+
+    store.compact()
+
+    assert store.compactions == 1
+    assert len(store.store) == 1
+    assert store.store.persist_dir != first_generation_dir
+    assert store.garbage_bytes == 0
+    docs = store.namespace("s2").similarity_search("gamma", k=2)
+    assert [doc.page_content for doc in docs] == ["gamma"]
+    assert docs[0].metadata["source"] == "a.txt"
+    # 压缩后相同内容仍然去重
+    _add(store, "s3", ["gamma"])
+    assert len(store.store) == 1
+
+
+def test_background_compaction_runs_when_garbage_exceeds_ratio(tmp_path):
+    store = _store(tmp_path, compact_ratio=0.5)
+    _add(store, "s1", ["alpha", "beta", "delta"])
+    _add(store, "s2", ["gamma"])
+
+    store.release("s1")
+    for thread in threading.enumerate():
+        if thread.name == "shared-store-compact":
+            thread.join(timeout=10)
+
+    assert store.compactions == 1
+    assert len(store.store) == 1
+
+
+def test_remove_source_releases_only_that_file(tmp_path):
+    store = _store(tmp_path)
+    view = store.namespace("s1")
+    _add(store, "s1", ["alpha", "beta"], source="a.txt")
+    _add(store, "s1", ["gamma"], source="b.txt")
+
+    assert view.remove_source("a.txt") == 2
+
+    assert not view.has_source("a.txt")
+    assert view.has_source("b.txt")
+    assert [doc.page_content for doc in view.similarity_search("alpha", k=3)] == ["gamma"]
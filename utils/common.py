@@ -1,15 +1,22 @@
 import datetime
+import functools
 import os
 from dotenv import load_dotenv
-import streamlit as st
-from langgraph.graph.state import CompiledStateGraph
+from typing import TYPE_CHECKING
+
+# 图和接口服务也会导入本模块，不在这里导入 streamlit 和 langgraph
+if TYPE_CHECKING:
+    from langgraph.graph.state import CompiledStateGraph
 
-@st.cache_data
 def load_env_vars():
     """
-    从 .env 文件读取配置
+    从 .env 文件读取配置，每个进程只读取一次，返回副本以免修改影响其他会话
     :return: json 格式的配置
     """
+    return dict(_load_env_vars())
+
+@functools.cache
+def _load_env_vars():
     load_dotenv(verbose=True)
     # OpenAI API 密钥
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
@@ -69,7 +76,7 @@ def upload_pdf(file):
         f.write(file.getbuffer())
         return file_path + file.name
 
-def gen_mermaid(graph: CompiledStateGraph, file_name: str):
+def gen_mermaid(graph: "CompiledStateGraph", file_name: str):
     """ 生成 graph 对应的 mermaid 文件 """
     path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "resources", file_name))
     with open(path, "w", encoding="utf-8") as file:
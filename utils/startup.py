@@ -0,0 +1,102 @@
+import argparse
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+
+# 默认统计的入口模块：图、命令行程序依赖的模型加载、HTTP 接口
+DEFAULT_MODULES = ("graph.graph", "chains.models", "server")
+
+
+def patch_torch_classes() -> bool:
+    """
+    torch 已被导入时修正 `torch.classes.__path__`，避免 Streamlit 的文件监视器遍历 torch.classes 时报错；
+    torch 尚未导入时不做任何事，也不会因此导入 torch
+
+    返回:
+        bool: 是否进行了修正
+    """
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return False
+    torch.classes.__path__ = [os.path.join(torch.__path__[0], torch.classes.__file__)]
+    return True
+
+
+@dataclass
+class ImportCost:
+    """ 一个模块的导入耗时 """
+    module: str
+    self_us: int            # 模块自身的导入耗时（微秒）
+    cumulative_us: int      # 包含其依赖的导入耗时（微秒）
+    depth: int              # 在导入树中的深度，0 为被直接导入的模块
+
+
+def measure_imports(module: str, python: str = sys.executable) -> list[ImportCost]:
+    """
+    在全新的解释器中用 `-X importtime` 导入模块，统计每个模块的导入耗时
+
+    参数:
+        module (str): 要导入的模块
+        python (str): 使用的解释器
+
+    返回:
+        list[ImportCost]: `module` 及其依赖的耗时，按导入完成的顺序排列，不含解释器启动时导入的模块
+    """
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    costs = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        costs.append(ImportCost(name.strip(), int(self_us), int(cumulative_us), depth))
+    if result.returncode != 0:
+        print(f"❌ 导入 {module} 失败:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+        return []
+
+    # -X importtime 先输出子模块再输出父模块，module 的导入树是它之前、上一个顶层模块之后的连续部分
+    roots = [i for i, cost in enumerate(costs) if cost.depth == 0]
+    end = next((i for i in reversed(roots) if costs[i].module == module), len(costs) - 1)
+    start = max((i for i in roots if i < end), default=-1) + 1
+    return costs[start:end + 1]
+
+
+def report(module: str, top: int = 20) -> None:
+    """
+    打印模块的导入耗时报告：总耗时、耗时最多的顶层依赖以及自身耗时最多的模块
+
+    参数:
+        module (str): 要导入的模块
+        top (int): 每个列表展示的模块数量
+    """
+    costs = measure_imports(module)
+    if not costs:
+        return
+    print(f"⏱️ import {module}: {costs[-1].cumulative_us / 1000:.1f} ms，共 {len(costs)} 个模块")
+
+    # module 直接导入的模块（深度为 1）的累计耗时，按顶层包汇总
+    packages: dict[str, int] = {}
+    for cost in costs:
+        if cost.depth == 1:
+            package = cost.module.split(".")[0]
+            packages[package] = packages.get(package, 0) + cost.cumulative_us
+    print("  累计耗时最多的包:")
+    for package, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"    {us / 1000:10.1f} ms  {package}")
+
+    print("  自身耗时最多的模块:")
+    for cost in sorted(costs, key=lambda c: c.self_us, reverse=True)[:top]:
+        print(f"    {cost.self_us / 1000:10.1f} ms  {cost.module}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="统计入口模块的冷启动导入耗时")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="要统计的模块")
+    parser.add_argument("--top", type=int, default=20, help="每个列表展示的模块数量")
+    args = parser.parse_args()
+    for name in args.modules:
+        report(name, args.top)
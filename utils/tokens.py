@@ -0,0 +1,21 @@
+import re
+
+# CJK 统一表意文字、日文假名和全角标点，在常见 BPE 分词器中大致每个字符对应一个 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数量，不依赖具体模型的分词器。
+    CJK 字符按每字 1 个 token 计算，其余字符按每 4 个字符 1 个 token 计算，结果偏保守。
+
+    参数:
+        text (str): 待估算的文本
+
+    返回:
+        int: 估算的 token 数量
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
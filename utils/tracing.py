@@ -0,0 +1,310 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+# 本模块在各入口调用 load_dotenv 之前就会被导入，采样率和日志级别需要先从 .env 读取
+load_dotenv()
+
+# 耗时直方图的桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "chatbot"
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def metric_name(*parts: str) -> str:
+    """ 拼接指标名称，加上统一前缀并把不合法的字符替换为下划线 """
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join((METRIC_PREFIX,) + parts))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(labels: tuple) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """
+    进程内的计数器和直方图，按 Prometheus 文本格式导出。
+
+    指标以 (名称, 标签) 区分，标签值只应取有限的几种（节点名、模型名、决策类型等），不要放入问题文本或 ID。
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        """ 计数器加上 `value` """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """ 在直方图中记录一个观测值 """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self) -> str:
+        """ 返回 Prometheus 文本格式的全部指标 """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, ([*value[0]], value[1], value[2])) for key, value in self._histograms.items())
+
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels_text(labels)} {value:g}")
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{name}_bucket{_labels_text(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_labels_text(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class _TraceWriter:
+    """ 以 JSON Lines 追加写入 span 的跟踪文件 """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+class Span:
+    """ 一次操作（图节点或外部调用）的耗时和属性 """
+
+    def __init__(self, name: str, labels: Optional[dict] = None, **attributes):
+        self.name = name
+        self.labels = labels or {}
+        self.attributes = attributes
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.sampled = parent.sampled if parent else random.random() < _trace_sample_rate
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.time()
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        """ 设置 span 的属性，数值属性会累加到对应的计数器 """
+        self.attributes.update(attributes)
+
+    def finish(self, duration: float) -> None:
+        record_span(self, duration)
+
+
+def record_span(span: Span, duration: float) -> None:
+    """
+    记录结束的 span：耗时写入 `chatbot_span_seconds` 直方图，以 `_seconds` 结尾的属性写入 `chatbot_<span>_<属性>` 直方图，
+    其他数值属性累加到 `chatbot_<span>_<属性>_total`，出错时 `chatbot_span_errors_total` 加一；开启跟踪文件且该次请求被采样时写入一行 JSON
+
+    参数:
+        span (Span): 结束的 span
+        duration (float): 耗时（秒）
+    """
+    metrics = get_metrics()
+    metrics.observe(metric_name("span_seconds"), duration, span=span.name, **span.labels)
+    for key, value in span.attributes.items():
+        if not isinstance(value, (int, float)):
+            continue
+        if key.endswith("_seconds"):
+            metrics.observe(metric_name(span.name, key), float(value), **span.labels)
+        else:
+            metrics.inc(metric_name(span.name, key, "total"), float(value), **span.labels)
+    if span.error:
+        metrics.inc(metric_name("span_errors_total"), span=span.name, **span.labels)
+
+    writer = _get_trace_writer()
+    if writer is not None and span.sampled:
+        writer.write({
+            "trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id, "name": span.name,
+            "start": span.start, "duration": duration, "labels": span.labels, "attributes": span.attributes,
+            "error": span.error,
+        })
+
+
+@contextmanager
+def span(name: str, labels: Optional[dict] = None, **attributes):
+    """
+    记录一段代码的耗时，同步和异步代码中都可以使用，嵌套的 span 会记录父子关系
+
+    参数:
+        name (str): span 名称，如 node.generate、llm、embedding、rerank、tavily、marker
+        labels (Optional[dict]): 作为指标标签的属性，只放取值有限的字段
+        **attributes: 其他属性，可在代码块中通过 `set` 补充
+
+    返回:
+        Span: 当前 span
+    """
+    current = Span(name, labels, **attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish(time.perf_counter() - start)
+
+
+def traced(name: str):
+    """ 为同步或异步函数记录 span 的装饰器，保留函数签名（RunnableLambda 根据签名判断是否传入 config） """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def content_sampled() -> bool:
+    """ 是否记录本次的完整内容（召回的文档、搜索结果等），按 `LOG_CONTENT_SAMPLE_RATE` 采样 """
+    return _content_sample_rate > 0 and random.random() < _content_sample_rate
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    获取日志记录器，级别由 `LOG_LEVEL` 控制，首次调用时配置输出格式
+
+    参数:
+        name (str): 记录器名称
+
+    返回:
+        logging.Logger: 日志记录器
+    """
+    global _logging_configured
+    if not _logging_configured:
+        root = logging.getLogger(METRIC_PREFIX)
+        if not root.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+            root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.propagate = False
+        _logging_configured = True
+    return logging.getLogger(f"{METRIC_PREFIX}.{name}")
+
+
+_logging_configured = False
+_trace_sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+_content_sample_rate = float(os.getenv("LOG_CONTENT_SAMPLE_RATE", 0.0))
+_metrics: Optional[Metrics] = None
+_trace_writer: Optional[_TraceWriter] = None
+_init_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """ 获取进程内共享的指标 """
+    global _metrics
+    if _metrics is None:
+        with _init_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
+
+
+def _get_trace_writer() -> Optional[_TraceWriter]:
+    global _trace_writer
+    path = os.getenv("TRACE_FILE")
+    if not path:
+        return None
+    if _trace_writer is None:
+        with _init_lock:
+            if _trace_writer is None:
+                _trace_writer = _TraceWriter(path)
+    return _trace_writer
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> bool:
+    """
+    在后台线程中启动只提供 `/metrics` 的 HTTP 服务，供没有自带 HTTP 接口的进程（Streamlit、命令行）使用，
+    同一进程中只启动一次
+
+    参数:
+        port (int): 监听端口
+        host (str): 监听地址
+
+    返回:
+        bool: 本次调用是否启动了服务
+    """
+    global _metrics_server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics().render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _init_lock:
+        if _metrics_server is not None:
+            return False
+        _metrics_server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    return True
+
+
+_metrics_server = None
@@ -0,0 +1,113 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+_LATIN = re.compile(r"[a-z0-9]+(?:[._+#-][a-z0-9]+)*")
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    面向中英文混合文本的分词：英文和数字按单词切分并转为小写，中文按相邻二元组切分（单字成词的保留单字）
+
+    参数:
+        text (str): 待分词的文本
+
+    返回:
+        list[str]: 词项列表
+    """
+    text = text.lower()
+    tokens = _LATIN.findall(text)
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    增量维护的 BM25 倒排索引。
+
+    文档以向量存储中的行号标识，写入向量的同时追加到倒排表，检索时只遍历查询词项的倒排列表。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        参数:
+            k1 (float): 词频饱和参数
+            b (float): 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, Tuple[list[int], list[int]]] = {}
+        self._doc_lens: list[int] = []
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lens)
+
+    def add(self, texts: Iterable[str]) -> None:
+        """
+        按行号顺序追加文档，第 i 个追加的文档对应行号 i
+
+        参数:
+            texts (Iterable[str]): 文档文本
+        """
+        with self._lock:
+            for text in texts:
+                row = len(self._doc_lens)
+                terms = Counter(tokenize(text))
+                for term, tf in terms.items():
+                    rows, tfs = self._postings.setdefault(term, ([], []))
+                    rows.append(row)
+                    tfs.append(tf)
+                length = sum(terms.values())
+                self._doc_lens.append(length)
+                self._total_len += length
+
+    def search(self, query: str, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 检索
+
+        参数:
+            query (str): 查询文本
+            k (int): 返回的结果数量
+            rows (Optional[np.ndarray]): 只在这些行中检索，为空时检索全部
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: 行号和对应的 BM25 分数，按分数降序排列
+        """
+        with self._lock:
+            count = len(self._doc_lens)
+            if not count:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            avg_len = self._total_len / count
+            doc_lens = np.asarray(self._doc_lens, dtype=np.float32)
+            # 在锁内复制倒排列表，避免与并发写入交错
+            postings = [(np.asarray(posting[0], dtype=np.int64), np.asarray(posting[1], dtype=np.float32))
+                        for posting in map(self._postings.get, set(tokenize(query))) if posting is not None]
+
+        scores = np.zeros(count, dtype=np.float32)
+        for term_rows, tfs in postings:
+            idf = math.log(1 + (count - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lens[term_rows] / avg_len)
+            scores[term_rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        if rows is not None:
+            # 忽略还没有写入索引的行
+            candidates = np.asarray(rows, dtype=np.int64)
+            candidates = candidates[(candidates >= 0) & (candidates < count)]
+        else:
+            candidates = np.flatnonzero(scores)
+        candidates = candidates[scores[candidates] > 0]
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        order = np.argsort(-scores[candidates])
+        return candidates[order], scores[candidates[order]]
@@ -0,0 +1,59 @@
+import asyncio
+from typing import List, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+
+def reciprocal_rank_fusion(
+        result_lists: Sequence[Sequence[Tuple[Document, float]]],
+        k: int = 60,
+) -> List[Tuple[Document, float]]:
+    """
+    倒数排名融合（RRF）：文档的融合分数为其在各个结果列表中 `1 / (k + 名次)` 之和
+
+    参数:
+        result_lists (Sequence[Sequence[Tuple[Document, float]]]): 多路检索结果，每路按相关性降序排列
+        k (int): 平滑常数，越大各路结果中排名靠后的文档权重越接近排名靠前的文档
+
+    返回:
+        List[Tuple[Document, float]]: 按融合分数降序排列的文档
+    """
+    fused: dict[str, Tuple[Document, float]] = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = doc.id or doc.page_content
+            previous = fused.get(key)
+            fused[key] = (doc, (previous[1] if previous else 0.0) + 1.0 / (k + rank))
+    return sorted(fused.values(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(vector_store, query: str, k: int = 10, fetch_k: int = 20, rrf_k: int = 60) -> List[Tuple[Document, float]]:
+    """
+    向量检索与 BM25 关键词检索的混合检索，两路结果用 RRF 融合后取前 k 个
+
+    参数:
+        vector_store: 向量存储，不支持 `keyword_search_with_score` 时退化为纯向量检索
+        query (str): 查询文本
+        k (int): 返回的文档数量
+        fetch_k (int): 每一路召回的文档数量
+        rrf_k (int): RRF 平滑常数
+
+    返回:
+        List[Tuple[Document, float]]: 文档及其融合分数，按分数降序排列
+    """
+    vector_results = vector_store.similarity_search_with_score(query, fetch_k)
+    if not hasattr(vector_store, "keyword_search_with_score"):
+        return vector_results[:k]
+    keyword_results = vector_store.keyword_search_with_score(query, fetch_k)
+    return reciprocal_rank_fusion([vector_results, keyword_results], rrf_k)[:k]
+
+
+async def ahybrid_search(vector_store, query: str, k: int = 10, fetch_k: int = 20, rrf_k: int = 60) -> List[Tuple[Document, float]]:
+    """ `hybrid_search` 的异步版本，向量检索和关键词检索并发执行 """
+    if not hasattr(vector_store, "akeyword_search_with_score"):
+        return (await vector_store.asimilarity_search_with_score(query, fetch_k))[:k]
+    vector_results, keyword_results = await asyncio.gather(
+        vector_store.asimilarity_search_with_score(query, fetch_k),
+        vector_store.akeyword_search_with_score(query, fetch_k),
+    )
+    return reciprocal_rank_fusion([vector_results, keyword_results], rrf_k)[:k]
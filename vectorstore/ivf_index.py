@@ -0,0 +1,196 @@
+import json
+import math
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class IVFFlatIndex:
+    """
+    倒排文件（IVF-Flat）近似最近邻索引。
+
+    用 k-means 将向量划分为 `nlist` 个簇，检索时只扫描与查询最接近的 `nprobe` 个簇内的向量，
+    `nprobe` 越大召回率越高、延迟越高。向量数量低于 `min_train_size` 时不训练，由向量存储走精确检索；
+    训练后新增的向量直接分配到最近的簇，语料增长到训练规模的 `retrain_factor` 倍时重新训练。
+
+    索引只保存簇中心（`ivf_centroids.npy`）、每行所属的簇编号（`ivf_assign.bin`）和训练时的向量数量（`ivf_meta.json`），
+    向量本身仍从向量存储的内存映射文件中读取。
+    """
+
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGN_FILE = "ivf_assign.bin"
+    META_FILE = "ivf_meta.json"
+
+    # 训练时每个簇平均采样的向量数量
+    SAMPLES_PER_LIST = 64
+    # 分配簇时每次读取的行数
+    ASSIGN_BLOCK_ROWS = 16384
+
+    def __init__(
+            self,
+            persist_dir: str,
+            nprobe: int = 16,
+            min_train_size: int = 20000,
+            kmeans_iterations: int = 10,
+            retrain_factor: int = 8,
+    ):
+        """
+        参数:
+            persist_dir (str): 索引文件目录，通常与向量存储目录相同
+            nprobe (int): 检索时扫描的簇数量，用于在召回率和延迟之间取舍
+            min_train_size (int): 训练索引所需的最少向量数量（至少为 1），低于该值时走精确检索
+            kmeans_iterations (int): k-means 迭代次数
+            retrain_factor (int): 语料增长到训练时规模的多少倍后重新训练
+        """
+        if min_train_size < 1:
+            raise ValueError(f"min_train_size must be at least 1, got {min_train_size}")
+        self.persist_dir = persist_dir
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.retrain_factor = retrain_factor
+        self._lock = threading.RLock()
+        self.centroids: Optional[np.ndarray] = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._lists: list[np.ndarray] = []
+        self._trained_size = 0
+
+        centroids_path = os.path.join(persist_dir, self.CENTROIDS_FILE)
+        if os.path.exists(centroids_path):
+            self.centroids = np.load(centroids_path)
+            assign_path = os.path.join(persist_dir, self.ASSIGN_FILE)
+            if os.path.exists(assign_path):
+                self._assign = np.fromfile(assign_path, dtype=np.int32)
+            meta_path = os.path.join(persist_dir, self.META_FILE)
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    self._trained_size = json.load(f)["trained_size"]
+            else:
+                # 旧版本的索引没有记录训练规模，以已分配的行数近似
+                self._trained_size = len(self._assign)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def ready(self) -> bool:
+        """ 索引已训练且倒排列表已构建，可以用于检索 """
+        return self.trained and bool(self._lists)
+
+    @property
+    def nlist(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def sync(self, vectors: Optional[np.ndarray]) -> None:
+        """
+        让索引与向量存储保持一致：截断多余的分配、补齐缺失的分配，并在需要时（重新）训练。
+
+        参数:
+            vectors (Optional[np.ndarray]): 向量存储中的全部（已归一化）向量，通常是内存映射矩阵
+        """
+        count = 0 if vectors is None else len(vectors)
+        with self._lock:
+            if count < self.min_train_size:
+                return
+            if not self.trained or count >= self._trained_size * self.retrain_factor:
+                self._train(vectors)
+                return
+            if len(self._assign) > count:
+                self._assign = self._assign[:count]
+                self._save_assign()
+                self._lists = []
+            if len(self._assign) < count:
+                start = len(self._assign)
+                new_assign = self._assign_rows(vectors, start, count)
+                with open(os.path.join(self.persist_dir, self.ASSIGN_FILE), "ab") as f:
+                    f.write(new_assign.tobytes())
+                self._assign = np.concatenate([self._assign, new_assign])
+                if self._lists:
+                    self._extend_lists(new_assign, start)
+            if not self._lists:
+                self._build_lists()
+
+    def _train(self, vectors: np.ndarray) -> None:
+        """ 在采样的向量上运行球面 k-means，并重新分配所有向量 """
+        count = len(vectors)
+        nlist = max(1, int(4 * math.sqrt(count)))
+        rng = np.random.default_rng(0)
+        sample_size = min(count, nlist * self.SAMPLES_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+        # 向量很少时 4 * sqrt(count) 会超过样本数量
+        nlist = min(nlist, sample_size)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空簇保留原来的中心
+            non_empty = norms[:, 0] > 0
+            centroids[non_empty] = sums[non_empty] / norms[non_empty]
+
+        self.centroids = centroids
+        self._assign = self._assign_rows(vectors, 0, count)
+        self._trained_size = count
+        np.save(os.path.join(self.persist_dir, self.CENTROIDS_FILE), centroids)
+        self._save_assign()
+        meta_path = os.path.join(self.persist_dir, self.META_FILE)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"trained_size": count}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        self._build_lists()
+
+    def _assign_rows(self, vectors: np.ndarray, start: int, end: int) -> np.ndarray:
+        assign = np.empty(end - start, dtype=np.int32)
+        for block_start in range(start, end, self.ASSIGN_BLOCK_ROWS):
+            block = np.asarray(vectors[block_start:min(end, block_start + self.ASSIGN_BLOCK_ROWS)], dtype=np.float32)
+            assign[block_start - start:block_start - start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assign
+
+    def _save_assign(self) -> None:
+        path = os.path.join(self.persist_dir, self.ASSIGN_FILE)
+        tmp_path = path + ".tmp"
+        self._assign.tofile(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _build_lists(self) -> None:
+        order = np.argsort(self._assign, kind="stable")
+        bounds = np.searchsorted(self._assign[order], np.arange(self.nlist + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+
+    def _extend_lists(self, new_assign: np.ndarray, start: int) -> None:
+        for list_id in np.unique(new_assign):
+            rows = start + np.flatnonzero(new_assign == list_id)
+            self._lists[list_id] = np.concatenate([self._lists[list_id], rows])
+
+    def search(self, query: np.ndarray, k: int, vectors: np.ndarray, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在最接近查询的 `nprobe` 个簇中检索。
+
+        参数:
+            query (np.ndarray): 已归一化的查询向量
+            k (int): 返回的结果数量
+            vectors (np.ndarray): 向量存储中的全部向量
+            nprobe (Optional[int]): 本次检索扫描的簇数量，缺省使用初始化时的配置
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: 行号和对应的余弦相似度，按相似度降序排列
+        """
+        lists, centroids = self._lists, self.centroids
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        # 排序后的行号读取内存映射文件时局部性更好
+        rows = np.sort(np.concatenate([lists[i] for i in probe]))
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        if k < len(rows):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
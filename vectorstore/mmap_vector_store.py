@@ -0,0 +1,441 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from vectorstore.bm25_index import BM25Index
+from vectorstore.ivf_index import IVFFlatIndex
+from vectorstore.quantization import Int8Quantizer
+
+
+class MmapVectorStore(VectorStore):
+    """
+    基于内存映射文件的持久化向量存储。
+
+    所有向量以归一化后的 float32/float16 矩阵连续写入 `vectors.bin`，检索时通过 `np.memmap`
+    按块读取，常驻内存不随语料增长；文档内容和元数据以 JSON Lines 追加写入 `docs.jsonl`，
+    `docs.idx` 记录每一行的字节偏移，按需读取命中的文档。
+    `meta.json` 最后写入，作为提交点，进程异常退出后重新打开时会截断未提交的尾部数据。
+
+    对外提供与 `InMemoryVectorStore` 相同的 `add_documents` / `similarity_search_with_score` 接口，
+    分数为余弦相似度。传入 `IVFFlatIndex` 时，语料达到索引的训练规模后使用近似检索，否则精确检索；
+    传入 `Int8Quantizer` 时，精确检索改为扫描常驻内存的 int8 编码，再读取少量候选的原始向量重算分数。
+    同时维护一个 BM25 倒排索引用于关键词检索：新建的存储随写入增量构建，重新打开的已有存储在第一次关键词检索时
+    从 `docs.jsonl` 构建。检索接口可以通过 `rows` 限定只在部分行中检索，供多个会话共享同一个存储时使用。
+    """
+
+    VECTORS_FILE = "vectors.bin"
+    DOCS_FILE = "docs.jsonl"
+    OFFSETS_FILE = "docs.idx"
+    META_FILE = "meta.json"
+
+    # 精确检索时每次从磁盘读取的行数
+    SCAN_BLOCK_ROWS = 16384
+
+    def __init__(
+            self,
+            embedding: Embeddings,
+            persist_dir: str,
+            dtype: str = "float32",
+            index: Optional[IVFFlatIndex] = None,
+            quantizer: Optional[Int8Quantizer] = None,
+    ):
+        """
+        打开（或创建）一个向量存储目录。
+
+        参数:
+            embedding (Embeddings): 用于将文本转换为向量的嵌入模型
+            persist_dir (str): 存储目录，不存在时自动创建
+            dtype (str): 向量在磁盘上的精度，`float32` 或 `float16`，已有存储以 `meta.json` 为准
+            index (Optional[IVFFlatIndex]): 可选的近似最近邻索引，随写入增量更新
+            quantizer (Optional[Int8Quantizer]): 可选的 int8 量化编码，随写入增量更新
+        """
+        self.embedding = embedding
+        self.index = index
+        self.quantizer = quantizer
+        self.persist_dir = persist_dir
+        self._lock = threading.RLock()
+        os.makedirs(persist_dir, exist_ok=True)
+
+        meta = self._read_meta()
+        self.dtype = np.dtype(meta.get("dtype", dtype))
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported vector dtype: {self.dtype}")
+        self.dim: Optional[int] = meta.get("dim")
+        self._count: int = meta.get("count", 0)
+        self._truncate_uncommitted()
+        self._vectors: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+        self._keyword_index: Optional[BM25Index] = None
+        self._remap()
+        if self.index is not None:
+            self.index.sync(self._vectors)
+        if self.quantizer is not None:
+            self.quantizer.sync(self._vectors)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        """ 全部（已归一化的）向量的只读内存映射矩阵，存储为空时为 None """
+        return self._vectors
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_dir, name)
+
+    def _read_meta(self) -> dict:
+        path = self._path(self.META_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self) -> None:
+        # 先写临时文件再原子替换，保证 meta.json 始终完整
+        path = self._path(self.META_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": self._count}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _truncate_uncommitted(self) -> None:
+        """ 截断上次写入中未提交到 meta.json 的尾部数据 """
+        offsets_path = self._path(self.OFFSETS_FILE)
+        docs_end = 0
+        if self._count and os.path.exists(offsets_path):
+            offsets = np.fromfile(offsets_path, dtype=np.uint64, count=self._count + 1)
+            if len(offsets) > self._count:
+                docs_end = int(offsets[self._count])
+            else:
+                docs_end = os.path.getsize(self._path(self.DOCS_FILE))
+        vector_bytes = self._count * (self.dim or 0) * self.dtype.itemsize
+        for name, size in ((self.VECTORS_FILE, vector_bytes),
+                           (self.OFFSETS_FILE, self._count * 8),
+                           (self.DOCS_FILE, docs_end)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _remap(self) -> None:
+        """ 按当前行数重新映射向量和偏移文件 """
+        if not self._count:
+            self._vectors, self._offsets = None, None
+            return
+        self._vectors = np.memmap(self._path(self.VECTORS_FILE), dtype=self.dtype, mode="r",
+                                  shape=(self._count, self.dim))
+        self._offsets = np.memmap(self._path(self.OFFSETS_FILE), dtype=np.uint64, mode="r",
+                                  shape=(self._count,))
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+    ) -> List[str]:
+        """
+        嵌入并写入文本。
+
+        参数:
+            texts (Iterable[str]): 文本列表
+            metadatas (Optional[List[dict]]): 每个文本对应的元数据
+            ids (Optional[List[str]]): 每个文本对应的 ID，缺省时自动生成
+
+        返回:
+            List[str]: 写入文档的 ID 列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self.embedding.embed_documents(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [None] * len(texts)
+        documents = [Document(id=doc_id, page_content=text, metadata=metadata or {})
+                     for text, metadata, doc_id in zip(texts, metadatas, ids)]
+        return self.add_embeddings(documents, vectors)
+
+    def add_embeddings(self, documents: Sequence[Document], vectors: Sequence[Sequence[float]]) -> List[str]:
+        """
+        写入已经嵌入好的文档，调用方负责保证 `documents` 与 `vectors` 一一对应。
+
+        参数:
+            documents (Sequence[Document]): 文档列表
+            vectors (Sequence[Sequence[float]]): 文档对应的嵌入向量
+
+        返回:
+            List[str]: 写入文档的 ID 列表
+        """
+        if not documents:
+            return []
+        matrix = self._normalize(np.asarray(vectors, dtype=np.float32))
+        if matrix.ndim != 2 or matrix.shape[0] != len(documents):
+            raise ValueError("documents and vectors must have the same length")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {matrix.shape[1]}")
+
+            ids, lines = [], []
+            for doc in documents:
+                doc_id = doc.id or uuid.uuid4().hex
+                ids.append(doc_id)
+                lines.append((json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                                         ensure_ascii=False) + "\n").encode("utf-8"))
+
+            docs_path = self._path(self.DOCS_FILE)
+            start = os.path.getsize(docs_path) if os.path.exists(docs_path) else 0
+            offsets = np.cumsum([start] + [len(line) for line in lines[:-1]], dtype=np.uint64)
+
+            with open(self._path(self.VECTORS_FILE), "ab") as f:
+                f.write(matrix.astype(self.dtype).tobytes())
+            with open(docs_path, "ab") as f:
+                f.writelines(lines)
+            with open(self._path(self.OFFSETS_FILE), "ab") as f:
+                f.write(offsets.tobytes())
+
+            if self._keyword_index is None and not self._count:
+                self._keyword_index = BM25Index()
+            # 先写入 BM25 索引再公开新的行数，关键词检索看到的行号都已经在索引中
+            if self._keyword_index is not None:
+                self._keyword_index.add(doc.page_content for doc in documents)
+            self._count += len(documents)
+            self._write_meta()
+            self._remap()
+            if self.index is not None:
+                self.index.sync(self._vectors)
+            if self.quantizer is not None:
+                self.quantizer.sync(self._vectors)
+        return ids
+
+    def _iter_documents(self, rows: Iterable[int]) -> Iterator[Document]:
+        offsets = self._offsets
+        with open(self._path(self.DOCS_FILE), "rb") as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                record = json.loads(f.readline())
+                yield Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+
+    def get_documents(self, rows: Iterable[int]) -> List[Document]:
+        """
+        按行号读取文档。
+
+        参数:
+            rows (Iterable[int]): 行号列表
+
+        返回:
+            List[Document]: 与行号顺序一致的文档列表
+        """
+        return list(self._iter_documents(rows))
+
+    def _scan(self, query: np.ndarray) -> np.ndarray:
+        """ 按块计算查询向量与所有向量的余弦相似度 """
+        vectors = self._vectors
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), self.SCAN_BLOCK_ROWS):
+            block = vectors[start:start + self.SCAN_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if k >= len(scores):
+            return np.argsort(-scores)
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def _score_rows(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """ 按块计算查询向量与指定行的余弦相似度，`rows` 需已排序 """
+        vectors = self._vectors
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.SCAN_BLOCK_ROWS):
+            block = rows[start:start + self.SCAN_BLOCK_ROWS]
+            scores[start:start + len(block)] = np.asarray(vectors[block], dtype=np.float32) @ query
+        return scores
+
+    def _valid_rows(self, rows: Sequence[int]) -> np.ndarray:
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        return rows[(rows >= 0) & (rows < self._count)]
+
+    def vector_search_rows(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            rows: Optional[Sequence[int]] = None,
+            nprobe: Optional[int] = None,
+            exact: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        根据向量检索最相似的行。
+
+        参数:
+            embedding (List[float]): 查询向量
+            k (int): 返回的结果数量
+            rows (Optional[Sequence[int]]): 只在这些行中检索，指定时直接精确计算这些行的分数
+            nprobe (Optional[int]): 近似检索扫描的簇数量，缺省使用索引的配置
+            exact (bool): 是否强制精确检索（不使用索引和量化编码）
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: 行号和对应的余弦相似度，按相似度降序排列
+        """
+        if not self._count or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))
+        if rows is not None:
+            rows = self._valid_rows(rows)
+            scores = self._score_rows(query, rows)
+            top = self._top_k(scores, k)
+            return rows[top], scores[top]
+        if not exact and self.index is not None and self.index.ready:
+            return self.index.search(query, k, self._vectors, nprobe=nprobe)
+        if not exact and self.quantizer is not None and self.quantizer.ready:
+            return self.quantizer.search(query, k, self._vectors)
+        scores = self._scan(query)
+        top = self._top_k(scores, k)
+        return top, scores[top]
+
+    def similarity_search_by_vector_with_score(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Callable[[Document], bool]] = None,
+            nprobe: Optional[int] = None,
+            exact: bool = False,
+            rows: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        根据向量检索最相似的文档。
+
+        参数:
+            embedding (List[float]): 查询向量
+            k (int): 返回的文档数量
+            filter (Optional[Callable[[Document], bool]]): 文档过滤函数，指定时走精确检索
+            nprobe (Optional[int]): 近似检索扫描的簇数量，缺省使用索引的配置
+            exact (bool): 是否强制精确检索（不使用索引和量化编码）
+            rows (Optional[Sequence[int]]): 只在这些行中检索
+
+        返回:
+            List[Tuple[Document, float]]: 文档及其余弦相似度，按相似度降序排列
+        """
+        if not self._count or k <= 0:
+            return []
+        if filter is None:
+            rows, scores = self.vector_search_rows(embedding, k, rows=rows, nprobe=nprobe, exact=exact)
+            return list(zip(self.get_documents(rows), scores.tolist()))
+
+        # 带过滤条件时按分数顺序逐行读取，直到凑满 k 个
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))
+        if rows is None:
+            scores = self._scan(query)
+            order = np.argsort(-scores)
+        else:
+            rows = self._valid_rows(rows)
+            row_scores = self._score_rows(query, rows)
+            scores = dict(zip(rows.tolist(), row_scores.tolist()))
+            order = rows[np.argsort(-row_scores)]
+        results = []
+        for row, doc in zip(order, self._iter_documents(order)):
+            if filter(doc):
+                results.append((doc, float(scores[row])))
+                if len(results) >= k:
+                    break
+        return results
+
+    def _ensure_keyword_index(self) -> BM25Index:
+        """ 获取关键词索引，已有存储首次使用时从 docs.jsonl 构建 """
+        with self._lock:
+            if self._keyword_index is None:
+                keyword_index = BM25Index()
+                if self._count:
+                    keyword_index.add(doc.page_content for doc in self._iter_documents(range(self._count)))
+                self._keyword_index = keyword_index
+            return self._keyword_index
+
+    def keyword_search_rows(self, query: str, k: int = 4, rows: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 关键词检索，返回行号。
+
+        参数:
+            query (str): 查询文本
+            k (int): 返回的结果数量
+            rows (Optional[Sequence[int]]): 只在这些行中检索
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: 行号和对应的 BM25 分数，按分数降序排列
+        """
+        if not self._count or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return self._ensure_keyword_index().search(query, k, None if rows is None else self._valid_rows(rows))
+
+    def keyword_search_with_score(self, query: str, k: int = 4, rows: Optional[Sequence[int]] = None) -> List[Tuple[Document, float]]:
+        """
+        BM25 关键词检索。
+
+        参数:
+            query (str): 查询文本
+            k (int): 返回的文档数量
+            rows (Optional[Sequence[int]]): 只在这些行中检索
+
+        返回:
+            List[Tuple[Document, float]]: 文档及其 BM25 分数，按分数降序排列
+        """
+        rows, scores = self.keyword_search_rows(query, k, rows)
+        return list(zip(self.get_documents(rows), scores.tolist()))
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = self.embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k, **kwargs)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        # 查询向量使用异步嵌入接口，磁盘扫描在线程池中执行，避免阻塞事件循环
+        embedding = await self.embedding.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_by_vector_with_score, embedding, k, **kwargs)
+
+    async def akeyword_search_with_score(self, query: str, k: int = 4, rows: Optional[Sequence[int]] = None) -> List[Tuple[Document, float]]:
+        return await asyncio.to_thread(self.keyword_search_with_score, query, k, rows)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # 向量已归一化，余弦相似度映射到 [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(
+            cls,
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            *,
+            persist_dir: str,
+            dtype: str = "float32",
+            **kwargs: Any,
+    ) -> "MmapVectorStore":
+        store = cls(embedding, persist_dir, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, **kwargs)
+        return store
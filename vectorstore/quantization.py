@@ -0,0 +1,251 @@
+import argparse
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class Int8Quantizer:
+    """
+    int8 标量量化的向量编码，用于在压缩后的向量上检索。
+
+    每个（已归一化的）向量按自身的最大绝对值缩放到 [-127, 127]，保存为 int8 编码和一个 float32 缩放系数，
+    4096 维的向量从 16 KB（float32）压缩到约 4 KB。检索时先用编码计算近似分数，取前 `k * rescore_factor`
+    个候选，再从向量存储的内存映射文件中读取原始向量精确重算分数，返回的分数与精确检索一致。
+
+    编码常驻内存（`sq8_codes.bin` / `sq8_scales.bin` 持久化），每次检索只扫描编码，
+    原始向量只读取少量候选行，留在磁盘和页缓存中。
+    """
+
+    CODES_FILE = "sq8_codes.bin"
+    SCALES_FILE = "sq8_scales.bin"
+
+    # 编码时每次读取的行数
+    ENCODE_BLOCK_ROWS = 16384
+    # 近似打分时每次转换的行数
+    SCAN_BLOCK_ROWS = 16384
+
+    def __init__(self, persist_dir: str, rescore_factor: int = 4):
+        """
+        参数:
+            persist_dir (str): 编码文件目录，通常与向量存储目录相同
+            rescore_factor (int): 精确重算的候选数量与 k 的倍数，越大召回率越高、读取的原始向量越多
+        """
+        self.persist_dir = persist_dir
+        self.rescore_factor = max(1, rescore_factor)
+        self._lock = threading.RLock()
+        self._codes: Optional[np.ndarray] = None
+        self._scales = np.empty(0, dtype=np.float32)
+
+    @property
+    def ready(self) -> bool:
+        return self._codes is not None and len(self._codes) > 0
+
+    def __len__(self) -> int:
+        return len(self._scales)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_dir, name)
+
+    @staticmethod
+    def encode(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        对一批向量做 int8 标量量化
+
+        参数:
+            vectors (np.ndarray): 形状为 (n, dim) 的向量
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: int8 编码和每个向量的缩放系数，`codes * scales[:, None]` 近似还原向量
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _load(self, dim: int) -> None:
+        scales_path, codes_path = self._path(self.SCALES_FILE), self._path(self.CODES_FILE)
+        if os.path.exists(scales_path) and os.path.exists(codes_path):
+            scales = np.fromfile(scales_path, dtype=np.float32)
+            codes = np.fromfile(codes_path, dtype=np.int8)
+            # 两个文件的行数不一致时（写入中断）以较短的为准
+            rows = min(len(scales), len(codes) // dim)
+            self._scales, self._codes = scales[:rows], codes[:rows * dim].reshape(rows, dim)
+        else:
+            self._scales, self._codes = np.empty(0, dtype=np.float32), np.empty((0, dim), dtype=np.int8)
+
+    def _save(self) -> None:
+        for name, array in ((self.CODES_FILE, self._codes), (self.SCALES_FILE, self._scales)):
+            path = self._path(name)
+            tmp_path = path + ".tmp"
+            array.tofile(tmp_path)
+            os.replace(tmp_path, path)
+
+    def sync(self, vectors: Optional[np.ndarray]) -> None:
+        """
+        让编码与向量存储保持一致：截断多余的编码，补齐新写入向量的编码。
+
+        参数:
+            vectors (Optional[np.ndarray]): 向量存储中的全部（已归一化）向量，通常是内存映射矩阵
+        """
+        if vectors is None or not len(vectors):
+            return
+        count, dim = vectors.shape
+        with self._lock:
+            if self._codes is None or self._codes.shape[1] != dim:
+                self._load(dim)
+            if len(self._scales) > count:
+                self._codes, self._scales = self._codes[:count], self._scales[:count]
+                self._save()
+            if len(self._scales) < count:
+                start = len(self._scales)
+                new_codes, new_scales = [], []
+                for block_start in range(start, count, self.ENCODE_BLOCK_ROWS):
+                    codes, scales = self.encode(vectors[block_start:min(count, block_start + self.ENCODE_BLOCK_ROWS)])
+                    new_codes.append(codes)
+                    new_scales.append(scales)
+                new_codes, new_scales = np.concatenate(new_codes), np.concatenate(new_scales)
+                # 先写缩放系数再写编码，中断时按较短的文件恢复
+                with open(self._path(self.SCALES_FILE), "ab") as f:
+                    f.write(new_scales.tobytes())
+                with open(self._path(self.CODES_FILE), "ab") as f:
+                    f.write(new_codes.tobytes())
+                self._codes = np.concatenate([self._codes, new_codes])
+                self._scales = np.concatenate([self._scales, new_scales])
+
+    def approximate_scores(self, query: np.ndarray, count: Optional[int] = None) -> np.ndarray:
+        """
+        用编码计算查询向量与所有向量的近似余弦相似度
+
+        参数:
+            query (np.ndarray): 已归一化的查询向量
+            count (Optional[int]): 只计算前 `count` 行，缺省计算全部
+
+        返回:
+            np.ndarray: 每一行的近似分数
+        """
+        codes, scales = self._codes, self._scales
+        if count is not None:
+            codes, scales = codes[:count], scales[:count]
+        scores = np.empty(len(scales), dtype=np.float32)
+        for start in range(0, len(scales), self.SCAN_BLOCK_ROWS):
+            block = codes[start:start + self.SCAN_BLOCK_ROWS]
+            scores[start:start + len(block)] = (block.astype(np.float32) @ query) * scales[start:start + len(block)]
+        return scores
+
+    def search(self, query: np.ndarray, k: int, vectors: np.ndarray, rescore_factor: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在编码上检索候选，再用原始向量精确重算分数。
+
+        参数:
+            query (np.ndarray): 已归一化的查询向量
+            k (int): 返回的结果数量
+            vectors (np.ndarray): 向量存储中的全部向量，用于精确重算
+            rescore_factor (Optional[int]): 本次检索的重算倍数，缺省使用初始化时的配置，为 0 时直接返回近似分数
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: 行号和对应的余弦相似度，按相似度降序排列
+        """
+        # 检索期间可能有新写入的编码，只使用调用方持有的向量对应的行
+        scores = self.approximate_scores(query, len(vectors))
+        factor = self.rescore_factor if rescore_factor is None else rescore_factor
+        if factor <= 0:
+            rows = _top_k(scores, k)
+            return rows, scores[rows]
+        # 排序后的行号读取内存映射文件时局部性更好
+        rows = np.sort(_top_k(scores, k * factor))
+        exact = np.asarray(vectors[rows], dtype=np.float32) @ query
+        top = _top_k(exact, k)
+        return rows[top], exact[top]
+
+    def memory_stats(self, vectors: Optional[np.ndarray] = None) -> dict:
+        """
+        获取编码占用的内存，以及与原始向量的对比
+
+        参数:
+            vectors (Optional[np.ndarray]): 向量存储中的全部向量，用于计算原始向量的大小
+
+        返回:
+            dict: 向量数量、编码字节数、原始向量字节数和压缩比
+        """
+        code_bytes = (0 if self._codes is None else self._codes.nbytes) + self._scales.nbytes
+        vector_bytes = 0 if vectors is None else int(vectors.size * vectors.dtype.itemsize)
+        return {
+            "vectors": len(self._scales),
+            "code_bytes": code_bytes,
+            "vector_bytes": vector_bytes,
+            "compression": round(vector_bytes / code_bytes, 2) if code_bytes else None,
+        }
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    if k >= len(scores):
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _exact_scores(vectors: np.ndarray, query: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        scores[start:start + len(block)] = np.asarray(block, dtype=np.float32) @ query
+    return scores
+
+
+def evaluate_recall(vectors: np.ndarray, quantizer: Int8Quantizer, k: int = 10, samples: int = 100,
+                    noise: float = 0.5, seed: int = 0) -> dict:
+    """
+    估计量化检索的 recall@k：以加了噪声的已存储向量为查询，与精确检索的前 k 个结果比较
+
+    参数:
+        vectors (np.ndarray): 向量存储中的全部向量
+        quantizer (Int8Quantizer): 已与 `vectors` 同步的编码
+        k (int): 比较的结果数量
+        samples (int): 查询数量
+        noise (float): 查询噪声与向量的相对大小，为 0 时查询就是已存储的向量
+        seed (int): 随机种子
+
+    返回:
+        dict: 只用编码排序的 recall@k，以及精确重算后的 recall@k
+    """
+    rng = np.random.default_rng(seed)
+    count, dim = vectors.shape
+    hits_codes, hits_rescored, total = 0, 0, 0
+    for row in rng.choice(count, min(samples, count), replace=False):
+        query = np.asarray(vectors[row], dtype=np.float32) + rng.standard_normal(dim).astype(np.float32) * noise / np.sqrt(dim)
+        query /= np.linalg.norm(query)
+        exact = set(_top_k(_exact_scores(vectors, query), k).tolist())
+        hits_codes += len(exact & set(quantizer.search(query, k, vectors, rescore_factor=0)[0].tolist()))
+        hits_rescored += len(exact & set(quantizer.search(query, k, vectors)[0].tolist()))
+        total += len(exact)
+    return {
+        "k": k,
+        "queries": min(samples, count),
+        "recall_codes": hits_codes / total if total else None,
+        "recall_rescored": hits_rescored / total if total else None,
+    }
+
+
+if __name__ == "__main__":
+    from vectorstore.mmap_vector_store import MmapVectorStore
+
+    parser = argparse.ArgumentParser(description="统计向量存储的 int8 量化内存占用和 recall@k")
+    parser.add_argument("persist_dir", help="向量存储目录，如 vector_store/<嵌入模型>/default")
+    parser.add_argument("--k", type=int, default=10, help="比较的结果数量")
+    parser.add_argument("--samples", type=int, default=100, help="查询数量")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="精确重算的候选数量与 k 的倍数")
+    args = parser.parse_args()
+
+    store = MmapVectorStore(None, args.persist_dir, quantizer=Int8Quantizer(args.persist_dir, args.rescore_factor))
+    if not len(store):
+        print(f"❌ 向量存储为空: {args.persist_dir}")
+    else:
+        stats = store.quantizer.memory_stats(store.vectors)
+        print(f"📦 {stats['vectors']} 个向量，编码 {stats['code_bytes'] / 2 ** 20:.1f} MB，"
+              f"原始向量 {stats['vector_bytes'] / 2 ** 20:.1f} MB，压缩 {stats['compression']}x")
+        recall = evaluate_recall(store.vectors, store.quantizer, args.k, args.samples)
+        print(f"🎯 recall@{recall['k']}（{recall['queries']} 个查询）: 只用编码 {recall['recall_codes']:.3f}，"
+              f"精确重算后 {recall['recall_rescored']:.3f}")
@@ -0,0 +1,559 @@
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from utils.tracing import get_logger
+from vectorstore.mmap_vector_store import MmapVectorStore
+
+logger = get_logger("shared_store")
+
+
+def content_hash(text: str) -> str:
+    """ chunk 内容的哈希，相同内容的 chunk 在共享存储中只保存一份 """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Namespace:
+    """ 一个会话在共享存储中引用的 chunk """
+    name: str
+    rows: dict = field(default_factory=dict)            # 行号 -> 该会话写入时的元数据
+    sources: set = field(default_factory=set)           # 写入过的文档来源（文件路径）
+    last_access: float = field(default_factory=time.monotonic)
+    _row_array: Optional[np.ndarray] = field(default=None, repr=False)
+
+    @property
+    def row_array(self) -> np.ndarray:
+        """ 已排序的行号数组，用于限定检索范围 """
+        if self._row_array is None:
+            self._row_array = np.fromiter(sorted(self.rows), dtype=np.int64, count=len(self.rows))
+        return self._row_array
+
+
+class SharedVectorStore:
+    """
+    进程内共享、多会话复用的向量存储。
+
+    所有会话的 chunk 写入同一个 `MmapVectorStore`，按内容哈希去重，相同的文档无论被多少个会话上传都只嵌入和保存一次；
+    每个会话是一个命名空间，只记录自己引用的行号，检索时只在这些行中计算分数。
+
+    每一行记录引用它的命名空间数量，命名空间被释放（会话删除、空闲超过 `ttl`，或总内容超过 `max_bytes` 时
+    按最近最少使用的顺序淘汰）后，不再被引用的行成为垃圾；垃圾超过有效内容的 `compact_ratio` 时，
+    在后台线程中把仍被引用的行复制到新一代存储并删除旧存储，内存和磁盘占用随去重后的内容增长，而不是随会话数量增长。
+    复制期间检索和写入照常使用旧存储，只有最后补齐新写入的行并切换存储时持有锁。
+
+    命名空间只保存在内存中，存储目录按进程区分（见 `process_dir_name`），进程重启后从空存储开始（嵌入向量缓存仍然有效）。
+    """
+
+    def __init__(
+            self,
+            embedding: Embeddings,
+            base_dir: str,
+            ttl: float = 3600,
+            max_bytes: int = 2 * 1024 ** 3,
+            compact_ratio: float = 0.5,
+            dtype: str = "float32",
+    ):
+        """
+        参数:
+            embedding (Embeddings): 嵌入模型
+            base_dir (str): 存储目录，只能由当前进程使用，每次压缩创建一个新的子目录
+            ttl (float): 命名空间空闲多久（秒）后被释放，为 0 时不按空闲时间释放
+            max_bytes (int): 被引用内容（向量和文本）的总字节数上限，超出时释放最近最少使用的命名空间
+            compact_ratio (float): 垃圾字节数超过有效字节数的该比例时压缩
+            dtype (str): 向量在磁盘上的精度
+        """
+        self.embedding = embedding
+        self.base_dir = base_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compact_ratio = compact_ratio
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compacting = False
+        self._namespaces: OrderedDict[str, Namespace] = OrderedDict()
+        self._row_by_hash: dict[str, int] = {}
+        self._hash_by_row: dict[int, str] = {}
+        self._refcounts: dict[int, int] = {}
+        self._row_bytes: dict[int, int] = {}
+        self.live_bytes = 0
+        self.garbage_bytes = 0
+        self.evictions = 0
+        self.compactions = 0
+        self._generation = 0
+        self._previous_dir: Optional[str] = None
+        self.store = self._open_generation(0)
+
+    def _open_generation(self, generation: int) -> MmapVectorStore:
+        return MmapVectorStore(self.embedding, os.path.join(self.base_dir, str(generation)), dtype=self.dtype)
+
+    def namespace(self, name: str) -> "NamespaceView":
+        """
+        获取命名空间的向量存储视图，命名空间在第一次写入时创建
+
+        参数:
+            name (str): 命名空间名称，通常是会话 ID
+
+        返回:
+            NamespaceView: 只能看到该命名空间文档的向量存储
+        """
+        return NamespaceView(self, name)
+
+    def _touch(self, name: str, create: bool = False) -> Optional[Namespace]:
+        namespace = self._namespaces.get(name)
+        if namespace is None and create:
+            namespace = self._namespaces[name] = Namespace(name)
+        if namespace is not None:
+            namespace.last_access = time.monotonic()
+            self._namespaces.move_to_end(name)
+        return namespace
+
+    def add(self, name: str, documents: Sequence[Document], vectors: Sequence[Sequence[float]]) -> List[str]:
+        """
+        向命名空间写入已经嵌入好的文档，内容已存在的 chunk 只增加引用
+
+        参数:
+            name (str): 命名空间名称
+            documents (Sequence[Document]): 文档列表
+            vectors (Sequence[Sequence[float]]): 文档对应的嵌入向量
+
+        返回:
+            List[str]: 文档在共享存储中的 ID
+        """
+        if not documents:
+            return []
+        hashes = [content_hash(doc.page_content) for doc in documents]
+        with self._lock:
+            namespace = self._touch(name, create=True)
+            # 同一批次中重复的内容只写入一次
+            new = {}
+            for index, digest in enumerate(hashes):
+                if digest not in self._row_by_hash and digest not in new:
+                    new[digest] = index
+            if new:
+                start = len(self.store)
+                self.store.add_embeddings([documents[i] for i in new.values()], [vectors[i] for i in new.values()])
+                for offset, (digest, index) in enumerate(new.items()):
+                    row = start + offset
+                    self._row_by_hash[digest], self._hash_by_row[row] = row, digest
+                    self._refcounts[row] = 0
+                    self._row_bytes[row] = self._vector_bytes() + len(documents[index].page_content.encode("utf-8"))
+
+            for doc, digest in zip(documents, hashes):
+                row = self._row_by_hash[digest]
+                if row not in namespace.rows:
+                    namespace.rows[row] = doc.metadata
+                    self._reference(row)
+                if doc.metadata.get("source"):
+                    namespace.sources.add(doc.metadata["source"])
+            namespace._row_array = None
+            ids = [doc.id for doc in self.store.get_documents([self._row_by_hash[digest] for digest in hashes])]
+            self._evict(keep=name)
+            return ids
+
+    def _vector_bytes(self) -> int:
+        return (self.store.dim or 0) * self.store.dtype.itemsize
+
+    def _reference(self, row: int) -> None:
+        # 引用数为 0 的行只可能是刚写入的行，已释放的行不再参与去重
+        if self._refcounts[row] == 0:
+            self.live_bytes += self._row_bytes[row]
+        self._refcounts[row] += 1
+
+    def _release_rows(self, rows: Iterable[int]) -> None:
+        for row in rows:
+            self._refcounts[row] -= 1
+            if self._refcounts[row] == 0:
+                # 不再被引用的行不能再被去重命中，压缩时删除
+                del self._row_by_hash[self._hash_by_row.pop(row)]
+                self.live_bytes -= self._row_bytes[row]
+                self.garbage_bytes += self._row_bytes[row]
+
+    def release(self, name: str) -> bool:
+        """
+        释放命名空间及其引用，会话结束时调用
+
+        参数:
+            name (str): 命名空间名称
+
+        返回:
+            bool: 命名空间是否存在
+        """
+        with self._lock:
+            namespace = self._namespaces.pop(name, None)
+            if namespace is None:
+                return False
+            self._release_rows(namespace.rows)
+            self._maybe_compact()
+            return True
+
+    def remove_source(self, name: str, source: str) -> int:
+        """
+        从命名空间中删除来自 `source` 的文档，文件内容变化后重新导入前调用；
+        同一命名空间中内容相同的 chunk 只记录第一次写入时的来源
+
+        参数:
+            name (str): 命名空间名称
+            source (str): 文档来源（文件路径）
+
+        返回:
+            int: 删除的文档数量
+        """
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None or source not in namespace.sources:
+                return 0
+            rows = [row for row, metadata in namespace.rows.items() if metadata.get("source") == source]
+            for row in rows:
+                del namespace.rows[row]
+            namespace.sources.discard(source)
+            namespace._row_array = None
+            self._release_rows(rows)
+            self._maybe_compact()
+            return len(rows)
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """ 释放空闲超时的命名空间，并在超出内存上限时按最近最少使用的顺序释放 """
+        now = time.monotonic()
+        for name, namespace in list(self._namespaces.items()):
+            over_ttl = self.ttl > 0 and now - namespace.last_access > self.ttl
+            over_cap = self.live_bytes > self.max_bytes
+            if not (over_ttl or over_cap):
+                break
+            if name == keep:
+                continue
+            del self._namespaces[name]
+            self._release_rows(namespace.rows)
+            self.evictions += 1
+            logger.info("释放向量存储命名空间 %s（%s）", name, "空闲超时" if over_ttl else "超出内存上限")
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        """ 垃圾超过阈值时在后台线程中压缩，调用方持有锁 """
+        if self._compacting or not self.garbage_bytes or self.garbage_bytes <= self.compact_ratio * max(self.live_bytes, 1):
+            return
+        self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="shared-store-compact", daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("压缩共享向量存储失败")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    @staticmethod
+    def _copy_rows(old_store: MmapVectorStore, new_store: MmapVectorStore, rows: List[int], mapping: dict) -> None:
+        for start in range(0, len(rows), MmapVectorStore.SCAN_BLOCK_ROWS):
+            block = rows[start:start + MmapVectorStore.SCAN_BLOCK_ROWS]
+            new_start = len(new_store)
+            new_store.add_embeddings(old_store.get_documents(block), np.asarray(old_store.vectors[block], dtype=np.float32))
+            mapping.update((row, new_start + offset) for offset, row in enumerate(block))
+
+    def compact(self) -> None:
+        """
+        把仍被引用的行复制到新一代存储，删除上一代存储。
+
+        复制在锁外进行，期间的写入进入旧存储，切换前在锁内补齐；复制期间被释放的行会留在新存储中，
+        计入垃圾，下一次压缩时删除
+        """
+        with self._compact_lock:
+            with self._lock:
+                old_store = self.store
+                live_rows = sorted(row for row, count in self._refcounts.items() if count > 0)
+                generation = self._generation + 1
+            new_store = self._open_generation(generation)
+            mapping = {}
+            self._copy_rows(old_store, new_store, live_rows, mapping)
+
+            with self._lock:
+                added = sorted(row for row, count in self._refcounts.items() if count > 0 and row not in mapping)
+                self._copy_rows(old_store, new_store, added, mapping)
+                self._hash_by_row = {mapping[row]: digest for row, digest in self._hash_by_row.items()}
+                self._row_by_hash = {digest: row for row, digest in self._hash_by_row.items()}
+                self._refcounts = {mapping[row]: self._refcounts[row] for row in mapping}
+                self._row_bytes = {mapping[row]: self._row_bytes[row] for row in mapping}
+                for namespace in self._namespaces.values():
+                    namespace.rows = {mapping[row]: metadata for row, metadata in namespace.rows.items()}
+                    namespace._row_array = None
+                self.store = new_store
+                self._generation = generation
+                self.garbage_bytes = sum(self._row_bytes[row] for row, count in self._refcounts.items() if count == 0)
+                self.compactions += 1
+
+                # 正在进行的检索可能还在读取上一代存储，保留一代，下一次压缩时再删除
+                if self._previous_dir is not None:
+                    shutil.rmtree(self._previous_dir, ignore_errors=True)
+                self._previous_dir = old_store.persist_dir
+                logger.info("压缩共享向量存储：保留 %d 行，第 %d 代", len(mapping), self._generation)
+
+    def _snapshot(self, name: str) -> Tuple[MmapVectorStore, dict, np.ndarray]:
+        """
+        获取当前一代存储、命名空间的元数据和行号，检索在锁外进行；
+        压缩会替换存储和元数据字典而不是原地修改，快照在检索期间保持一致
+        """
+        with self._lock:
+            self._evict(keep=name)
+            namespace = self._touch(name)
+            if namespace is None:
+                return self.store, {}, np.empty(0, dtype=np.int64)
+            return self.store, namespace.rows, namespace.row_array
+
+    @staticmethod
+    def _documents(store: MmapVectorStore, metadatas: dict, rows: np.ndarray, scores: np.ndarray) -> List[Tuple[Document, float]]:
+        # 文档内容共享，元数据（如文件路径）使用该命名空间写入时的值
+        return [(Document(id=doc.id, page_content=doc.page_content, metadata=metadatas.get(row, doc.metadata)), score)
+                for row, doc, score in zip(rows.tolist(), store.get_documents(rows), scores.tolist())]
+
+    def vector_search(self, name: str, embedding: List[float], k: int,
+                      filter: Optional[Callable[[Document], bool]] = None) -> List[Tuple[Document, float]]:
+        """ 在命名空间中按向量检索，`filter` 作用于带有该命名空间元数据的文档 """
+        store, metadatas, rows = self._snapshot(name)
+        if not len(rows):
+            return []
+        if filter is None:
+            rows, scores = store.vector_search_rows(embedding, k, rows=rows)
+            return self._documents(store, metadatas, rows, scores)
+        rows, scores = store.vector_search_rows(embedding, len(rows), rows=rows)
+        return [(doc, score) for doc, score in self._documents(store, metadatas, rows, scores) if filter(doc)][:k]
+
+    def keyword_search(self, name: str, query: str, k: int) -> List[Tuple[Document, float]]:
+        """ 在命名空间中按 BM25 检索 """
+        store, metadatas, rows = self._snapshot(name)
+        if not len(rows):
+            return []
+        rows, scores = store.keyword_search_rows(query, k, rows=rows)
+        return self._documents(store, metadatas, rows, scores)
+
+    def has_source(self, name: str, source: str) -> bool:
+        """ 命名空间中是否有来自 `source` 的文档，命名空间被释放后返回 False """
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            return namespace is not None and source in namespace.sources
+
+    def size(self, name: str) -> int:
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            return 0 if namespace is None else len(namespace.rows)
+
+    def stats(self) -> dict:
+        """
+        获取共享存储的统计信息
+
+        返回:
+            dict: 命名空间数量、去重后的行数、有效和垃圾字节数、淘汰和压缩次数
+        """
+        with self._lock:
+            references = sum(len(namespace.rows) for namespace in self._namespaces.values())
+            unique = sum(1 for count in self._refcounts.values() if count > 0)
+            return {
+                "namespaces": len(self._namespaces),
+                "unique_chunks": unique,
+                "references": references,
+                "dedup_ratio": round(references / unique, 2) if unique else None,
+                "live_bytes": self.live_bytes,
+                "garbage_bytes": self.garbage_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "compactions": self.compactions,
+            }
+
+
+class NamespaceView(VectorStore):
+    """
+    共享向量存储中一个命名空间的视图，对外提供与 `MmapVectorStore` 相同的写入和检索接口，
+    可以直接传给导入队列和图的 config。
+
+    命名空间被淘汰后视图仍然可用，之后的写入会重新创建命名空间；导入队列通过 `has_source` 发现文件已随命名空间
+    一起被释放，再次提交时重新导入。
+    """
+
+    def __init__(self, shared: SharedVectorStore, name: str):
+        self.shared = shared
+        self.name = name
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.shared.embedding
+
+    def __len__(self) -> int:
+        return self.shared.size(self.name)
+
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self.embeddings.embed_documents(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [None] * len(texts)
+        documents = [Document(id=doc_id, page_content=text, metadata=metadata or {})
+                     for text, metadata, doc_id in zip(texts, metadatas, ids)]
+        return self.add_embeddings(documents, vectors)
+
+    def add_embeddings(self, documents: Sequence[Document], vectors: Sequence[Sequence[float]]) -> List[str]:
+        return self.shared.add(self.name, documents, vectors)
+
+    def has_source(self, source: str) -> bool:
+        """ 命名空间中是否还有来自 `source`（文件路径）的文档 """
+        return self.shared.has_source(self.name, source)
+
+    def remove_source(self, source: str) -> int:
+        """ 删除来自 `source`（文件路径）的文档，返回删除的数量 """
+        return self.shared.remove_source(self.name, source)
+
+    def release(self) -> bool:
+        """ 释放命名空间，会话结束时调用 """
+        return self.shared.release(self.name)
+
+    @staticmethod
+    def _check_search_kwargs(kwargs: dict) -> None:
+        # 命名空间检索总是精确检索，只支持 filter，其他参数（如 nprobe）不静默忽略
+        unsupported = set(kwargs) - {"filter"}
+        if unsupported:
+            raise TypeError(f"unsupported search arguments for NamespaceView: {', '.join(sorted(unsupported))}")
+
+    def similarity_search_by_vector_with_score(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Callable[[Document], bool]] = None,
+            **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        根据向量在命名空间中检索最相似的文档
+
+        参数:
+            embedding (List[float]): 查询向量
+            k (int): 返回的文档数量
+            filter (Optional[Callable[[Document], bool]]): 文档过滤函数
+
+        返回:
+            List[Tuple[Document, float]]: 文档及其余弦相似度，按相似度降序排列
+        """
+        self._check_search_kwargs(kwargs)
+        return self.shared.vector_search(self.name, embedding, k, filter)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        self._check_search_kwargs(kwargs)
+        if not len(self):
+            return []
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k, **kwargs)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        self._check_search_kwargs(kwargs)
+        if not len(self):
+            return []
+        embedding = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_by_vector_with_score, embedding, k, **kwargs)
+
+    def keyword_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        return self.shared.keyword_search(self.name, query, k)
+
+    async def akeyword_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        return await asyncio.to_thread(self.keyword_search_with_score, query, k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(
+            cls,
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            *,
+            base_dir: str,
+            name: str = "default",
+            ttl: float = 0,
+            dtype: str = "float32",
+            **kwargs: Any,
+    ) -> "NamespaceView":
+        """ 新建一个共享存储，把文本写入其中名为 `name` 的命名空间；缺省不按空闲时间释放 """
+        view = SharedVectorStore(embedding, base_dir, ttl=ttl, dtype=dtype).namespace(name)
+        view.add_texts(texts, metadatas=metadatas, **kwargs)
+        return view
+
+
+_HOST = re.sub(r"[^0-9A-Za-z._]", "_", socket.gethostname())
+_PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+
+def process_dir_name() -> str:
+    """
+    当前进程的共享存储目录名：`<主机名>-<进程号>-<随机串>`。
+
+    多个容器挂载同一个 VECTOR_STORE_DIR 时进程号可能相同，随机串保证目录不会被其他进程复用
+    """
+    return f"{_HOST}-{os.getpid()}-{_PROCESS_TOKEN}"
+
+
+def remove_stale_process_dirs(parent: str) -> None:
+    """
+    删除本机已退出进程留下的共享存储目录。其他主机（容器）的目录无法判断进程是否存活，不做处理
+
+    参数:
+        parent (str): 按进程分目录的上级目录
+    """
+    if not os.path.isdir(parent):
+        return
+    current = process_dir_name()
+    for entry in os.listdir(parent):
+        parts = entry.rsplit("-", 2)
+        if len(parts) != 3 or parts[0] != _HOST or not parts[1].isdigit() or entry == current:
+            continue
+        try:
+            os.kill(int(parts[1]), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+        except PermissionError:
+            pass
+
+
+_shared_stores: dict[str, SharedVectorStore] = {}
+_shared_stores_lock = threading.Lock()
+
+
+def get_shared_store(key: str, factory: Callable[[], SharedVectorStore]) -> SharedVectorStore:
+    """
+    获取进程内共享的向量存储，每个嵌入模型一个，首次调用时用 `factory` 创建
+
+    参数:
+        key (str): 存储的键，通常是嵌入模型名称
+        factory (Callable[[], SharedVectorStore]): 创建存储的函数
+
+    返回:
+        SharedVectorStore: 共享向量存储
+    """
+    with _shared_stores_lock:
+        if key not in _shared_stores:
+            _shared_stores[key] = factory()
+        return _shared_stores[key]